@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark lấy card trên listing của caoviet69:
+- cũ : locator + get_attribute cho từng card (nhiều round trip Playwright)
+- mới: 1 lần page.evaluate(caoviet69.CARDS_JS) + caoviet69.cards_from_raw
+
+In thời gian trung bình mỗi trang (ms) và kiểm tra 2 cách cho cùng kết quả.
+
+Usage:
+    python bench_caoviet69_listing.py --pages 1 2 --repeat 5
+    python bench_caoviet69_listing.py --html saved_listing.html --repeat 20
+"""
+
+import argparse
+import statistics
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+from playwright.sync_api import sync_playwright
+
+import caoviet69
+
+
+# ---- bản cũ (locator từng thuộc tính), giữ lại chỉ để so sánh ----
+def _legacy_best_img_src(a_tag) -> Optional[str]:
+    img = a_tag.locator("img").first
+    if img.count() == 0:
+        return None
+    for attr in ["srcset", "data-srcset"]:
+        try:
+            val = img.get_attribute(attr)
+            if val:
+                best = caoviet69._best_from_srcset(val)
+                if best:
+                    return best
+        except Exception:
+            pass
+    for attr in ["src", "data-src", "data-lazy", "data-original"]:
+        try:
+            val = img.get_attribute(attr)
+            if val:
+                return val
+        except Exception:
+            pass
+    return None
+
+
+def legacy_gather_post_cards(page) -> List[Dict[str, str]]:
+    cards = []
+    for a in page.locator(caoviet69.LIST_SELECTOR).all():
+        try:
+            href = a.get_attribute("href")
+            if not href:
+                continue
+            img_src = _legacy_best_img_src(a)
+            if img_src:
+                img_src = urljoin(caoviet69.BASE, img_src)
+            cards.append({"href": urljoin(caoviet69.BASE, href), "thumb_url": img_src or ""})
+        except Exception:
+            continue
+    uniq, seen = [], set()
+    for c in cards:
+        key = (c["href"], c["thumb_url"])
+        if key not in seen:
+            uniq.append(c)
+            seen.add(key)
+    return uniq
+
+
+def batched_gather_post_cards(page) -> List[Dict[str, str]]:
+    # giống caoviet69.gather_post_cards_on_listing nhưng trên page của sync API
+    return caoviet69.cards_from_raw(page.evaluate(caoviet69.CARDS_JS, caoviet69.LIST_SELECTOR))
+
+
+def time_it(fn, page, repeat: int):
+    out, times = None, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(page)
+        times.append((time.perf_counter() - t0) * 1000)
+    return out, times
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, nargs="*", default=[1], help="Các trang listing cần đo")
+    ap.add_argument("--html", type=str, default="", help="Đo trên file HTML đã lưu thay vì trang thật")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        page = browser.new_page()
+
+        if args.html:
+            with open(args.html, "r", encoding="utf-8") as f:
+                sources = [(args.html, f.read())]
+        else:
+            sources = [(f"{caoviet69.BASE}/page/{n}/" if n > 1 else caoviet69.BASE, None) for n in args.pages]
+
+        old_all, new_all = [], []
+        for label, html in sources:
+            if html is None:
+                page.goto(label, wait_until="domcontentloaded", timeout=caoviet69.LIST_TIMEOUT_MS)
+            else:
+                page.set_content(html)
+
+            old, t_old = time_it(legacy_gather_post_cards, page, args.repeat)
+            new, t_new = time_it(batched_gather_post_cards, page, args.repeat)
+            old_all += t_old
+            new_all += t_new
+            same = "OK" if old == new else "KHÁC"
+            print(f"{label}: {len(new)} card | cũ {statistics.mean(t_old):8.1f} ms"
+                  f" | mới {statistics.mean(t_new):8.1f} ms | kết quả {same}")
+
+        if old_all and new_all:
+            m_old, m_new = statistics.mean(old_all), statistics.mean(new_all)
+            print(f"\nTrung bình mỗi trang: cũ {m_old:.1f} ms, mới {m_new:.1f} ms"
+                  f" (x{m_old / max(m_new, 1e-6):.1f})")
+
+        browser.close()
+
+
+if __name__ == "__main__":
+    main()
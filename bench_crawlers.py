@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark crawler offline: dựng 1 site giả trên 127.0.0.1 từ HTML mẫu (bench_fixtures/) + media tổng hợp,
+chạy crawler thật trên đó và in posts/s, MB/s, độ trễ từng stage (để thấy ngay khi code chậm đi).
+
+Site giả phục vụ:
+- quatvn     : /quatvn/, /quatvn/page/N/  (listing), /quatvn/<slug>/ (flowplayer[data-item] → mp4)
+- fullcliphot: /fullcliphot/..., /xfast/<slug>/note.txt + segment PNG (payload nằm sau IEND)
+- blogger    : /blogger/video.g?token=<id> (VIDEO_CONFIG inline) → /media/<id>.mp4
+Media hỗ trợ Range (tiếp tục / nhiều kết nối). Có ffmpeg thì media là MP4 fragmented thật
+(testsrc), không có thì là byte ngẫu nhiên (fullcliphot cần ffmpeg để ghép nên sẽ bị bỏ qua).
+
+fullcliphot: Chrome được thay bằng resolver HTTP (đọc thẳng note.txt), chỉ đo phần tải/ghép.
+
+Usage:
+    python bench_crawlers.py                       # quatvn + fullcliphot, 2 trang mỗi site
+    python bench_crawlers.py --sites quatvn blogger --pages 3 --media_mb 8 --latency_ms 20
+    python bench_crawlers.py --sites quatvn --engine sync --connections 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import scheduler
+from result_store import ResultStore
+
+PNG_SIG = b'\x89PNG\r\n\x1a\n'
+
+
+# ---------- Media tổng hợp ----------
+def make_media(size: int, ffmpeg: str | None) -> bytes:
+    """MP4 fragmented thật (ghép stream được) nếu có ffmpeg, ngược lại byte ngẫu nhiên."""
+    if ffmpeg:
+        # bitrate cố định để dung lượng ~ size
+        secs = 10
+        kbps = max(100, size * 8 // 1000 // secs)
+        cmd = [ffmpeg, "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=25:duration={secs}",
+               "-c:v", "libx264", "-preset", "ultrafast", "-b:v", f"{kbps}k", "-maxrate", f"{kbps}k",
+               "-bufsize", f"{kbps}k", "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+               "-f", "mp4", "pipe:1"]
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode == 0 and p.stdout:
+            return p.stdout
+        print(f"! ffmpeg không tạo được media ({p.stderr.decode(errors='replace')[:200]}) → dùng byte ngẫu nhiên")
+    return os.urandom(size)
+
+
+def _png_chunk(typ: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + typ + data + struct.pack(">I", zlib.crc32(typ + data))
+
+
+def wrap_png(payload: bytes) -> bytes:
+    """PNG 1x1 hợp lệ, payload gắn sau IEND (như segment của xfast)."""
+    ihdr = struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0)
+    return PNG_SIG + _png_chunk(b"IHDR", ihdr) + _png_chunk(b"IEND", b"") + payload
+
+
+# ---------- Site giả ----------
+class FakeSite:
+    """Nội dung site giả; mọi URL trong HTML mẫu được đổi sang base local."""
+
+    def __init__(self, fixtures: Path, media: bytes, segments: int, latency_ms: int = 0):
+        self.fx = {p.stem: p.read_text(encoding="utf-8") for p in fixtures.glob("*.html")}
+        self.media = media
+        self.latency = latency_ms / 1000
+        step = -(-len(media) // max(1, segments))
+        self.segs = [wrap_png(media[i:i + step]) for i in range(0, len(media), step)]
+        self.thumb = wrap_png(b"")  # thumbnail chỉ cần là ảnh nhỏ
+        self.base = ""
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def _local(self, html: str) -> str:
+        return (html.replace("https://cdn.quatvn.love", f"{self.base}/quatvn-cdn")
+                    .replace("https://quatvn.love", f"{self.base}/quatvn")
+                    .replace("https://fullcliphot.org", f"{self.base}/fullcliphot"))
+
+    def route(self, path: str, query: dict):
+        """Trả về (content_type, body) hoặc None (404)."""
+        m = re.match(r"^/(quatvn|fullcliphot)(?:/|/page/(\d+)/)?$", path)
+        if m:
+            site, page_no = m.group(1), int(m.group(2) or 1)
+            html = self._local(self.fx.get(f"{site}_listing", ""))
+            # slug khác nhau cho mỗi trang để seen index không bỏ qua
+            html = re.sub(r"/(clip|phim)-(\d+)", rf"/p{page_no}-\1-\2", html)
+            return "text/html; charset=utf-8", html.encode("utf-8")
+
+        m = re.match(r"^/quatvn/([\w-]+)/$", path)
+        if m:
+            slug = m.group(1)
+            html = self.fx.get("quatvn_post", "").replace(
+                "https://cdn.quatvn.love/videos/clip-1001.mp4", f"{self.base}/media/{slug}.mp4")
+            return "text/html; charset=utf-8", self._local(html).encode("utf-8")
+
+        m = re.match(r"^/fullcliphot/([\w-]+)/$", path)
+        if m:
+            return "text/html; charset=utf-8", self._local(self.fx.get("fullcliphot_post", "")).encode("utf-8")
+
+        m = re.match(r"^/xfast/([\w-]+)/note\.txt$", path)
+        if m:
+            lines = ["#EXTM3U"] + [f"{self.base}/xfast/{m.group(1)}/seg_{i:05d}.png"
+                                   for i in range(1, len(self.segs) + 1)]
+            return "text/plain", "\n".join(lines).encode("ascii")
+
+        m = re.match(r"^/xfast/[\w-]+/seg_(\d+)\.png$", path)
+        if m and 1 <= int(m.group(1)) <= len(self.segs):
+            return "image/png", self.segs[int(m.group(1)) - 1]
+
+        if path.startswith("/blogger/video.g"):
+            token = (query.get("token") or ["x"])[0]
+            cfg = {"streams": [{"play_url": f"{self.base}/media/{token}-360.mp4", "format_id": 18},
+                               {"play_url": f"{self.base}/media/{token}-720.mp4", "format_id": 22}]}
+            html = f"<html><body><script>var VIDEO_CONFIG = {json.dumps(cfg)};</script></body></html>"
+            return "text/html; charset=utf-8", html.encode("utf-8")
+
+        if path.startswith("/media/") and path.endswith(".mp4"):
+            return "video/mp4", self.media
+
+        if path.endswith((".jpg", ".jpeg", ".png", ".webp")):
+            return "image/png", self.thumb
+        return None
+
+    def handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *a):
+                pass
+
+            def do_GET(self):
+                sp = urlsplit(self.path)
+                if site.latency:
+                    time.sleep(site.latency)
+                found = site.route(sp.path, parse_qs(sp.query))
+                if found is None:
+                    self.send_error(404)
+                    return
+                ctype, body = found
+                status, start, end = 200, 0, len(body) - 1
+                m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), end) if m.group(2) else end
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+                self.end_headers()
+                try:
+                    self.wfile.write(memoryview(body)[start:end + 1])
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                with site._lock:
+                    site.requests += 1
+                    site.bytes_sent += end - start + 1
+
+        return Handler
+
+    def serve(self):
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{httpd.server_address[1]}"
+        threading.Thread(target=httpd.serve_forever, name="fake-site", daemon=True).start()
+        return httpd
+
+
+# ---------- Đo từng stage ----------
+class StageTimer:
+    """Bọc hàm của module crawler để ghi thời gian + số byte theo stage; unpatch() trả lại như cũ."""
+
+    def __init__(self):
+        self.times: dict[str, list[float]] = {}
+        self.bytes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._undo = []
+
+    def record(self, stage: str, secs: float, nbytes: int = 0):
+        with self._lock:
+            self.times.setdefault(stage, []).append(secs)
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+
+    def patch(self, owner, name: str, value):
+        self._undo.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def wrap(self, owner, name: str, stage, out_file=None):
+        """stage: tên cố định hoặc hàm(*args, **kwargs) -> tên. out_file(args, kwargs, ret) -> Path để đếm byte."""
+        fn = getattr(owner, name)
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            ret = fn(*args, **kwargs)
+            n = 0
+            if out_file is not None:
+                p = out_file(args, kwargs, ret)
+                try:
+                    n = Path(p).stat().st_size if p and Path(p).is_file() else 0
+                except OSError:
+                    n = 0
+            label = stage(*args, **kwargs) if callable(stage) else stage
+            self.record(label, time.perf_counter() - t0, n)
+            return ret
+
+        self.patch(owner, name, timed)
+
+    def unpatch(self):
+        for owner, name, fn in reversed(self._undo):
+            setattr(owner, name, fn)
+        self._undo.clear()
+
+    def report(self):
+        print(f"  {'stage':<14}{'n':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'MB':>9}")
+        for stage, ts in self.times.items():
+            ms = sorted(t * 1000 for t in ts)
+            p95 = ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))]
+            print(f"  {stage:<14}{len(ms):>6}{statistics.mean(ms):>10.1f}{statistics.median(ms):>10.1f}"
+                  f"{p95:>10.1f}{ms[-1]:>10.1f}{self.bytes.get(stage, 0) / 1e6:>9.1f}")
+
+
+def _dir_bytes(p: Path) -> int:
+    return sum(f.stat().st_size for f in p.rglob("*") if f.is_file()) if p.exists() else 0
+
+
+def _crawl_args(work: Path, args, **extra):
+    return SimpleNamespace(start=1, end=args.pages, out=str(work / "out"), excel=str(work / "ketqua.xlsx"),
+                           seen_index=str(work / "seen_index.txt"), until_seen=False, **extra)
+
+
+# ---------- Từng site ----------
+def bench_quatvn(site: FakeSite, work: Path, args, timer: StageTimer):
+    import asyncio
+    import craw_quatvn as q
+
+    timer.patch(q, "BASE", f"{site.base}/quatvn")
+    timer.wrap(q, "get_html", lambda url, sess: "listing" if url == q.BASE or "/page/" in url else "post_html")
+    timer.wrap(q, "parse_post", "parse")
+    timer.wrap(q, "save_file", lambda url, out, sess, referer=None, **kw: "video" if referer else "thumb",
+               out_file=lambda a, kw, ret: a[1])
+    timer.wrap(ResultStore, "append", "write")
+
+    # giới hạn mỗi host của engine async = suất per-host của scheduler
+    scheduler.configure(per_host=args.per_host)
+    cargs = _crawl_args(work, args, engine=args.engine, resolve_workers=4,
+                        thumb_workers=2, video_workers=3, queue_size=24, connections=args.connections)
+    if args.engine == "async":
+        asyncio.run(q.crawl_async(cargs))
+    else:
+        q.crawl(cargs)
+    return cargs
+
+
+class HttpResolver:
+    """Thay PlaylistResolver (Chrome) bằng HTTP: GET trang bài rồi trỏ thẳng note.txt của site giả."""
+
+    def __init__(self, base: str, timer: StageTimer, pages: int = 3, **_):
+        self.base = base
+        self.timer = timer
+        self._ex = ThreadPoolExecutor(max_workers=max(1, pages))
+
+    def _resolve(self, post_url: str):
+        import requests
+        t0 = time.perf_counter()
+        html = requests.get(post_url, timeout=30).text
+        slug = post_url.rstrip("/").rsplit("/", 1)[-1]
+        self.timer.record("resolve", time.perf_counter() - t0)
+        return f"{self.base}/xfast/{slug}/note.txt", f"{self.base}/xfast/watch/{slug}.html", html
+
+    def submit(self, post_url: str) -> Future:
+        return self._ex.submit(self._resolve, post_url)
+
+    def close(self):
+        self._ex.shutdown(wait=False, cancel_futures=True)
+
+
+def bench_fullcliphot(site: FakeSite, work: Path, args, timer: StageTimer):
+    import crawfullcliphot as f
+
+    if not args.ffmpeg:
+        print("! fullcliphot: không có ffmpeg (--ffmpeg) → bỏ qua")
+        return None
+    timer.patch(f, "BASE", f"{site.base}/fullcliphot")
+    timer.patch(f, "FFMPEG_CMD", args.ffmpeg)
+    timer.patch(f, "PlaylistResolver", lambda **kw: HttpResolver(site.base, timer, **kw))
+    timer.wrap(f, "get_html", "listing")
+    timer.wrap(f, "save_thumbnail", "thumb", out_file=lambda a, kw, ret: ret)
+    timer.wrap(f, "stream_segments_to_mp4", "segments+mux", out_file=lambda a, kw, ret: a[1])
+    timer.wrap(f, "parallel_download_segments", "segments")
+    timer.wrap(f, "ffmpeg_concat_m4s", "mux", out_file=lambda a, kw, ret: a[1])
+    timer.wrap(f, "get_post_meta", "parse")
+    timer.wrap(ResultStore, "append", "write")
+
+    cargs = _crawl_args(work, args, seg_workers=args.seg_workers, mux=args.mux, resume_segments=False, pw_pages=3,
+                        no_block=False)
+    f.crawl(cargs)
+    return cargs
+
+
+def bench_blogger(site: FakeSite, work: Path, args, timer: StageTimer):
+    """Chỉ đo đường HTTP (VIDEO_CONFIG inline → tải mp4); không ghi Excel."""
+    import requests
+    try:
+        import download_video_bloger as b
+    except ImportError as e:
+        print(f"! blogger: thiếu thư viện ({e}) → bỏ qua")
+        return None
+
+    out = work / "out" / "videos"
+    out.mkdir(parents=True, exist_ok=True)
+    timer.wrap(b, "resolve_play_url_http", "resolve")
+    timer.wrap(b, "download_file", "video", out_file=lambda a, kw, ret: a[1])
+    urls = [f"{site.base}/blogger/video.g?token=bench{i:04d}" for i in range(args.pages * 12)]
+    rows = []
+
+    def one(i_url):
+        i, url = i_url
+        sess = requests.Session()
+        play = b.resolve_play_url_http(url, sess)
+        if play and b.download_file(play, str(out / f"{i:04d}.mp4"), 1):
+            rows.append(i)
+
+    with ThreadPoolExecutor(max_workers=b.MAX_WORKERS) as ex:
+        list(ex.map(one, enumerate(urls)))
+    return SimpleNamespace(out=str(work / "out"), n_rows=len(rows))
+
+
+SITES = {"quatvn": bench_quatvn, "fullcliphot": bench_fullcliphot, "blogger": bench_blogger}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sites", nargs="*", choices=list(SITES), default=["quatvn", "fullcliphot"])
+    ap.add_argument("--fixtures", type=str, default="bench_fixtures", help="Thư mục HTML mẫu")
+    ap.add_argument("--pages", type=int, default=2, help="Số trang listing mỗi site (12-20 bài/trang)")
+    ap.add_argument("--media_mb", type=float, default=4, help="Dung lượng mỗi video tổng hợp (MB)")
+    ap.add_argument("--segments", type=int, default=20, help="Số segment PNG mỗi video fullcliphot")
+    ap.add_argument("--latency_ms", type=int, default=0, help="Độ trễ giả lập cho mỗi request")
+    ap.add_argument("--engine", choices=("async", "sync"), default="async", help="Engine quatvn")
+    ap.add_argument("--per_host", type=int, default=4)
+    ap.add_argument("--connections", type=int, default=1)
+    ap.add_argument("--seg_workers", type=int, default=8)
+    ap.add_argument("--mux", choices=("stream", "files"), default="stream")
+    ap.add_argument("--ffmpeg", type=str, default=shutil.which("ffmpeg") or "", help="Đường dẫn ffmpeg")
+    ap.add_argument("--keep", action="store_true", help="Giữ thư mục làm việc tạm để kiểm tra")
+    args = ap.parse_args()
+    if args.ffmpeg and os.path.exists(args.ffmpeg):
+        args.ffmpeg = os.path.abspath(args.ffmpeg)  # cwd đổi sang thư mục log bên dưới
+
+    media = make_media(int(args.media_mb * 1024 * 1024), args.ffmpeg or None)
+    site = FakeSite(Path(args.fixtures), media, args.segments, args.latency_ms)
+    httpd = site.serve()
+    print(f"Site giả: {site.base} | media {len(media) / 1e6:.1f} MB"
+          f" (sha1 {hashlib.sha1(media).hexdigest()[:8]}) | {len(site.segs)} segment/video\n")
+
+    # crawler tạo FileHandler(LOG_FILE tương đối) ngay khi import → chạy trong thư mục tạm để log không rơi vào repo
+    log_dir = Path(tempfile.mkdtemp(prefix="bench_logs_"))
+    cwd = os.getcwd()
+    summary = []
+    for name in args.sites:
+        work = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+        timer = StageTimer()
+        t0 = time.perf_counter()
+        os.chdir(log_dir)
+        try:
+            cargs = SITES[name](site, work, args, timer)
+        finally:
+            os.chdir(cwd)
+            timer.unpatch()
+        wall = time.perf_counter() - t0
+        if cargs is None:
+            continue
+
+        n_rows = getattr(cargs, "n_rows", len(timer.times.get("write", [])))
+        mb = _dir_bytes(Path(cargs.out) / "videos") / 1e6
+        summary.append((name, n_rows, wall, mb))
+        print(f"\n== {name}: {n_rows} bài trong {wall:.2f}s → {n_rows / wall:.2f} posts/s, {mb / wall:.1f} MB/s")
+        timer.report()
+        if args.keep:
+            print(f"  (giữ thư mục: {work})")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    httpd.shutdown()
+    print(f"\nServer: {site.requests} request, {site.bytes_sent / 1e6:.1f} MB đã gửi | log crawler: {log_dir}")
+    if summary:
+        print(json.dumps([{"site": s, "posts": n, "seconds": round(w, 3), "posts_per_s": round(n / w, 3),
+                           "mb_per_s": round(mb / w, 2)} for s, n, w, mb in summary], ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
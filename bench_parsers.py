@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark parse HTML trên các fixture đã lưu (bench_fixtures/):
+- cũ : BeautifulSoup "html.parser", trang bài parse 2 lần (media + meta)
+- mới: BeautifulSoup HTML_PARSER (lxml nếu có), trang bài parse 1 lần (craw_quatvn.parse_post)
+
+In thời gian trung bình mỗi trang (ms) và kiểm tra 2 cách cho cùng kết quả.
+
+Usage:
+    python bench_parsers.py --repeat 200
+    python bench_parsers.py --fixtures bench_fixtures --repeat 50
+"""
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import craw_quatvn
+import crawfullcliphot
+
+
+def time_it(fn, html: str, repeat: int):
+    out, times = None, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(html)
+        times.append((time.perf_counter() - t0) * 1000)
+    return out, times
+
+
+def _with_parser(mod, parser: str, fn):
+    """Chạy fn với mod.HTML_PARSER tạm đổi sang parser khác."""
+    def run(html):
+        old = mod.HTML_PARSER
+        mod.HTML_PARSER = parser
+        try:
+            return fn(html)
+        finally:
+            mod.HTML_PARSER = old
+    return run
+
+
+# ---- quatvn ----
+def quatvn_post_old(html):
+    # bản cũ: 2 lần parse html.parser
+    media_url, kind = craw_quatvn._media_from_soup(BeautifulSoup(html, "html.parser"))
+    title, tags = craw_quatvn._meta_from_soup(BeautifulSoup(html, "html.parser"))
+    return {"media_url": media_url, "kind": kind, "title": title, "tags": tags}
+
+
+CASES = [
+    # (fixture, tên, hàm cũ, hàm mới)
+    ("quatvn_listing.html", "quatvn listing",
+     _with_parser(craw_quatvn, "html.parser", craw_quatvn.list_posts), craw_quatvn.list_posts),
+    ("quatvn_post.html", "quatvn post",
+     quatvn_post_old, craw_quatvn.parse_post),
+    ("fullcliphot_listing.html", "fullcliphot listing",
+     _with_parser(crawfullcliphot, "html.parser", crawfullcliphot.list_posts), crawfullcliphot.list_posts),
+    ("fullcliphot_post.html", "fullcliphot post",
+     _with_parser(crawfullcliphot, "html.parser", crawfullcliphot.get_post_meta), crawfullcliphot.get_post_meta),
+]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fixtures", type=str, default="bench_fixtures", help="Thư mục chứa HTML đã lưu")
+    ap.add_argument("--repeat", type=int, default=100)
+    args = ap.parse_args()
+
+    root = Path(args.fixtures)
+    print(f"Parser mới: {craw_quatvn.HTML_PARSER}\n")
+
+    old_all, new_all = [], []
+    for fname, label, old_fn, new_fn in CASES:
+        path = root / fname
+        if not path.exists():
+            print(f"{label}: thiếu {path} → bỏ qua")
+            continue
+        html = path.read_text(encoding="utf-8")
+        old, t_old = time_it(old_fn, html, args.repeat)
+        new, t_new = time_it(new_fn, html, args.repeat)
+        old_all.append(statistics.mean(t_old))
+        new_all.append(statistics.mean(t_new))
+        same = "OK" if old == new else "KHÁC"
+        print(f"{label:22s}: cũ {statistics.mean(t_old):7.2f} ms | mới {statistics.mean(t_new):7.2f} ms"
+              f" | kết quả {same}")
+
+    if old_all and new_all:
+        m_old, m_new = sum(old_all), sum(new_all)
+        print(f"\nTổng mỗi lượt: cũ {m_old:.2f} ms, mới {m_new:.2f} ms (x{m_old / max(m_new, 1e-6):.1f})")
+
+
+if __name__ == "__main__":
+    main()
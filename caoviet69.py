@@ -1,11 +1,16 @@
+import asyncio
 import csv
+import json
 import re
-import time
 from pathlib import Path
 from typing import List, Dict, Optional
 from urllib.parse import urljoin
 
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
+from playwright.async_api import async_playwright, TimeoutError as PWTimeoutError
+
+import metrics
+from route_filter import DEFAULT_BLOCK_HOSTS, RouteFilter
+from seen_index import SeenIndex
 
 BASE = "https://viet69.nu"
 LIST_SELECTOR = "a.clip-link"
@@ -20,96 +25,90 @@ LIST_TIMEOUT_MS = 25000
 WAIT_MEDIA_SECS = 25    # thời gian tối đa đợi request get-video
 OUT_CSV = "viet69_scrape.csv"
 HEADLESS = True
+TABS = 4                # số tab xử lý bài song song trong cùng context
+SEEN_INDEX_FILE = "viet69_seen.txt"  # URL bài/video đã lấy (lần đầu tự nạp từ OUT_CSV)
+UNTIL_SEEN = False      # True: dừng khi gặp trang mà mọi bài đều đã lấy
+BLOCK_TYPES = ("image", "font", "media")  # tài nguyên không cần để bắt get-video; () = không chặn theo loại
+BLOCK_ADS = True        # chặn quảng cáo / analytics (DEFAULT_BLOCK_HOSTS trong route_filter.py)
+METRICS_FILE = "viet69.metrics.json"  # số liệu theo stage, ghi lại mỗi METRICS_INTERVAL giây ("" = tắt)
+METRICS_INTERVAL = 10
 # ===================
 
-def get_video_url_with_retries(page, url: str, max_tries: int = 3, delay_between: float = 1.5) -> Optional[str]:
+async def get_video_url_with_retries(page, url: str, max_tries: int = 3, delay_between: float = 1.5) -> Optional[str]:
     for attempt in range(1, max_tries + 1):
-        video_url = capture_video_url_while_loading(page, url)
+        if attempt > 1:
+            metrics.incr("video_url", "retries")
+        with metrics.timer("video_url"):
+            video_url = await capture_video_url_while_loading(page, url)
         if video_url:
             if attempt > 1:
-                print(f"     • Lấy được URL sau lần thử {attempt}.")
+                print(f"     • [{url}] Lấy được URL sau lần thử {attempt}.")
             return video_url
         if attempt < max_tries:
-            print(f"     • Không thấy URL, thử lại ({attempt}/{max_tries})…")
-            try:
-                page.reload(wait_until="domcontentloaded", timeout=LIST_TIMEOUT_MS)
-            except Exception:
-                try:
-                    page.goto(url, wait_until="domcontentloaded", timeout=LIST_TIMEOUT_MS)
-                except Exception:
-                    pass
-            time.sleep(delay_between)
+            print(f"     • [{url}] Không thấy URL, thử lại ({attempt}/{max_tries})…")
+            await asyncio.sleep(delay_between)
     return None
 
-def extract_title(page) -> str:
+async def extract_title(page) -> str:
     for sel in TITLE_SELECTORS:
         loc = page.locator(sel)
-        if loc.count():
+        if await loc.count():
             try:
-                t = loc.first.inner_text().strip()
+                t = (await loc.first.inner_text()).strip()
                 if t:
                     return t
             except Exception:
                 pass
     try:
-        return page.title().strip()
+        return (await page.title()).strip()
     except Exception:
         return ""
 
-def extract_tags(page) -> List[str]:
+async def extract_tags(page) -> List[str]:
     tags = []
     try:
         cont = page.locator(TAGS_CONTAINER)
-        if cont.count():
-            tags = [a.inner_text().strip() for a in cont.first.locator('a[rel="tag"]').all()]
+        if await cont.count():
+            tags = [(await a.inner_text()).strip()
+                    for a in await cont.first.locator('a[rel="tag"]').all()]
     except Exception:
         pass
     return tags
 
-def capture_video_url_while_loading(page, target_url: str) -> Optional[str]:
-    import json, time, re
-    context = page.context
-    captured = {"url": None}
-    VIDEO_API_RE = re.compile(r"https://emb\.cd-vs\.com/api/get-video\?")
-
-    def on_response(resp):
-        try:
-            if VIDEO_API_RE.match(resp.url) and resp.status == 200 and not captured["url"]:
-                try:
-                    data = resp.json()
-                except Exception:
-                    data = json.loads(resp.text())
-                captured["url"] = data.get("url")
-        except Exception:
-            pass
+def _is_video_api_response(resp) -> bool:
+    return bool(VIDEO_API_RE.match(resp.url)) and resp.status == 200
 
-    context.on("response", on_response)
+async def capture_video_url_while_loading(page, target_url: str) -> Optional[str]:
+    """
+    Mở trang và trả về ngay khi response get-video của chính tab này về tới
+    (không polling); None nếu quá WAIT_MEDIA_SECS hoặc lỗi điều hướng.
+    """
     try:
-        page.goto(target_url, wait_until="domcontentloaded", timeout=25000)
-        t0 = time.time()
-        while time.time() - t0 < 25:
-            if captured["url"]:
-                break
+        async with page.expect_response(_is_video_api_response,
+                                        timeout=WAIT_MEDIA_SECS * 1000) as resp_info:
+            await page.goto(target_url, wait_until="domcontentloaded", timeout=LIST_TIMEOUT_MS)
             try:
-                page.mouse.wheel(0, 600)  # kích lazy-load nếu có
-            except Exception:
-                pass
-            time.sleep(0.3)
-    finally:
-        if hasattr(context, "remove_listener"):
-            context.remove_listener("response", on_response)
-        else:
-            try:
-                page.remove_listener("response", on_response)
+                await page.mouse.wheel(0, 600)  # kích lazy-load nếu có
             except Exception:
                 pass
+        resp = await resp_info.value
+    except Exception:
+        return None
 
-    return captured["url"]
+    try:
+        data = await resp.json()
+    except Exception:
+        try:
+            data = json.loads(await resp.text())
+        except Exception:
+            return None
+    return data.get("url") if isinstance(data, dict) else None
 
-def process_post(page, url, thumb_url) -> Dict:
-    video_url = get_video_url_with_retries(page, url, max_tries=3, delay_between=1.5)
-    title = extract_title(page)
-    tags = extract_tags(page)
+async def process_post(page, url, thumb_url) -> Dict:
+    video_url = await get_video_url_with_retries(page, url, max_tries=3, delay_between=1.5)
+    with metrics.timer("meta"):
+        title = await extract_title(page)
+        tags = await extract_tags(page)
     return {
         "post_url": url,
         "thumb_url": thumb_url or "",
@@ -118,63 +117,74 @@ def process_post(page, url, thumb_url) -> Dict:
         "tags": ", ".join(tags),
     }
 
-def _get_best_img_src(a_tag) -> Optional[str]:
+# Lấy toàn bộ card trong 1 lần page.evaluate (thay vì vài get_attribute/locator cho mỗi card)
+CARDS_JS = """
+(sel) => Array.from(document.querySelectorAll(sel)).map(a => {
+  const img = a.querySelector('img');
+  const attrs = {};
+  if (img) {
+    for (const k of ['srcset', 'data-srcset', 'src', 'data-src', 'data-lazy', 'data-original']) {
+      attrs[k] = img.getAttribute(k);
+    }
+  }
+  return { href: a.getAttribute('href'), img: img ? attrs : null };
+})
+"""
+
+def _best_from_srcset(val: str) -> Optional[str]:
+    """Chọn URL có độ rộng lớn nhất trong srcset (dạng: https://... 500w, ...)."""
+    parts = [p.strip() for p in val.split(",")]
+    best = None
+    best_w = -1
+    for p in parts:
+        bits = p.split()
+        if not bits:
+            continue
+        url = bits[0]
+        w = -1
+        if len(bits) > 1 and bits[1].endswith("w"):
+            try:
+                w = int(bits[1][:-1])
+            except ValueError:
+                pass
+        if w > best_w:
+            best_w = w
+            best = url
+    return best
+
+def _get_best_img_src(img_attrs: Optional[Dict[str, Optional[str]]]) -> Optional[str]:
     """Ưu tiên srcset (nếu có), rồi tới src, rồi data-src/data-lazy."""
-    img = a_tag.locator("img").first
-    if img.count() == 0:
+    if not img_attrs:
         return None
     for attr in ["srcset", "data-srcset"]:
-        try:
-            val = img.get_attribute(attr)
-            if val:
-                # chọn URL có độ rộng lớn nhất trong srcset
-                parts = [p.strip() for p in val.split(",")]
-                best = None
-                best_w = -1
-                for p in parts:
-                    # dạng: https://... 500w
-                    bits = p.split()
-                    if not bits:
-                        continue
-                    url = bits[0]
-                    w = -1
-                    if len(bits) > 1 and bits[1].endswith("w"):
-                        try:
-                            w = int(bits[1][:-1])
-                        except:
-                            pass
-                    if w > best_w:
-                        best_w = w
-                        best = url
-                if best:
-                    return best
-        except Exception:
-            pass
+        val = img_attrs.get(attr)
+        if val:
+            best = _best_from_srcset(val)
+            if best:
+                return best
     for attr in ["src", "data-src", "data-lazy", "data-original"]:
-        try:
-            val = img.get_attribute(attr)
-            if val:
-                return val
-        except Exception:
-            pass
+        val = img_attrs.get(attr)
+        if val:
+            return val
     return None
 
-def gather_post_cards_on_listing(page) -> List[Dict[str, str]]:
+async def gather_post_cards_on_listing(page) -> List[Dict[str, str]]:
     """Trả về danh sách dict: {'href': ..., 'thumb_url': ...} theo thứ tự xuất hiện."""
+    return cards_from_raw(await page.evaluate(CARDS_JS, LIST_SELECTOR))
+
+def cards_from_raw(raw_cards: List[Dict]) -> List[Dict[str, str]]:
+    """Chuẩn hoá kết quả CARDS_JS: chọn ảnh tốt nhất, urljoin, loại trùng giữ thứ tự."""
     cards = []
-    for a in page.locator(LIST_SELECTOR).all():
-        try:
-            href = a.get_attribute("href")
-            if not href:
-                continue
-            # lấy ảnh ngay trên listing
-            img_src = _get_best_img_src(a)
-            if img_src:
-                img_src = urljoin(BASE, img_src)
-            href = urljoin(BASE, href)
-            cards.append({"href": href, "thumb_url": img_src or ""})
-        except Exception:
+    for raw in raw_cards:
+        href = raw.get("href")
+        if not href:
             continue
+        # lấy ảnh ngay trên listing
+        img_src = _get_best_img_src(raw.get("img"))
+        if img_src:
+            img_src = urljoin(BASE, img_src)
+        href = urljoin(BASE, href)
+        cards.append({"href": href, "thumb_url": img_src or ""})
 
     # loại trùng, giữ thứ tự
     uniq, seen = [], set()
@@ -185,48 +195,112 @@ def gather_post_cards_on_listing(page) -> List[Dict[str, str]]:
             seen.add(key)
     return uniq
 
-def run():
-    # thêm cột thumb_url
-    Path(OUT_CSV).write_text("post_url,thumb_url,title,video_url,tags\n", encoding="utf-8")
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=HEADLESS, args=["--lang=vi-VN"])
-        context = browser.new_context(
+def csv_post_urls(path) -> set:
+    """post_url các dòng đã có trong CSV."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return {row["post_url"] for row in csv.DictReader(f) if row.get("post_url")}
+
+async def run_async():
+    seen = SeenIndex(SEEN_INDEX_FILE, seed_from=OUT_CSV)
+    # thêm cột thumb_url; file đã có thì ghi nối (chỉ bài mới)
+    if not Path(OUT_CSV).exists():
+        Path(OUT_CSV).write_text("post_url,thumb_url,title,video_url,tags\n", encoding="utf-8")
+    # bài chưa có URL video không vào seen (lần sau thử lại) → chỉ ghi CSV lần đầu, không ghi trùng mỗi lần chạy
+    written = csv_post_urls(OUT_CSV)
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=HEADLESS, args=["--lang=vi-VN"])
+        context = await browser.new_context(
             user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                         "AppleWebKit/537.36 (KHTML, like Gecko) "
                         "Chrome/120 Safari/537.36"),
             ignore_https_errors=True,
         )
-        page = context.new_page()
-        writer = csv.DictWriter(
-            open(OUT_CSV, "a", encoding="utf-8", newline=""),
-            fieldnames=["post_url", "thumb_url", "title", "video_url", "tags"]
-        )
+        # ảnh listing chỉ cần thuộc tính src/srcset (đọc bằng CARDS_JS), không cần tải ảnh về
+        if BLOCK_TYPES or BLOCK_ADS:
+            await RouteFilter(BLOCK_TYPES, DEFAULT_BLOCK_HOSTS if BLOCK_ADS else (),
+                              allow=("cd-vs.com",)).install_async(context)
+        list_page = await context.new_page()
+
+        # pool tab dùng lại giữa các bài; mỗi bài mượn 1 tab rồi trả lại
+        tabs: asyncio.Queue = asyncio.Queue()
+        for _ in range(max(1, TABS)):
+            tabs.put_nowait(await context.new_page())
 
-        for page_no in range(START_PAGE, END_PAGE + 1):
-            list_url = f"{BASE}/page/{page_no}/" if page_no > 1 else BASE
-            print(f"=== Đang duyệt trang {page_no}: {list_url}")
-            page.goto(list_url, wait_until="domcontentloaded", timeout=LIST_TIMEOUT_MS)
-
-            post_cards = gather_post_cards_on_listing(page)
-            print(f" Tìm thấy {len(post_cards)} bài.")
-
-            for idx, card in enumerate(post_cards, 1):
-                link = card["href"]; thumb = card["thumb_url"]
-                print(f"  [{idx}/{len(post_cards)}] {link}")
-                if thumb:
-                    print(f"     • Ảnh (listing): {thumb}")
-                try:
-                    rec = process_post(page, link, thumb)
-                    print(f'     • Tiêu đề: {rec["title"]}')
-                    print(f'     • URL video (JSON): {rec["video_url"] or "(không thấy)"}')
-                    print(f'     • Tags: {rec["tags"]}')
-                    writer.writerow(rec)
-                except Exception as e:
-                    print(f"     ! Lỗi xử lý bài: {e}")
+        out = open(OUT_CSV, "a", encoding="utf-8", newline="")
+        writer = csv.DictWriter(out, fieldnames=["post_url", "thumb_url", "title", "video_url", "tags"])
+
+        async def handle(idx, total, card) -> Optional[Dict]:
+            link = card["href"]; thumb = card["thumb_url"]
+            tab = await tabs.get()
+            try:
+                with metrics.timer("post"):
+                    rec = await process_post(tab, link, thumb)
+            except Exception as e:
+                print(f"  [{idx}/{total}] {link}\n     ! Lỗi xử lý bài: {e}")
+                return None
+            finally:
+                tabs.put_nowait(tab)
+            lines = [f"  [{idx}/{total}] {link}"]
+            if thumb:
+                lines.append(f"     • Ảnh (listing): {thumb}")
+            lines.append(f'     • Tiêu đề: {rec["title"]}')
+            lines.append(f'     • URL video (JSON): {rec["video_url"] or "(không thấy)"}')
+            lines.append(f'     • Tags: {rec["tags"]}')
+            print("\n".join(lines))
+            return rec
+
+        try:
+            for page_no in range(START_PAGE, END_PAGE + 1):
+                list_url = f"{BASE}/page/{page_no}/" if page_no > 1 else BASE
+                print(f"=== Đang duyệt trang {page_no}: {list_url}")
+                with metrics.timer("listing"):
+                    await list_page.goto(list_url, wait_until="domcontentloaded", timeout=LIST_TIMEOUT_MS)
+                    post_cards = await gather_post_cards_on_listing(list_page)
+                print(f" Tìm thấy {len(post_cards)} bài.")
+                if UNTIL_SEEN and seen.all_seen(c["href"] for c in post_cards):
+                    print(" Mọi bài trên trang này đã lấy trước đó → dừng.")
+                    break
+                n_all = len(post_cards)
+                post_cards = [c for c in post_cards if c["href"] not in seen]
+                metrics.incr("post", "skipped", n_all - len(post_cards))
+                print(f" Còn {len(post_cards)} bài mới.")
+
+                # các bài của trang chạy song song (tối đa TABS), ghi CSV theo thứ tự trên listing
+                recs = await asyncio.gather(*(handle(i, len(post_cards), c)
+                                              for i, c in enumerate(post_cards, 1)))
+                for rec in recs:
+                    if not rec:
+                        metrics.incr("post", "failures")
+                        continue
+                    if rec["video_url"] and rec["video_url"] in seen:
+                        metrics.incr("post", "skipped")
+                        seen.add(rec["post_url"])
+                        continue
+                    metrics.incr("post", "done" if rec["video_url"] else "no_video")
+                    if not rec["video_url"] and rec["post_url"] in written:
+                        continue
+                    with metrics.timer("write"):
+                        writer.writerow(rec)
+                    written.add(rec["post_url"])
+                    # bài chưa lấy được URL video thì để lần sau thử lại
+                    if rec["video_url"]:
+                        seen.add(rec["post_url"])
+                        seen.add(rec["video_url"], kind="video_url")
+                out.flush()
+        finally:
+            out.close()
+            seen.close()
 
         print(f"\n✅ Xong. Kết quả lưu ở: {OUT_CSV}")
-        context.close()
-        browser.close()
+        await context.close()
+        await browser.close()
+
+def run():
+    metrics.start(METRICS_FILE, METRICS_INTERVAL, name="viet69")
+    try:
+        asyncio.run(run_async())
+    finally:
+        print("[metrics] " + json.dumps(metrics.finish(), ensure_ascii=False))
 
 if __name__ == "__main__":
     run()
@@ -7,29 +7,37 @@ Crawl quatvn.love:
 - Vào trang bài, đọc flowplayer[data-item] để lấy link media:
     + Nếu .mp4 => dùng trực tiếp
     + Nếu .m3u8 => tự map sang .mp4 (…/stream/<NAME>/output.m3u8 -> …/stream/<NAME>.mp4)
-- Tải video (đặt Referer là trang bài), đặt tên file ngẫu nhiên .mp4.
+- Tải video (đặt Referer là trang bài), tên file .mp4 = hash của URL media (chạy lại thì tải tiếp .part cũ).
 - Ghi Excel: page, post_url, title, thumb_url, thumb_path, video_url, video_name, tags.
+  (từng dòng vào journal ketqua.pending.<pid>.jsonl, cuối lượt gộp vào Excel 1 lần — xem result_store.py)
 
 Usage:
     python crawl_quatvn.py --start 1 --end 3 --out luuvideo --excel ketqua.xlsx
+    python crawl_quatvn.py --start 1 --end 200 --engine async --host_downloads 6 --video_workers 4
 """
 
 from __future__ import annotations
 import argparse
+import asyncio
 import logging
 import os
-import random
 import re
-import string
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 from urllib.parse import urlparse, urlsplit, urlunsplit
 
 import html as ihtml
 import json
-import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter, Retry
+
+import downloader
+import metrics
+import ratecontrol
+import scheduler
+from result_store import ResultStore
+from seen_index import SeenIndex
 
 # ============ Config ============
 BASE = "https://quatvn.love"
@@ -40,6 +48,13 @@ HEADERS = {
 LOG_FILE = "crawl_quatvn.log"
 # ================================
 
+# lxml nhanh hơn html.parser nhiều lần; chưa cài (pip install lxml) thì dùng html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -52,17 +67,9 @@ log = logging.getLogger("quatvn")
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
-def rand_name(min_len=20, max_len=40) -> str:
-    n = random.randint(min_len, max_len)
-    return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(n))
-
 def build_session() -> requests.Session:
-    sess = requests.Session()
-    retries = Retry(total=3, backoff_factor=0.5,
-                    status_forcelist=(429, 500, 502, 503, 504))
-    adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=retries)
-    sess.mount("http://", adapter)
-    sess.mount("https://", adapter)
+    # 429/503/timeout → tự giảm tốc theo host, tôn trọng Retry-After, tạm dừng host lỗi liên tục
+    sess = ratecontrol.mount(requests.Session(), pool_size=50)
     sess.headers.update(HEADERS)
     return sess
 
@@ -71,7 +78,12 @@ def get_html(url: str, sess: requests.Session) -> str:
     r.raise_for_status()
     return r.text
 
-def save_file(url: str, out_path: Path, sess: requests.Session, referer: str | None = None) -> None:
+def save_file(url: str, out_path: Path, sess: requests.Session, referer: str | None = None,
+              connections: int = 1) -> None:
+    """
+    Tải qua downloader: ghi .part, đứt mạng thì tiếp tục bằng Range, kiểm tra kích thước.
+    connections > 1: chia file thành nhiều khoảng byte tải song song (nếu server hỗ trợ Range).
+    """
     headers = dict(HEADERS)
     if referer:
         headers["Referer"] = referer
@@ -79,17 +91,14 @@ def save_file(url: str, out_path: Path, sess: requests.Session, referer: str | N
         if m:
             headers["Origin"] = m.group(1)
 
-    with sess.get(url, headers=headers, stream=True, timeout=120) as r:
-        r.raise_for_status()
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(1024 * 1024):
-                if chunk:
-                    f.write(chunk)
+    downloader.download_file(url, out_path, sess, headers=headers, timeout=120,
+                             connections=connections)
+    metrics.add_bytes("video" if referer else "thumb", out_path.stat().st_size)
 
 # ---------- Parsers ----------
 def list_posts(listing_html: str) -> list[dict]:
     """Trả về tối đa 12 item: {url, thumb, title}."""
-    soup = BeautifulSoup(listing_html, "html.parser")
+    soup = BeautifulSoup(listing_html, HTML_PARSER)
     items: list[dict] = []
     for li in soup.select(".g1-collection .g1-collection-items > li")[:12]:
         a = li.select_one(".entry-featured-media a.g1-frame[href]")
@@ -115,11 +124,7 @@ def m3u8_to_mp4(u: str) -> str:
     sp = sp._replace(path=new_path, query="", fragment="")
     return urlunsplit(sp)
 
-def extract_media_from_post_html(html: str) -> tuple[str | None, str | None]:
-    """
-    Đọc flowplayer[data-item] → trả về (media_url, kind) với kind in {"mp4","mp4_from_m3u8"}.
-    """
-    soup = BeautifulSoup(html, "html.parser")
+def _media_from_soup(soup) -> tuple[str | None, str | None]:
     fp = soup.select_one('div.flowplayer[data-item]')
     if not fp:
         return None, None
@@ -146,34 +151,28 @@ def extract_media_from_post_html(html: str) -> tuple[str | None, str | None]:
 
     return None, None
 
-def get_post_meta(html: str) -> tuple[str, list[str]]:
-    soup = BeautifulSoup(html, "html.parser")
+def _meta_from_soup(soup) -> tuple[str, list[str]]:
     h1 = soup.select_one("h1.entry-title, h1.g1-mega.entry-title")
     title = h1.get_text(strip=True) if h1 else ""
     tag_a = soup.select_one(".entry-categories a.entry-category")
     tags = [tag_a.get_text(strip=True)] if tag_a else []
     return title, tags
 
-# ---------- Excel ----------
-def excel_append_row(xlsx_path: Path, row: dict) -> None:
+def parse_post(html: str) -> dict:
+    """Parse trang bài 1 lần duy nhất → {media_url, kind, title, tags}."""
+    soup = BeautifulSoup(html, HTML_PARSER)
+    media_url, kind = _media_from_soup(soup)
+    title, tags = _meta_from_soup(soup)
+    return {"media_url": media_url, "kind": kind, "title": title, "tags": tags}
+
+def extract_media_from_post_html(html: str) -> tuple[str | None, str | None]:
     """
-    row: page, post_url, title, thumb_url, thumb_path, video_url, video_name, tags
+    Đọc flowplayer[data-item] → trả về (media_url, kind) với kind in {"mp4","mp4_from_m3u8"}.
     """
-    from openpyxl import Workbook, load_workbook
-
-    cols = ["page", "post_url", "title", "thumb_url", "thumb_path",
-            "video_url", "video_name", "tags"]
-
-    if not xlsx_path.exists():
-        wb = Workbook()
-        ws = wb.active
-        ws.append(cols)
-        wb.save(str(xlsx_path))
+    return _media_from_soup(BeautifulSoup(html, HTML_PARSER))
 
-    wb = load_workbook(str(xlsx_path))
-    ws = wb.active
-    ws.append([row.get(c, "") for c in cols])
-    wb.save(str(xlsx_path))
+def get_post_meta(html: str) -> tuple[str, list[str]]:
+    return _meta_from_soup(BeautifulSoup(html, HTML_PARSER))
 
 # ---------- Main crawl ----------
 def crawl(args) -> None:
@@ -185,7 +184,8 @@ def crawl(args) -> None:
     ensure_dir(thumb_dir)
     ensure_dir(video_dir)
 
-    all_rows: list[dict] = []
+    store = ResultStore(args.excel)
+    seen = SeenIndex(args.seen_index, seed_from=args.excel)
 
     for page_no in range(args.start, args.end + 1):
         page_url = BASE if page_no == 1 else f"{BASE}/page/{page_no}/"
@@ -196,7 +196,8 @@ def crawl(args) -> None:
         log.info(f"=== Listing page {page_no}: {page_url}")
 
         try:
-            listing_html = get_html(page_url, sess)
+            with metrics.timer("listing"):
+                listing_html = get_html(page_url, sess)
         except Exception as e:
             log.warning(f"Không tải được listing page {page_no}: {e}")
             continue
@@ -205,40 +206,60 @@ def crawl(args) -> None:
         if not posts:
             log.warning("Không tìm thấy bài nào trên trang này.")
             continue
+        if args.until_seen and seen.all_seen(p["url"] for p in posts):
+            log.info(f"==> Trang {page_no} đã crawl hết trước đó → dừng (--until_seen)")
+            break
 
         for idx, post in enumerate(posts, 1):
             log.info(f"\n[{page_no}.{idx}] {post['title']}")
+            if post["url"] in seen:
+                log.info("  - Đã có trong seen index → bỏ qua")
+                metrics.incr("post", "skipped")
+                continue
             try:
-                # 1) Lưu thumbnail
+                # 1) Mở trang bài -> lấy media
+                with metrics.timer("post_html"):
+                    post_html = get_html(post["url"], sess)
+                with metrics.timer("parse"):
+                    info = parse_post(post_html)
+                media_url = info["media_url"]
+                if not media_url:
+                    log.warning("✗ Không tìm thấy nguồn media")
+                    metrics.incr("post", "no_media")
+                    continue
+                if media_url in seen:
+                    log.info(f"  - Video đã tải trước đó ({media_url}) → bỏ qua")
+                    metrics.incr("post", "skipped")
+                    seen.add(post["url"])
+                    continue
+
+                # 2) Lưu thumbnail (sau khi chắc bài / video chưa lấy)
                 thumb_path = Path("")
                 if post["thumb"]:
                     try:
                         ext = os.path.splitext(urlparse(post["thumb"]).path)[1] or ".jpg"
-                        thumb_path = thumb_dir / (rand_name(10, 16) + ext)
-                        save_file(post["thumb"], thumb_path, sess)
+                        thumb_path = thumb_dir / downloader.stable_name(post["thumb"], ext)
+                        with metrics.timer("thumb"):
+                            save_file(post["thumb"], thumb_path, sess)
                     except Exception as e:
                         log.warning(f"  - Lỗi tải thumbnail: {e}")
                         thumb_path = Path("")
 
-                # 2) Mở trang bài -> lấy media
-                post_html = get_html(post["url"], sess)
-                media_url, kind = extract_media_from_post_html(post_html)
-                if not media_url:
-                    log.warning("✗ Không tìm thấy nguồn media")
-                    continue
-
                 # 3) Tải mp4
-                video_name = rand_name(20, 40) + ".mp4"
+                # tên theo URL → lần chạy sau tải tiếp .part còn dở
+                video_name = downloader.stable_name(media_url, ".mp4")
                 out_mp4 = video_dir / video_name
                 log.info(f"MP4 = {media_url}")
                 try:
-                    save_file(media_url, out_mp4, sess, referer=post["url"])
+                    with metrics.timer("video"):
+                        save_file(media_url, out_mp4, sess, referer=post["url"],
+                                  connections=args.connections)
                 except Exception as e:
                     log.warning(f"! Lỗi tải MP4: {e}")
                     continue
 
                 # 4) Meta & Excel
-                title, tags = get_post_meta(post_html)
+                title, tags = info["title"], info["tags"]
                 row = {
                     "page": page_no,
                     "post_url": post["url"],
@@ -249,8 +270,11 @@ def crawl(args) -> None:
                     "video_name": out_mp4.name,
                     "tags": ", ".join(tags),
                 }
-                excel_append_row(Path(args.excel), row)
-                all_rows.append(row)
+                with metrics.timer("write"):
+                    store.append(row)
+                seen.add(post["url"])
+                seen.add(media_url, kind="video_url")
+                metrics.incr("post", "done")
 
                 log.info(f"✓ DONE: {row['title']}")
                 log.info(f"   thumb: {row['thumb_path']}")
@@ -260,33 +284,253 @@ def crawl(args) -> None:
 
             except Exception as e:
                 log.warning(f"!! Lỗi bài [{post['url']}]: {e}")
-
-    # Gộp Excel nếu muốn (nếu đã có file, append đã xử lý ở trên — phần này chỉ log tổng kết)
-    excel_path = Path(args.excel).resolve()
-    if all_rows:
-        # đảm bảo file tồn tại (trong trường hợp không viết được ở trên vì lý do nào đó)
-        if not excel_path.exists():
-            pd.DataFrame(all_rows).to_excel(excel_path, index=False)
-        log.info(f"\n==> Đã ghi {len(all_rows)} dòng vào: {excel_path}")
+                metrics.incr("post", "failures")
+
+    seen.close()
+    _finish_excel(store)
+
+def _finish_excel(store: ResultStore) -> None:
+    """Gộp journal vào Excel một lần ở cuối lượt crawl."""
+    with metrics.timer("excel_export"):
+        n = store.export_xlsx()
+    excel_path = store.xlsx_path.resolve()
+    if n:
+        log.info(f"\n==> Đã ghi {n} dòng vào: {excel_path}")
     else:
-        # tạo file rỗng có header nếu chưa có
-        if not excel_path.exists():
-            from openpyxl import Workbook
-            wb = Workbook()
-            ws = wb.active
-            ws.append(["page", "post_url", "title", "thumb_url", "thumb_path",
-                       "video_url", "video_name", "tags"])
-            wb.save(str(excel_path))
         log.warning(f"\n==> Không có bản ghi mới. Excel: {excel_path}")
 
+# ---------- Async crawl ----------
+class HostLimiter:
+    """
+    Chạy request (requests.Session, blocking) trong thread pool cho engine async; asyncio chỉ lo điều phối.
+    Giới hạn mỗi host chỉ có 1 chỗ: suất per-host của scheduler (--host_downloads), tính theo từng kết nối:
+    - request trang (listing, trang bài) giữ 1 suất trong lúc chạy (download=False);
+    - tải file (download=True) không giữ thêm suất ở đây: downloader tự xin 1 suất cho mỗi kết nối,
+      kể cả từng khoảng byte khi --connections > 1.
+    ratecontrol chỉ giảm thêm bên dưới giới hạn này khi host bị 429 / lỗi.
+    stage: tên stage trong metrics; chỉ tính thời gian chạy thật, không tính lúc chờ suất.
+    """
+
+    def __init__(self, sched: scheduler.Scheduler):
+        self.sched = sched
+
+    def _call(self, url, download, stage, fn, args, kwargs):
+        with nullcontext() if download else self.sched.slot(url), \
+             metrics.timer(stage) if stage else nullcontext():
+            return fn(*args, **kwargs)
+
+    async def run(self, url: str, fn, *args, stage: str | None = None, download: bool = False, **kwargs):
+        return await asyncio.to_thread(self._call, url, download, stage, fn, args, kwargs)
+
+_STOP = object()  # sentinel báo stage phía trước đã hết việc
+
+async def run_stage(name: str, workers: int, q_in: asyncio.Queue, fn,
+                    q_out: asyncio.Queue | None = None, out_workers: int = 0) -> None:
+    """
+    Chạy `workers` worker lấy item từ q_in, gọi fn(item); kết quả khác None được đẩy sang q_out
+    (queue có giới hạn → stage sau chậm thì stage trước tự chờ). Khi mọi worker gặp _STOP,
+    gửi out_workers sentinel cho stage sau.
+    """
+    async def worker():
+        while True:
+            item = await q_in.get()
+            if item is _STOP:
+                return
+            try:
+                out = await fn(item)
+            except Exception as e:
+                log.warning(f"!! [{name}] Lỗi bài [{item['post']['url']}]: {e}")
+                metrics.incr("post", "failures")
+                continue
+            if out is not None and q_out is not None:
+                await q_out.put(out)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if q_out is not None:
+        for _ in range(out_workers):
+            await q_out.put(_STOP)
+
+async def crawl_async(args) -> None:
+    """
+    Pipeline nhiều stage, nối bằng queue có giới hạn (--queue_size):
+        discovery (listing) → resolve (trang bài + media + meta) → thumbnail → video → ghi kết quả
+    Mỗi stage có số worker riêng; metadata chạy trước trong khi các luồng tải video luôn bận.
+    Mỗi host tối đa args.host_downloads kết nối cùng lúc (xem HostLimiter). Thứ tự dòng Excel = thứ tự tải xong.
+    """
+    for name in ("resolve_workers", "thumb_workers", "video_workers", "queue_size"):
+        setattr(args, name, max(1, getattr(args, name)))
+    sess = build_session()
+    limiter = HostLimiter(scheduler.get())
+    loop = asyncio.get_running_loop()
+    # đủ thread cho mọi worker đang chạy I/O cùng lúc (mỗi worker chờ suất ngay trong thread của nó)
+    n_threads = args.resolve_workers + args.thumb_workers + args.video_workers + 1
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=n_threads))
+
+    out_root = Path(args.out).resolve()
+    thumb_dir = out_root / "thumbs"
+    video_dir = out_root / "videos"
+    ensure_dir(thumb_dir)
+    ensure_dir(video_dir)
+
+    store = ResultStore(args.excel)
+    seen = SeenIndex(args.seen_index, seed_from=args.excel)
+
+    q_resolve: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    q_thumb: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    q_video: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    q_write: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+
+    # ---- stage 1: discovery ----
+    async def discover() -> None:
+        try:
+            for page_no in range(args.start, args.end + 1):
+                page_url = BASE if page_no == 1 else f"{BASE}/page/{page_no}/"
+                try:
+                    listing_html = await limiter.run(page_url, get_html, page_url, sess, stage="listing")
+                except Exception as e:
+                    log.warning(f"Không tải được listing page {page_no}: {e}")
+                    continue
+                posts = list_posts(listing_html)
+                if not posts:
+                    log.warning(f"Không tìm thấy bài nào trên trang {page_no}.")
+                    continue
+                if args.until_seen and seen.all_seen(p["url"] for p in posts):
+                    log.info(f"==> Trang {page_no} đã crawl hết trước đó → dừng (--until_seen)")
+                    break
+                new = [(i, p) for i, p in enumerate(posts, 1) if p["url"] not in seen]
+                metrics.incr("post", "skipped", len(posts) - len(new))
+                log.info(f"=== Listing page {page_no}: {len(posts)} bài ({len(new)} bài mới)")
+                for idx, post in new:
+                    await q_resolve.put({"page_no": page_no, "idx": idx, "post": post})
+        finally:
+            for _ in range(args.resolve_workers):
+                await q_resolve.put(_STOP)
+
+    # ---- stage 2: resolve ----
+    async def resolve(item: dict):
+        post = item["post"]
+        post_html = await limiter.run(post["url"], get_html, post["url"], sess, stage="post_html")
+        with metrics.timer("parse"):
+            info = parse_post(post_html)
+        media_url = info["media_url"]
+        tag = f"[{item['page_no']}.{item['idx']}]"
+        if not media_url:
+            log.warning(f"{tag} ✗ Không tìm thấy nguồn media")
+            metrics.incr("post", "no_media")
+            return None
+        if media_url in seen:
+            log.info(f"{tag} Video đã tải trước đó → bỏ qua")
+            metrics.incr("post", "skipped")
+            seen.add(post["url"])
+            return None
+        item.update(media_url=media_url, title=info["title"] or post["title"], tags=info["tags"])
+        return item
+
+    # ---- stage 3: thumbnail ----
+    async def thumb(item: dict):
+        post = item["post"]
+        item["thumb_path"] = Path("")
+        if post["thumb"]:
+            try:
+                ext = os.path.splitext(urlparse(post["thumb"]).path)[1] or ".jpg"
+                thumb_path = thumb_dir / downloader.stable_name(post["thumb"], ext)
+                await limiter.run(post["thumb"], save_file, post["thumb"], thumb_path, sess, stage="thumb",
+                                    download=True)
+                item["thumb_path"] = thumb_path
+            except Exception as e:
+                log.warning(f"  - Lỗi tải thumbnail [{post['url']}]: {e}")
+        return item
+
+    # ---- stage 4: video ----
+    async def video(item: dict):
+        post, media_url = item["post"], item["media_url"]
+        tag = f"[{item['page_no']}.{item['idx']}]"
+        out_mp4 = video_dir / downloader.stable_name(media_url, ".mp4")
+        log.info(f"{tag} MP4 = {media_url}")
+        try:
+            await limiter.run(media_url, save_file, media_url, out_mp4, sess, referer=post["url"],
+                              connections=args.connections, stage="video", download=True)
+        except Exception as e:
+            log.warning(f"{tag} ! Lỗi tải MP4: {e}")
+            return None
+        item["video_name"] = out_mp4.name
+        return item
+
+    # ---- stage 5: ghi kết quả (1 worker) ----
+    async def write(item: dict):
+        post = item["post"]
+        row = {
+            "page": item["page_no"],
+            "post_url": post["url"],
+            "title": item["title"],
+            "thumb_url": post["thumb"],
+            "thumb_path": item["thumb_path"].name if item["thumb_path"] else "",
+            "video_url": item["media_url"],
+            "video_name": item["video_name"],
+            "tags": ", ".join(item["tags"]),
+        }
+        with metrics.timer("write"):
+            store.append(row)
+        seen.add(post["url"])
+        seen.add(item["media_url"], kind="video_url")
+        metrics.incr("post", "done")
+        log.info(f"[{item['page_no']}.{item['idx']}] ✓ DONE: {row['title']} -> {row['video_name']}")
+        return None
+
+    await asyncio.gather(
+        discover(),
+        run_stage("resolve", args.resolve_workers, q_resolve, resolve, q_thumb, args.thumb_workers),
+        run_stage("thumb", args.thumb_workers, q_thumb, thumb, q_video, args.video_workers),
+        run_stage("video", args.video_workers, q_video, video, q_write, 1),
+        run_stage("write", 1, q_write, write),
+    )
+
+    seen.close()
+    _finish_excel(store)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--start", type=int, default=1, help="Trang bắt đầu")
     ap.add_argument("--end", type=int, default=1, help="Trang kết thúc (inclusive)")
     ap.add_argument("--out", type=str, default="luuvideo", help="Thư mục lưu file")
     ap.add_argument("--excel", type=str, default="ketqua.xlsx", help="Tên file Excel")
+    ap.add_argument("--engine", choices=("async", "sync"), default="async",
+                    help="async = tải song song theo host, sync = tuần tự như cũ")
+    ap.add_argument("--per_host", type=int, default=None,
+                    help="Tên cũ của --host_downloads (nếu có thì dùng giá trị này)")
+    ap.add_argument("--resolve_workers", type=int, default=4, help="Số worker đọc trang bài (engine async)")
+    ap.add_argument("--thumb_workers", type=int, default=2, help="Số worker tải thumbnail (engine async)")
+    ap.add_argument("--video_workers", type=int, default=3, help="Số worker tải MP4 (engine async)")
+    ap.add_argument("--queue_size", type=int, default=24, help="Số item tối đa chờ giữa 2 stage")
+    ap.add_argument("--connections", type=int, default=1,
+                    help="Số kết nối tối đa cho 1 file MP4 (chia khoảng byte, cần server hỗ trợ Range)")
+    ap.add_argument("--seen_index", type=str, default="seen_index.txt",
+                    help="File lưu URL bài/video đã xử lý (lần đầu tự nạp từ Excel)")
+    ap.add_argument("--until_seen", action="store_true",
+                    help="Dừng khi gặp trang listing mà mọi bài đều đã xử lý")
+    ap.add_argument("--max_downloads", type=int, default=16,
+                    help="Tổng số kết nối tải cùng lúc (chia đều nếu nhiều crawler chạy song song)")
+    ap.add_argument("--host_downloads", type=int, default=8,
+                    help="Số kết nối tối đa mỗi host (request trang + từng kết nối tải, kể cả khoảng byte)")
+    ap.add_argument("--bandwidth", type=float, default=0, help="Giới hạn băng thông tải (MB/s), 0 = không giới hạn")
+    ap.add_argument("--priority", choices=scheduler.POLICIES, default="oldest",
+                    help="Thứ tự tải khi phải chờ: oldest = lượt tải bắt đầu trước, smallest = file nhỏ trước")
+    ap.add_argument("--metrics", type=str, default="crawl_quatvn.metrics.json",
+                    help="File JSON số liệu theo stage, ghi lại định kỳ ('' = tắt)")
+    ap.add_argument("--metrics_interval", type=float, default=10, help="Chu kỳ ghi file metrics (giây)")
     args = ap.parse_args()
-    crawl(args)
+    if args.per_host is not None:
+        args.host_downloads = args.per_host
+    scheduler.configure(max_total=args.max_downloads, per_host=args.host_downloads,
+                        bytes_per_sec=args.bandwidth * 1e6, policy=args.priority)
+    metrics.start(args.metrics, args.metrics_interval, name="quatvn")
+    try:
+        if args.engine == "async":
+            asyncio.run(crawl_async(args))
+        else:
+            crawl(args)
+    finally:
+        metrics.finish()
 
 if __name__ == "__main__":
     main()
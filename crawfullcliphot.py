@@ -4,28 +4,40 @@
 """
 Crawl fullcliphot.org:
 - Crawl listing pages, save thumbnail + title.
-- Open each post with Playwright, capture network for .../note.txt URL.
+- Open each post with Playwright, capture network for .../note.txt URL
+  (one persistent Chrome context per crawl, several tabs resolving posts concurrently).
 - Download note.txt (M3U8-like), fetch all segment-*.png,
   extract m4s payload from PNG (chunk custom or trailing-after-IEND),
-  then concat -> MP4 via ffmpeg.
+  then pipe the ordered payloads into ffmpeg -> MP4 (--mux stream, default)
+  or write seg files and concat them (--mux files).
 - Grab post title & tags.
-- Write rows to Excel.
+- Write rows to Excel (journal ketqua.pending.<pid>.jsonl per row, merged into Excel once at the end).
 
 Usage:
     python crawl_fullcliphot.py --start 1 --end 3 --out luuvideo --excel ketqua.xlsx
 """
 
 import argparse
+import asyncio
+import hashlib
+import json
+import threading
 import os, re, sys, time, random, string, struct, subprocess, shutil, io, csv
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 import requests
 from bs4 import BeautifulSoup
-import pandas as pd
 from tqdm import tqdm
 import logging
 import sys
 
+import metrics
+from route_filter import DEFAULT_BLOCK_HOSTS, RouteFilter
+import ratecontrol
+import scheduler
+from result_store import ResultStore
+from seen_index import SeenIndex
+
 # ---------- Config ----------
 BASE = "https://fullcliphot.org"
 HEADERS = {
@@ -33,6 +45,16 @@ HEADERS = {
 }
 CHUNK_TYPE = b"seGB"  # nếu site dùng chunk tuỳ chỉnh; nếu không có, script sẽ tự lấy phần sau IEND
 
+# lxml nhanh hơn html.parser nhiều lần; chưa cài (pip install lxml) thì dùng html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# tài nguyên Chrome không cần để bắt admin-ajax / note.txt (--no_block để tắt)
+BLOCK_TYPES = ("image", "font", "media")
+
 FFMPEG_CMD = r"C:\ffmpeg-2025-10-27-git-68152978b5-full_build\bin\ffmpeg.exe"  # hoặc r"path\to\ffmpeg.exe" nếu chưa có trong PATH
 # ---------------------------
 
@@ -66,7 +88,7 @@ def get_html(url):
     return r.text
 
 def list_posts(listing_html):
-    soup = BeautifulSoup(listing_html, "html.parser")
+    soup = BeautifulSoup(listing_html, HTML_PARSER)
     posts = []
     for div in soup.select("#recent-content.content-loop .hentry"):
         a = div.select_one("a.thumbnail-link")
@@ -83,8 +105,10 @@ def list_posts(listing_html):
 def save_thumbnail(thumb_url: str, out_dir: Path) -> Path:
     if not thumb_url:
         return Path()
-    r = requests.get(thumb_url, headers=HEADERS, timeout=30)
-    r.raise_for_status()
+    with scheduler.get().slot(thumb_url, created=time.monotonic()):
+        r = requests.get(thumb_url, headers=HEADERS, timeout=30)
+        r.raise_for_status()
+        scheduler.get().throttle(len(r.content))
     ext = os.path.splitext(urlparse(thumb_url).path)[1] or ".jpg"
     name = rand_name(10, 16) + ext
     out = out_dir / name
@@ -92,36 +116,42 @@ def save_thumbnail(thumb_url: str, out_dir: Path) -> Path:
         f.write(r.content)
     return out
 
-def extract_payload_from_png(png_bytes: bytes) -> bytes:
+PNG_SIG = b'\x89PNG\r\n\x1a\n'
+
+def extract_payload_from_png(png_bytes) -> memoryview:
+    """
+    Trả về memoryview trỏ thẳng vào payload (không copy): chunk CHUNK_TYPE nếu có,
+    nếu không thì phần nằm sau IEND.
+    """
+    mv = memoryview(png_bytes)
+    n = len(mv)
     # PNG signature
-    if len(png_bytes) < 8 or png_bytes[:8] != b'\x89PNG\r\n\x1a\n':
+    if n < 8 or mv[:8] != PNG_SIG:
         raise ValueError("Not a PNG")
     # scan chunks
     i = 8
     found_custom = None
-    while i + 8 <= len(png_bytes):
-        length = struct.unpack(">I", png_bytes[i:i+4])[0]; i += 4
-        typ = png_bytes[i:i+4]; i += 4
-        if i + length > len(png_bytes):
+    while i + 8 <= n:
+        length = struct.unpack_from(">I", mv, i)[0]; i += 4
+        typ = mv[i:i+4]; i += 4
+        if i + length > n:
             break
-        chunk_data = png_bytes[i:i+length]; i += length
-        crc = png_bytes[i:i+4]; i += 4
+        chunk_start = i; i += length
+        i += 4  # crc
         if typ == CHUNK_TYPE:
-            found_custom = chunk_data
+            found_custom = mv[chunk_start:chunk_start+length]
             break
         if typ == b"IEND":
             # trailing payload starts right after IEND CRC
-            trailing = png_bytes[i:]
-            if trailing:
-                return trailing
+            if i < n:
+                return mv[i:]
     if found_custom is not None:
         return found_custom
     # fallback: try trailing after last IEND occurrence (if loop missed)
-    idx = png_bytes.rfind(b"IEND")
-    if idx != -1 and idx + 8 <= len(png_bytes):
-        trailing = png_bytes[idx+8:]
-        if trailing:
-            return trailing
+    raw = png_bytes if isinstance(png_bytes, (bytes, bytearray)) else mv.tobytes()
+    idx = raw.rfind(b"IEND")
+    if idx != -1 and idx + 8 < n:
+        return mv[idx+8:]
     raise RuntimeError("No payload (chunk or trailing) found in PNG")
 
 def download_segments_from_playlist(playlist_text: str) -> list:
@@ -134,163 +164,226 @@ def download_segments_from_playlist(playlist_text: str) -> list:
         urls.append(ln)
     return urls
 
-def fetch_playlist_url_with_playwright(playwright, post_url: str,
-                                       timeout_ms=20000, retries=3,
-                                       user_data_dir="chrome-profile") -> str:
-    """
-    Flow:
-      - Mở post_url (fullcliphot.org), bắt /wp-admin/admin-ajax.php -> lấy 'data' (https://xfast.sbs/watch/....html)
-      - Dùng Chrome thật (channel="chrome") + persistent profile để vào trang watch
-      - Truyền Referer/Origin đúng khi goto để CDN/JWPlayer cấp playlist
-      - Nghe network để bắt .../note.txt; nếu chưa thấy thì reload tối đa 'retries' lần
-      - Fallback: regex note.txt trong HTML trang watch
-    """
-    import json, re, time, requests
-    chromium = playwright.chromium
-
-    # 1) Dùng Chrome thật + persistent profile (ổn định hơn headless Chromium)
-    context = chromium.launch_persistent_context(
-        user_data_dir=user_data_dir,                # tạo/tham chiếu thư mục profile
-        channel="chrome",                           # chạy Chrome đã cài sẵn
-        headless=True,                             # để debug trực quan; khi ổn có thể True
-        args=[
-            "--disable-blink-features=AutomationControlled",
-            "--autoplay-policy=no-user-gesture-required",
-        ],
-    )
-    # che navigator.webdriver + auto-mute khi play
-    context.add_init_script("""
-        Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-        (function() {
-          const _play = HTMLMediaElement.prototype.play;
-          HTMLMediaElement.prototype.play = function() {
-            try { this.muted = true; } catch(e) {}
-            try { this.setAttribute && this.setAttribute('muted',''); } catch(e) {}
-            return _play.call(this);
-          };
-        })();
-    """)
-    page = context.new_page()
-
-    embed_url = None
-    playlist_url = None
-    capture_embed = True
-    capture_note  = False
-
-    def on_response(resp):
-        nonlocal embed_url, playlist_url, capture_embed, capture_note
-        u = resp.url
-        # Bắt admin-ajax để lấy URL watch
-        if capture_embed and "/wp-admin/admin-ajax.php" in u and "fullcliphot.org" in u:
-            body = ""
-            try: body = resp.text()
-            except: pass
-            try:
-                j = json.loads(body)
-                if isinstance(j, dict) and j.get("type") == "embed" and "data" in j:
-                    cand = str(j["data"]).strip()
-                    if cand.startswith("http"):
-                        embed_url = cand
-            except:
-                m = re.search(r"https?://[^\s\"']+/watch/[^\s\"']+\.html", body or "")
-                if m: embed_url = m.group(0)
-            return
-
-        # Bắt note.txt khi đã sang xfast.sbs
-        if capture_note and "xfast.sbs" in u and "note.txt" in u:
-            playlist_url = u
+# che navigator.webdriver + auto-mute khi play
+STEALTH_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+    (function() {
+      const _play = HTMLMediaElement.prototype.play;
+      HTMLMediaElement.prototype.play = function() {
+        try { this.muted = true; } catch(e) {}
+        try { this.setAttribute && this.setAttribute('muted',''); } catch(e) {}
+        return _play.call(this);
+      };
+    })();
+"""
+WATCH_URL_RE = re.compile(r"https?://[^\s\"']+/watch/[^\s\"']+\.html")
 
-    page.on("response", on_response)
+def _ref_headers(ref: str) -> dict:
+    hdrs = {"Referer": ref}
+    m = re.match(r"(https?://[^/]+)", ref)
+    if m:
+        hdrs["Origin"] = m.group(1)
+    return hdrs
 
-    # Helper: set extra headers (Referer/Origin) cho toàn bộ request trong context
-    def set_ref_headers(ref):
-        hdrs = {"Referer": ref}
-        m = re.match(r"(https?://[^/]+)", ref)
+def _embed_url_from_ajax(body: str):
+    """admin-ajax trả {"type": "embed", "data": "https://xfast.sbs/watch/....html"}."""
+    try:
+        j = json.loads(body)
+        if isinstance(j, dict) and j.get("type") == "embed" and "data" in j:
+            cand = str(j["data"]).strip()
+            if cand.startswith("http"):
+                return cand
+    except Exception:
+        m = WATCH_URL_RE.search(body or "")
         if m:
-            hdrs["Origin"] = m.group(1)
-        context.set_extra_http_headers(hdrs)
+            return m.group(0)
+    return None
 
+def _note_url_from_watch_html(embed_url: str, post_url: str):
+    """Fallback: regex note.txt trong HTML trang watch (tải bằng requests)."""
     try:
-        # --- B1: vào trang bài để lấy embed_url ---
-        page.goto(post_url, timeout=timeout_ms, wait_until="load")
-        try: page.mouse.wheel(0, 1400)
-        except: pass
-
-        end = time.time() + timeout_ms/1000.0
-        while time.time() < end and not embed_url:
-            time.sleep(0.25)
-
-        if not embed_url:
-            html = page.content()
-            m = re.search(r"https?://[^\s\"']+/watch/[^\s\"']+\.html", html)
-            if m: embed_url = m.group(0)
-        if not embed_url:
-            return None
-
-        # --- B2: sang trang watch bằng Chrome thật + đúng Referer/Origin ---
-        capture_embed = False
-        capture_note  = True
-
-        # set headers cho toàn bộ subrequest (segments, note.txt…)
-        set_ref_headers(post_url)
-
-        for attempt in range(1, retries + 1):
-            if attempt == 1:
-                # Gắn referer trực tiếp cho main document
-                page.goto(embed_url, timeout=timeout_ms, wait_until="load",
-                          referer=post_url)
-            else:
-                page.reload(timeout=timeout_ms, wait_until="load")
-
-            # cố gắng kích hoạt player
-            try:
-                page.mouse.wheel(0, 1400)
-                page.click("css=.jw-display-icon-container, css=video", timeout=1500)
-            except: pass
-            try:
-                page.evaluate("(window.jwplayer && jwplayer().play) && jwplayer().play();")
-            except: pass
+        h = {"User-Agent": HEADERS.get("User-Agent", "")}
+        h.update(_ref_headers(post_url))
+        whtml = requests.get(embed_url, headers=h, timeout=30).text
+        m = re.search(r"https?://[^\s\"']+?/note\.txt", whtml)
+        if m and "xfast.sbs" in m.group(0):
+            return m.group(0)
+    except Exception:
+        pass
+    return None
+
+async def _wait_future(fut, timeout_ms):
+    try:
+        return await asyncio.wait_for(asyncio.shield(fut), timeout_ms / 1000.0)
+    except asyncio.TimeoutError:
+        return None
 
-            end = time.time() + timeout_ms/1000.0
-            while time.time() < end and not playlist_url:
-                time.sleep(0.25)
-            if playlist_url:
-                break
+class PlaylistResolver:
+    """
+    Giữ 1 persistent Chrome context (channel="chrome" + profile + init script) cho cả lượt crawl.
+    Playwright async chạy trong 1 thread riêng; pool `pages` tab cho phép resolve nhiều bài cùng lúc.
+
+    Flow cho mỗi bài (như trước):
+      - Mở post_url, bắt /wp-admin/admin-ajax.php -> lấy 'data' (https://xfast.sbs/watch/....html)
+      - Sang trang watch với đúng Referer/Origin để CDN/JWPlayer cấp playlist
+      - Nghe network để bắt .../note.txt; nếu chưa thấy thì reload tối đa `reloads` lần
+      - Fallback: regex note.txt trong HTML trang watch
+    submit(post_url) -> concurrent.futures.Future trả về (playlist_url, embed_url, post_html);
+    post_html là HTML trang bài đã render ở B1, dùng lại để lấy title/tags (khỏi GET thêm lần nữa).
+    """
 
-        # --- B3: fallback regex trong HTML trang watch ---
-        if not playlist_url:
+    def __init__(self, pages: int = 3, timeout_ms: int = 15000, tries: int = 3, reloads: int = 3,
+                 user_data_dir: str = "chrome-profile", block: bool = True):
+        self.pages = max(1, pages)
+        self.block = block
+        self.timeout_ms = timeout_ms
+        self.tries = tries
+        self.reloads = reloads
+        self.user_data_dir = user_data_dir
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="playwright", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        from playwright.async_api import async_playwright
+        self._pw = await async_playwright().start()
+        # Dùng Chrome thật + persistent profile (ổn định hơn headless Chromium)
+        self._context = await self._pw.chromium.launch_persistent_context(
+            user_data_dir=self.user_data_dir,           # tạo/tham chiếu thư mục profile
+            channel="chrome",                           # chạy Chrome đã cài sẵn
+            headless=True,                              # False để debug trực quan
+            args=[
+                "--disable-blink-features=AutomationControlled",
+                "--autoplay-policy=no-user-gesture-required",
+            ],
+        )
+        await self._context.add_init_script(STEALTH_INIT_SCRIPT)
+        if self.block:
+            # bỏ ảnh / font / video / quảng cáo: chỉ cần response admin-ajax và request note.txt
+            await RouteFilter(BLOCK_TYPES, DEFAULT_BLOCK_HOSTS).install_async(self._context)
+        self._free_pages = asyncio.Queue()
+        for _ in range(self.pages):
+            self._free_pages.put_nowait(await self._context.new_page())
+
+    def submit(self, post_url: str):
+        return asyncio.run_coroutine_threadsafe(self._resolve(post_url), self._loop)
+
+    def close(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(timeout=30)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+    async def _stop(self):
+        try:
+            await self._context.close()
+        finally:
+            await self._pw.stop()
+
+    async def _resolve(self, post_url: str):
+        """Mượn 1 tab; retry khi timeout (nghỉ 2s) hoặc khi không thấy note.txt (nghỉ 3s)."""
+        from playwright.async_api import TimeoutError as PWTimeoutError
+        page = await self._free_pages.get()
+        embed_url, post_html = None, ""
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            for retry in range(self.tries):
+                if retry:
+                    metrics.incr("resolve", "retries")
+                try:
+                    playlist_url, embed_url, html = await self._resolve_on_page(page, post_url)
+                    post_html = html or post_html
+                except PWTimeoutError:
+                    log_info(f"   -> Page.goto timeout [{post_url}], thử lại ({retry+1}/{self.tries})...")
+                    metrics.incr("resolve", "timeouts")
+                    await asyncio.sleep(2)
+                    continue
+                if playlist_url:
+                    ok = True
+                    return playlist_url, embed_url, post_html
+                log_warn(f"! Không tìm được note.txt [{post_url}] → thử lại ({retry+1}/{self.tries})...")
+                await asyncio.sleep(3)
+            return None, embed_url, post_html
+        finally:
+            metrics.observe("resolve", time.perf_counter() - t0, ok)
             try:
-                h = dict({"User-Agent": context.user_agent or HEADERS.get("User-Agent", "")})
-                h["Referer"] = post_url
-                m = re.match(r"(https?://[^/]+)", post_url)
-                if m: h["Origin"] = m.group(1)
-                whtml = requests.get(embed_url, headers=h, timeout=30).text
-                m = re.search(r"https?://[^\s\"']+?/note\.txt", whtml)
-                if m and "xfast.sbs" in m.group(0):
-                    playlist_url = m.group(0)
-            except: pass
-
-        return playlist_url, embed_url   # <-- TRẢ VỀ CẢ HAI
+                await page.goto("about:blank")
+            except Exception:
+                pass
+            self._free_pages.put_nowait(page)
+
+    async def _resolve_on_page(self, page, post_url: str):
+        loop = asyncio.get_running_loop()
+        embed_fut = loop.create_future()
+        note_fut = loop.create_future()
+        capture = {"embed": True, "note": False}
+
+        async def on_response(resp):
+            u = resp.url
+            # Bắt admin-ajax để lấy URL watch
+            if capture["embed"] and "/wp-admin/admin-ajax.php" in u and "fullcliphot.org" in u:
+                body = ""
+                try: body = await resp.text()
+                except Exception: pass
+                cand = _embed_url_from_ajax(body)
+                if cand and not embed_fut.done():
+                    embed_fut.set_result(cand)
+                return
+            # Bắt note.txt khi đã sang xfast.sbs
+            if capture["note"] and "xfast.sbs" in u and "note.txt" in u and not note_fut.done():
+                note_fut.set_result(u)
+
+        page.on("response", on_response)
+        try:
+            # --- B1: vào trang bài để lấy embed_url ---
+            await page.set_extra_http_headers({})
+            await page.goto(post_url, timeout=self.timeout_ms, wait_until="load")
+            try: await page.mouse.wheel(0, 1400)
+            except Exception: pass
+
+            embed_url = await _wait_future(embed_fut, self.timeout_ms)
+            post_html = await page.content()
+            if not embed_url:
+                m = WATCH_URL_RE.search(post_html)
+                if m: embed_url = m.group(0)
+            if not embed_url:
+                return None, None, post_html
 
-    finally:
-        context.close()
+            # --- B2: sang trang watch với đúng Referer/Origin (chỉ trên tab này) ---
+            capture["embed"], capture["note"] = False, True
+            await page.set_extra_http_headers(_ref_headers(post_url))
 
-from pathlib import Path
+            playlist_url = None
+            for attempt in range(1, self.reloads + 1):
+                if attempt == 1:
+                    await page.goto(embed_url, timeout=self.timeout_ms, wait_until="load", referer=post_url)
+                else:
+                    await page.reload(timeout=self.timeout_ms, wait_until="load")
+
+                # cố gắng kích hoạt player
+                try:
+                    await page.mouse.wheel(0, 1400)
+                    await page.click("css=.jw-display-icon-container, css=video", timeout=1500)
+                except Exception: pass
+                try:
+                    await page.evaluate("(window.jwplayer && jwplayer().play) && jwplayer().play();")
+                except Exception: pass
+
+                playlist_url = await _wait_future(note_fut, self.timeout_ms)
+                if playlist_url:
+                    break
+
+            # --- B3: fallback regex trong HTML trang watch ---
+            if not playlist_url:
+                playlist_url = await asyncio.to_thread(_note_url_from_watch_html, embed_url, post_url)
 
-def excel_append_row(xlsx_path, row):
-    # row là dict: page, post_url, title, thumb_url, thumb_path, video_path, video_name, tags
-    from openpyxl import Workbook, load_workbook
-    cols = ["page","post_url","title","thumb_url","thumb_path","video_url","video_name","tags"]
-    xlsx = Path(xlsx_path)
-    if not xlsx.exists():
-        wb = Workbook(); ws = wb.active
-        ws.append(cols)
-        wb.save(xlsx_path)
-
-    wb = load_workbook(xlsx_path)
-    ws = wb.active
-    ws.append([row.get(c, "") for c in cols])
-    wb.save(xlsx_path)
+            return playlist_url, embed_url, post_html
+        finally:
+            page.remove_listener("response", on_response)
 
 def ffmpeg_concat_m4s(seg_files: list, out_mp4: Path):
     # Kiểm tra ffmpeg có chạy được không
@@ -338,7 +431,7 @@ def ffmpeg_concat_m4s(seg_files: list, out_mp4: Path):
 
 
 def get_post_meta(html: str):
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, HTML_PARSER)
     # title (trang bài)
     title = ""
     h1 = soup.select_one("h1.entry-title")
@@ -348,68 +441,109 @@ def get_post_meta(html: str):
     tags = [a.get_text(strip=True) for a in soup.select(".entry-tags .tag-links a")]
     return title, tags
     
-def get_playlist_with_retry_only_on_timeout(pw, post_url: str, tries: int = 3, timeout_ms: int = 15000):
-    """
-    Chỉ retry khi fetch_playlist_url_with_playwright ném lỗi Page.goto timeout.
-    Các lỗi khác: ném ra luôn (không retry).
-    Trả về playlist_url (note.txt) hoặc ném lỗi sau khi thử đủ số lần.
-    """
-    last_timeout_err = None
-    for i in range(tries):
-        try:
-            return fetch_playlist_url_with_playwright(pw, post_url, timeout_ms=timeout_ms)
-        except PlaywrightTimeoutError as e:
-            # chỉ bắt lỗi timeout của Playwright (đúng kiểu trong ảnh)
-            log_info(f"   -> Page.goto timeout, thử lại {i+1}/{tries} ...")
-            last_timeout_err = e
-            time.sleep(2)
-            continue
-        except Exception:
-            # lỗi khác: ném ra luôn để outer try/except xử lý như cũ
-            raise
-    # hết số lần retry mà vẫn timeout
-    raise last_timeout_err if last_timeout_err else RuntimeError("Timeout nhưng không có exception?!")
-
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter, Retry
 
 def build_session():
-    sess = requests.Session()
-    # retry nhẹ nhàng với backoff để tránh fail lẻ
-    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
-    adapter = HTTPAdapter(pool_connections=100, pool_maxsize=100, max_retries=retries)
-    sess.mount("http://", adapter)
-    sess.mount("https://", adapter)
+    # 429/503/timeout → tự giảm tốc theo host, tôn trọng Retry-After, tạm dừng host lỗi liên tục
+    sess = ratecontrol.mount(requests.Session(), pool_size=100)
     sess.headers.update(HEADERS)
     return sess
 
-def _download_one(idx_url, sess: requests.Session, work_dir: Path):
-    """Tải 1 PNG → rút payload → lưu đúng tên theo index. Trả về đường dẫn .m4s hoặc None."""
+def _get_segment(url: str, sess: requests.Session, created: float | None) -> bytearray:
+    """Tải 1 PNG qua scheduler (suất tải + throttle băng thông theo chunk)."""
+    sched = scheduler.get()
+    buf = bytearray()
+    with sched.slot(url, created=created), sess.get(url, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(256 * 1024):
+            buf += chunk
+            sched.throttle(len(chunk))
+    return buf
+
+def _fetch_payload(idx_url, sess: requests.Session, created: float | None = None):
+    """Tải 1 PNG → trả về payload (memoryview) hoặc None nếu lỗi."""
     idx, url = idx_url
     try:
-        rb = sess.get(url, timeout=60).content
-        payload = extract_payload_from_png(rb)
-        out_seg = work_dir / f"seg_{idx:05d}.m4s"
-        with open(out_seg, "wb") as f:
-            f.write(payload)
-        return out_seg
+        with metrics.timer("segment"):
+            payload = extract_payload_from_png(_get_segment(url, sess, created))
+        metrics.add_bytes("segment", len(payload))
+        return payload
     except Exception as e:
         logging.warning(f"  - lỗi segment {idx}: {e}")
         return None
 
-def parallel_download_segments(seg_urls: list, work_dir: Path, workers: int = 8) -> list[Path]:
+class SegmentCache:
+    """
+    Thư mục segment cố định theo URL playlist (note.txt): tmp/seg_<sha1>/
+    + manifest.txt ghi index các segment đã tải xong. Bị ngắt giữa chừng thì lần chạy sau
+    chỉ tải những segment còn thiếu rồi ghép.
+    """
+
+    def __init__(self, root: Path, playlist_url: str):
+        key = hashlib.sha1(playlist_url.encode("utf-8")).hexdigest()[:16]
+        self.dir = root / f"seg_{key}"
+        ensure_dir(self.dir)
+        self.manifest = self.dir / "manifest.txt"
+        (self.dir / "playlist.url").write_text(playlist_url, encoding="utf-8")
+        self._lock = threading.Lock()
+        self.done = self._load()
+
+    def _load(self) -> set:
+        done = set()
+        if self.manifest.exists():
+            for ln in self.manifest.read_text(encoding="ascii", errors="ignore").split():
+                if ln.isdigit() and self.path(int(ln)).exists():
+                    done.add(int(ln))
+        return done
+
+    def path(self, idx: int) -> Path:
+        return self.dir / f"seg_{idx:05d}.m4s"
+
+    def has(self, idx: int) -> bool:
+        return idx in self.done
+
+    def read(self, idx: int) -> bytes:
+        return self.path(idx).read_bytes()
+
+    def put(self, idx: int, payload) -> Path:
+        out_seg = self.path(idx)
+        tmp = out_seg.with_suffix(".part")
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, out_seg)
+        # chỉ ghi manifest khi file segment đã hoàn chỉnh
+        with self._lock:
+            with open(self.manifest, "a", encoding="ascii") as f:
+                f.write(f"{idx}\n")
+            self.done.add(idx)
+        return out_seg
+
+    def remove(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def _download_one(idx_url, sess: requests.Session, cache: SegmentCache, created=None):
+    """Tải 1 PNG → rút payload → lưu vào cache theo index. Trả về đường dẫn .m4s hoặc None."""
+    idx, _ = idx_url
+    if cache.has(idx):
+        return cache.path(idx)
+    payload = _fetch_payload(idx_url, sess, created)
+    if payload is None:
+        return None
+    return cache.put(idx, payload)
+
+def parallel_download_segments(seg_urls: list, cache: SegmentCache, workers: int = 8) -> list[Path]:
     """
-    Tải các segment PNG song song, nhưng ghi file theo đúng thứ tự chỉ số.
+    Tải các segment PNG còn thiếu trong cache song song, ghi file theo đúng thứ tự chỉ số.
     Trả về danh sách Path đã được **sắp xếp theo index**.
     """
-    ensure_dir(work_dir)
     sess = build_session()
+    created = time.monotonic()  # mọi segment của video cùng mức ưu tiên, trong đó theo thứ tự index
 
     # Gắn index 1-based cho đúng thứ tự ghép
     jobs = [(i+1, u) for i, u in enumerate(seg_urls)]
     results = {}
     with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
-        futures = {ex.submit(_download_one, j, sess, work_dir): j[0] for j in jobs}
+        futures = {ex.submit(_download_one, j, sess, cache, created): j[0] for j in jobs}
         for fut in tqdm(as_completed(futures), total=len(futures), desc="Downloading PNG segments"):
             idx = futures[fut]
             p = fut.result()
@@ -420,6 +554,84 @@ def parallel_download_segments(seg_urls: list, work_dir: Path, workers: int = 8)
     ordered = [results[i] for i in sorted(results.keys())]
     return ordered
 
+def _stream_payload(idx_url, sess: requests.Session, cache, created=None):
+    """Lấy payload cho chế độ stream: đọc từ cache nếu có, tải xong thì lưu vào cache (nếu bật)."""
+    idx, _ = idx_url
+    if cache is not None and cache.has(idx):
+        return cache.read(idx)
+    payload = _fetch_payload(idx_url, sess, created)
+    if payload is not None and cache is not None:
+        cache.put(idx, payload)
+    return payload
+
+def stream_segments_to_mp4(seg_urls: list, out_mp4: Path, workers: int = 8, cache=None) -> int:
+    """
+    Tải PNG song song, rút payload và đẩy thẳng theo đúng thứ tự vào stdin của 1 tiến trình
+    ffmpeg (-i pipe:0 -c copy): không ghi seg_XXXXX.m4s / list.txt ra đĩa.
+    Số segment đang giữ trong RAM bị giới hạn bởi cửa sổ workers*4.
+    Có cache (SegmentCache) thì segment vẫn được lưu lại để tiếp tục được nếu bị ngắt.
+    Trả về số segment đã ghi; segment lỗi bị bỏ qua như chế độ file.
+    """
+    if not shutil.which(FFMPEG_CMD):
+        raise RuntimeError(
+            f"Không tìm thấy FFmpeg tại '{FFMPEG_CMD}'. "
+            f"Hãy sửa FFMPEG_CMD thành full path tới ffmpeg.exe hoặc thêm vào PATH."
+        )
+    cmd = [
+        FFMPEG_CMD, "-y", "-loglevel", "error",
+        "-fflags", "+genpts", "-i", "pipe:0",
+        "-c", "copy", "-movflags", "+faststart",
+        str(out_mp4)
+    ]
+    log_info(f"FFmpeg (stream): {' '.join(cmd)}")
+
+    sess = build_session()
+    window = max(1, workers) * 4
+    created = time.monotonic()
+    jobs = iter([(i+1, u) for i, u in enumerate(seg_urls)])
+    written = 0
+
+    import tempfile
+    with tempfile.TemporaryFile() as err, \
+         ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+        inflight = {}
+
+        def fill():
+            while len(inflight) < window:
+                j = next(jobs, None)
+                if j is None:
+                    return
+                inflight[j[0]] = ex.submit(_stream_payload, j, sess, cache, created)
+
+        fill()
+        next_idx = 1
+        try:
+            with tqdm(total=len(seg_urls), desc="Streaming PNG segments") as bar:
+                while inflight:
+                    payload = inflight.pop(next_idx).result()
+                    if payload is not None:
+                        proc.stdin.write(payload)
+                        written += 1
+                    next_idx += 1
+                    bar.update(1)
+                    fill()
+        except BrokenPipeError:
+            pass
+        finally:
+            for fut in inflight.values():
+                fut.cancel()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            rc = proc.wait()
+
+        if rc != 0:
+            err.seek(0)
+            raise RuntimeError("FFmpeg stream mux failed:\n" + err.read().decode("utf-8", "replace"))
+    return written
+
 def crawl(args):
     out_root = Path(args.out).resolve()
     thumb_dir = out_root / "thumbs"
@@ -427,78 +639,120 @@ def crawl(args):
     temp_dir = out_root / "tmp"
     ensure_dir(thumb_dir); ensure_dir(video_dir); ensure_dir(temp_dir)
 
-    all_rows = []
+    store = ResultStore(args.excel)
+    seen = SeenIndex(args.seen_index, seed_from=args.excel)
 
-    # Playwright lazy import (để không bắt buộc nếu chỉ test HTML)
-    from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
-
-    with sync_playwright() as pw:
+    # 1 persistent context cho cả lượt crawl; Playwright chỉ import khi khởi tạo resolver
+    resolver = PlaylistResolver(pages=args.pw_pages, timeout_ms=15000, block=not args.no_block)
+    try:
         for page_no in range(args.start, args.end + 1):
             url = BASE if page_no == 1 else f"{BASE}/page/{page_no}/"
             os.system('cls' if os.name == 'nt' else 'clear')   # <== clear CMD khi sang page mới
             log_info(f"=== Listing page {page_no}: {url}")
-            html = get_html(url)
+            with metrics.timer("listing"):
+                html = get_html(url)
             posts = list_posts(html)
             if not posts:
                 log_warn("Không tìm thấy bài nào trên trang này.")
                 continue
+            if args.until_seen and seen.all_seen(p["url"] for p in posts):
+                log_info(f"==> Trang {page_no} đã crawl hết trước đó → dừng (--until_seen)")
+                break
+            # bỏ qua bài đã xử lý ở lượt trước (không mở Chrome, không tải thumb)
+            n_all = len(posts)
+            posts = [p for p in posts if p["url"] not in seen]
+            metrics.incr("post", "skipped", n_all - len(posts))
+            if not posts:
+                log_info("Mọi bài trên trang này đều đã có → sang trang sau.")
+                continue
+
+            # gửi trước toàn bộ bài của trang cho resolver (chạy song song trên pw_pages tab);
+            # trong lúc tải segment bài này, các bài sau đã được resolve sẵn
+            pending = [resolver.submit(post["url"]) for post in posts]
 
-            for idx, post in enumerate(posts, 1):
+            for idx, (post, fut) in enumerate(zip(posts, pending), 1):
                 try:
                     log_info(f"\n[{page_no}.{idx}] {post['title']}")
-                    # save thumb
-                    thumb_path = save_thumbnail(post["thumb"], thumb_dir)
-                    # lấy playlist (note.txt) qua network
-                    playlist_url, video_url = None, ""
-                    for retry in range(3):
-                        try:
-                            playlist_url, video_url = fetch_playlist_url_with_playwright(
-                                pw, post["url"], timeout_ms=15000
-                            )
-                        except PlaywrightTimeoutError:
-                            log_info(f"   -> Page.goto timeout, thử lại ({retry+1}/3)...")
-                            time.sleep(2)
-                            continue
-
-                        if playlist_url:
-                            break
-                        log_warn(f"! Không tìm được note.txt → thử lại ({retry+1}/3)...")
-                        time.sleep(3)
+                    # lấy playlist (note.txt) qua network; thời gian chờ resolver (0 nếu đã resolve xong trước)
+                    with metrics.timer("resolve_wait"):
+                        playlist_url, video_url, post_html = fut.result()
 
                     if not playlist_url:
                         log_warn("✗ Không tìm được note.txt sau 3 lần → bỏ qua bài này")
+                        metrics.incr("post", "no_playlist")
                         continue
                     log_info(f"note.txt = {playlist_url}")
+                    if playlist_url in seen or video_url in seen:
+                        log_info("  - Video đã tải trước đó → bỏ qua")
+                        metrics.incr("post", "skipped")
+                        seen.add(post["url"])
+                        continue
+
+                    # save thumb (sau khi chắc bài / video chưa lấy)
+                    with metrics.timer("thumb"):
+                        thumb_path = save_thumbnail(post["thumb"], thumb_dir)
+                    if thumb_path.is_file():
+                        metrics.add_bytes("thumb", thumb_path.stat().st_size)
 
                     # tải note.txt
-                    playlist_text = requests.get(playlist_url, headers=HEADERS, timeout=30).text
+                    with metrics.timer("playlist"):
+                        playlist_text = requests.get(playlist_url, headers=HEADERS, timeout=30).text
                     seg_urls = download_segments_from_playlist(playlist_text)
                     if not seg_urls:
                         log_warn("! note.txt rỗng → bỏ qua")
                         continue
 
-                    # tải từng PNG & tách payload
-                    work_dir = temp_dir / rand_name(8, 10)
-                    ensure_dir(work_dir)
-
-                    # tải SONG SONG
-                    seg_files = parallel_download_segments(seg_urls, work_dir, workers=args.seg_workers)
-
-                    if not seg_files or len(seg_files) < len(seg_urls):
-                        log_warn(f"! Tải thiếu segment ({len(seg_files)}/{len(seg_urls)}) – vẫn thử ghép")
-                    if not seg_files:
-                        log_warn("! Không có segment nào → bỏ qua")
-                        shutil.rmtree(work_dir, ignore_errors=True)
-                        continue
-
-                    # ghép mp4
                     video_name = rand_name(20, 40) + ".mp4"
                     out_mp4 = video_dir / video_name
-                    ffmpeg_concat_m4s(seg_files, out_mp4)
+                    # cache segment theo playlist: chạy lại sau khi bị ngắt chỉ tải phần còn thiếu
+                    # (--mux stream chỉ ghi cache khi có --resume_segments, mặc định không ghi đĩa)
+                    cache = None
+                    if args.mux == "files" or args.resume_segments:
+                        cache = SegmentCache(temp_dir, playlist_url)
+                        if cache.done:
+                            log_info(f"Tiếp tục từ cache: {len(cache.done)}/{len(seg_urls)} segment đã có")
+
+                    n_ok = 0
+                    if args.mux == "stream":
+                        # rút payload & đẩy thẳng vào ffmpeg, không qua list.txt
+                        try:
+                            with metrics.timer("stream_mux"):
+                                n_ok = stream_segments_to_mp4(seg_urls, out_mp4, workers=args.seg_workers,
+                                                              cache=cache)
+                        except RuntimeError as e:
+                            log_warn(f"! Ghép stream lỗi → chuyển sang chế độ file: {e}")
+                            out_mp4.unlink(missing_ok=True)
+                            n_ok = 0
+                        if 0 < n_ok < len(seg_urls):
+                            log_warn(f"! Tải thiếu segment ({n_ok}/{len(seg_urls)}) – vẫn ghép")
+
+                    if not n_ok:
+                        # tải từng PNG & tách payload ra file, rồi concat
+                        cache = cache or SegmentCache(temp_dir, playlist_url)
+
+                        # tải SONG SONG (chỉ những segment chưa có trong cache)
+                        with metrics.timer("segments"):
+                            seg_files = parallel_download_segments(seg_urls, cache, workers=args.seg_workers)
+
+                        if not seg_files or len(seg_files) < len(seg_urls):
+                            log_warn(f"! Tải thiếu segment ({len(seg_files)}/{len(seg_urls)}) – vẫn thử ghép")
+                        if not seg_files:
+                            log_warn("! Không có segment nào → bỏ qua")
+                            cache.remove()
+                            continue
+
+                        # ghép mp4 (lỗi thì giữ cache để lần sau chỉ cần ghép lại)
+                        with metrics.timer("mux"):
+                            ffmpeg_concat_m4s(seg_files, out_mp4)
 
-                    # metadata của bài
-                    post_html = get_html(post["url"])
-                    title, tags = get_post_meta(post_html)
+                    # ghép xong → dọn cache
+                    if cache is not None:
+                        cache.remove()
+
+                    # metadata của bài: dùng lại HTML Playwright đã tải ở bước resolve
+                    title, tags = get_post_meta(post_html) if post_html else ("", [])
+                    if not title:
+                        title, tags = get_post_meta(get_html(post["url"]))
 
                     # lưu row
                     row = {
@@ -511,37 +765,33 @@ def crawl(args):
                         "video_name": video_name,
                         "tags": ", ".join(tags),
                     }
-                    all_rows.append(row)
-                    excel_append_row(args.excel, row)  # lưu nối sau mỗi phim
+                    with metrics.timer("write"):
+                        store.append(row)  # ghi journal sau mỗi phim (không load/save Excel)
+                    metrics.add_bytes("video", out_mp4.stat().st_size)
+                    metrics.incr("post", "done")
+                    seen.add(post["url"])
+                    seen.add(video_url, kind="video_url")
+                    seen.add(playlist_url, kind="playlist_url")
                     log_info(f"✓ DONE: {row['title']}")
                     log_info(f"   thumb: {row['thumb_path']}")
                     log_info(f"   file : {row['video_name']}")
                     log_info(f"   url  : {row['video_url']}")
                     log_info(f"   tags : {row['tags']}")
 
-                    # dọn temp
-                    shutil.rmtree(work_dir, ignore_errors=True)
-
                 except Exception as e:
                     log_warn(f"!! Lỗi bài [{post['url']}]: {e}")
-
-    if all_rows:
-        # vẫn ghi hợp nhất nếu muốn (tuỳ chọn)
-        df = pd.DataFrame(all_rows)
-        excel_path = Path(args.excel).resolve()
-        if excel_path.exists():
-            old = pd.read_excel(excel_path)
-            df = pd.concat([old, df], ignore_index=True)
-        df.to_excel(excel_path, index=False)
-        log_info(f"\n==> Đã lưu Excel hợp nhất: {excel_path}")
+                    metrics.incr("post", "failures")
+    finally:
+        resolver.close()
+        seen.close()
+
+    # gộp journal vào Excel 1 lần
+    with metrics.timer("excel_export"):
+        n = store.export_xlsx()
+    excel_path = Path(args.excel).resolve()
+    if n:
+        log_info(f"\n==> Đã lưu Excel hợp nhất ({n} dòng mới): {excel_path}")
     else:
-        # tạo file rỗng với header nếu chưa tồn tại
-        from openpyxl import Workbook
-        excel_path = Path(args.excel).resolve()
-        if not excel_path.exists():
-            wb = Workbook(); ws = wb.active
-            ws.append(["page","post_url","title","thumb_url","thumb_path","video_url","video_name","tags"])
-            wb.save(str(excel_path))
         log_warn(f"\n==> Không có bản ghi mới, file Excel: {excel_path}")
 
 def main():
@@ -551,8 +801,35 @@ def main():
     ap.add_argument("--out", type=str, default="luuvideo")
     ap.add_argument("--excel", type=str, default="ketqua.xlsx")
     ap.add_argument("--seg_workers", type=int, default=8, help="Số luồng tải PNG segments")
+    ap.add_argument("--mux", choices=("stream", "files"), default="stream",
+                    help="stream = đẩy payload thẳng vào ffmpeg, files = ghi seg_XXXXX.m4s rồi concat")
+    ap.add_argument("--resume_segments", action="store_true",
+                    help="--mux stream: lưu cả segment vào cache tmp/seg_<hash> để chạy lại tiếp tục được nếu bị ngắt"
+                         " (tốn thêm đĩa ~ bằng dung lượng video)")
+    ap.add_argument("--seen_index", type=str, default="seen_index.txt",
+                    help="File lưu URL bài/video đã xử lý (lần đầu tự nạp từ Excel)")
+    ap.add_argument("--until_seen", action="store_true",
+                    help="Dừng khi gặp trang listing mà mọi bài đều đã xử lý")
+    ap.add_argument("--pw_pages", type=int, default=3, help="Số tab Chrome resolve note.txt song song")
+    ap.add_argument("--no_block", action="store_true",
+                    help="Không chặn ảnh/font/video/quảng cáo trong Chrome (để debug khi không bắt được note.txt)")
+    ap.add_argument("--max_downloads", type=int, default=16,
+                    help="Tổng số kết nối tải cùng lúc (chia đều nếu nhiều crawler chạy song song)")
+    ap.add_argument("--host_downloads", type=int, default=8, help="Số kết nối tải tối đa mỗi host")
+    ap.add_argument("--bandwidth", type=float, default=0, help="Giới hạn băng thông tải (MB/s), 0 = không giới hạn")
+    ap.add_argument("--priority", choices=scheduler.POLICIES, default="oldest",
+                    help="Thứ tự tải khi phải chờ: oldest = lượt tải bắt đầu trước, smallest = file nhỏ trước")
+    ap.add_argument("--metrics", type=str, default="crawl_fullcliphot.metrics.json",
+                    help="File JSON số liệu theo stage, ghi lại định kỳ ('' = tắt)")
+    ap.add_argument("--metrics_interval", type=float, default=10, help="Chu kỳ ghi file metrics (giây)")
     args = ap.parse_args()
-    crawl(args)
+    scheduler.configure(max_total=args.max_downloads, per_host=args.host_downloads,
+                        bytes_per_sec=args.bandwidth * 1e6, policy=args.priority)
+    metrics.start(args.metrics, args.metrics_interval, name="fullcliphot")
+    try:
+        crawl(args)
+    finally:
+        metrics.finish()
 
 if __name__ == "__main__":
     main()
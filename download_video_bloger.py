@@ -1,23 +1,44 @@
 import json
+import re
 import requests
 import time
 import os
 import pandas as pd
-import secrets
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import queue
 from playwright.sync_api import sync_playwright
 from pynput import keyboard
 
+import downloader
+import metrics
+from route_filter import DEFAULT_BLOCK_HOSTS, RouteFilter
+import ratecontrol
+import scheduler
+
 # --- CẤU HÌNH ---
 EXCEL_FILE = "viet69_final.xlsx"
 DOWNLOAD_DIR = "videos_downloaded"
 URL_COLUMN = "Video URL"
 NAME_COLUMN = "video_name"
 MAX_WORKERS = 5 
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+CONNECTIONS_PER_FILE = 1  # >1: tải mỗi video bằng nhiều kết nối (chia khoảng byte, cần server hỗ trợ Range)
+RECYCLE_CONTEXT_AFTER = 50  # số link mỗi context xử lý trước khi tạo context mới (tránh phình RAM)
+VIDEO_CONFIG_RE = re.compile(r"VIDEO_CONFIG\s*=\s*")
+MAX_DOWNLOADS = 16       # tổng kết nối tải cùng lúc (chia đều nếu nhiều crawler chạy song song)
+HOST_DOWNLOADS = 8       # kết nối tải tối đa mỗi host
+BANDWIDTH_MBPS = 0       # giới hạn băng thông (MB/s), 0 = không giới hạn
+DOWNLOAD_PRIORITY = "oldest"  # "oldest" hoặc "smallest"
+EXCEL_FLUSH_SECS = 15     # ghi Excel gộp mỗi EXCEL_FLUSH_SECS giây...
+EXCEL_FLUSH_ROWS = 20     # ...hoặc khi đủ EXCEL_FLUSH_ROWS video mới (cái nào tới trước)
+EXCEL_CLOSE_RETRIES = 3   # lần ghi cuối lỗi (file đang mở trong Excel...) → thử lại chừng này lần, cách nhau 5s,
+                          # vẫn lỗi thì lưu sang <excel>.unsaved.jsonl, lần chạy sau tự ghi vào Excel
+BLOCK_TYPES = ("image", "font", "media")  # trình duyệt fallback chỉ cần window.VIDEO_CONFIG; () = không chặn theo loại
+BLOCK_ADS = True
+METRICS_FILE = "download_bloger.metrics.json"  # số liệu theo stage, ghi lại mỗi METRICS_INTERVAL giây ("" = tắt)
+METRICS_INTERVAL = 10
 
-# Khởi tạo khóa đồng bộ và sự kiện dừng
-excel_lock = threading.Lock()
+# Khởi tạo sự kiện dừng
 stop_event = threading.Event()
 
 if not os.path.exists(DOWNLOAD_DIR):
@@ -34,67 +55,248 @@ def is_valid_blogger_url(url):
     if pd.isna(url): return False
     return "blogger.com/video.g?token=" in str(url)
 
-def download_file(url, filepath, worker_no):
+def download_file(url, filepath, worker_no, sess=None):
     if stop_event.is_set(): return False
     headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+        "User-Agent": USER_AGENT,
         "Referer": "https://www.blogger.com/"
     }
     try:
-        with requests.get(url, headers=headers, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            with open(filepath, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024*1024):
-                    if stop_event.is_set(): return False
-                    if chunk: f.write(chunk)
-            return True
+        # ghi .part + tiếp tục bằng Range khi đứt mạng giữa chừng
+        with metrics.timer("download"):
+            done = downloader.download_file(url, filepath, sess, headers=headers, timeout=60,
+                                            should_stop=stop_event.is_set,
+                                            connections=CONNECTIONS_PER_FILE)
+        if done:
+            metrics.add_bytes("download", os.path.getsize(filepath))
+        return done
     except Exception as e:
         if not stop_event.is_set():
             print(f"    [Luồng {worker_no}][!] Lỗi tải file: {e}")
         return False
 
-def worker_task(index, url, worker_no):
+def extract_video_config(html):
+    """Lấy object VIDEO_CONFIG từ script inline của trang video.g (None nếu không parse được)."""
+    m = VIDEO_CONFIG_RE.search(html or "")
+    if not m:
+        return None
+    try:
+        cfg, _ = json.JSONDecoder().raw_decode(html, m.end())
+    except ValueError:
+        return None
+    return cfg if isinstance(cfg, dict) else None
+
+def get_play_url(video_config):
+    """Stream cuối trong VIDEO_CONFIG là chất lượng cao nhất."""
+    if video_config and "streams" in video_config:
+        streams = video_config["streams"]
+        if streams:
+            return streams[-1].get("play_url")
+    return None
+
+def resolve_play_url_http(url, sess):
+    """Đường nhanh: tải trang video.g bằng HTTP thường rồi đọc VIDEO_CONFIG, không cần trình duyệt."""
+    with metrics.timer("resolve_http"):
+        try:
+            r = sess.get(url, headers={"User-Agent": USER_AGENT}, timeout=30)
+            r.raise_for_status()
+        except Exception:
+            metrics.incr("resolve_http", "failures")
+            return None
+        play_url = get_play_url(extract_video_config(r.text))
+    if not play_url:
+        metrics.incr("resolve_http", "no_config")
+    return play_url
+
+def resolve_play_url_browser(page, url):
+    """Đường chậm: render trang bằng Playwright, chờ player rồi đọc window.VIDEO_CONFIG."""
+    if stop_event.is_set(): return None
+    page.goto(url, wait_until="networkidle", timeout=60000)
+
+    if stop_event.is_set(): return None
+    page.wait_for_selector(".play-button", timeout=45000)
+
+    time.sleep(2)
+    if stop_event.is_set(): return None
+
+    return get_play_url(page.evaluate("() => window.VIDEO_CONFIG"))
+
+class ExcelWriter(threading.Thread):
+    """
+    Luồng duy nhất ghi Excel: các worker chỉ put((index, video_name)) vào queue,
+    luồng này gom lại và ghi 1 lần read_excel + to_excel cho cả lô
+    (mỗi EXCEL_FLUSH_SECS giây hoặc đủ EXCEL_FLUSH_ROWS dòng). Nhấn ESC → ghi ngay phần đang chờ;
+    close() ghi nốt lần cuối rồi kết thúc; không ghi được thì lưu sang unsaved_path() để không mất kết quả.
+    """
+    _STOP = object()
+
+    def __init__(self, path, flush_secs=EXCEL_FLUSH_SECS, flush_rows=EXCEL_FLUSH_ROWS):
+        super().__init__(name="excel-writer", daemon=True)
+        self.path = path
+        self.flush_secs = flush_secs
+        self.flush_rows = flush_rows
+        self.q = queue.Queue()
+        self.written = 0
+
+    def put(self, index, video_name):
+        self.q.put((index, video_name))
+
+    def close(self):
+        self.q.put(self._STOP)
+        self.join()
+
+    def run(self):
+        pending = {}
+        deadline = time.monotonic() + self.flush_secs
+        while True:
+            try:
+                item = self.q.get(timeout=max(0.0, min(1.0, deadline - time.monotonic())))
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                for attempt in range(EXCEL_CLOSE_RETRIES):
+                    if self.flush(pending):
+                        return
+                    print(f"[!] Đóng file {self.path} nếu đang mở – thử ghi lại sau 5s"
+                          f" ({attempt + 1}/{EXCEL_CLOSE_RETRIES})")
+                    time.sleep(5)
+                if not self.flush(pending):
+                    self.dump(pending)
+                return
+            if item is not None:
+                index, video_name = item
+                pending[index] = video_name
+            if pending and (len(pending) >= self.flush_rows or time.monotonic() >= deadline
+                            or stop_event.is_set()):
+                self.flush(pending)
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_secs
+
+    def flush(self, pending):
+        """Ghi pending vào Excel; True nếu đã ghi (hoặc không có gì để ghi)."""
+        if not pending:
+            return True
+        try:
+            with metrics.timer("excel"):
+                df = pd.read_excel(self.path)
+                df[NAME_COLUMN] = df[NAME_COLUMN].astype(str)
+                for index, video_name in pending.items():
+                    df.at[index, NAME_COLUMN] = str(video_name)
+                # ghi ra file tạm rồi replace để không làm hỏng Excel nếu bị ngắt giữa chừng
+                tmp = os.path.splitext(self.path)[0] + ".tmp.xlsx"
+                df.to_excel(tmp, index=False)
+                os.replace(tmp, self.path)
+        except Exception as e:
+            # giữ lại để lần flush sau thử tiếp (vd: file đang mở trong Excel)
+            print(f"[!] Không ghi được Excel ({len(pending)} dòng chờ): {e}")
+            return False
+        self.written += len(pending)
+        print(f"[Excel] Đã ghi {len(pending)} dòng (tổng {self.written})")
+        pending.clear()
+        return True
+
+    def dump(self, pending):
+        path = unsaved_path(self.path)
+        with open(path, "a", encoding="utf-8") as f:
+            for index, video_name in pending.items():
+                f.write(json.dumps({"index": int(index), "video_name": str(video_name)}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"[!] Chưa ghi được Excel → đã lưu {len(pending)} dòng vào {path} (lần chạy sau tự ghi vào Excel)")
+        pending.clear()
+
+def unsaved_path(excel_path):
+    return os.path.splitext(excel_path)[0] + ".unsaved.jsonl"
+
+def load_unsaved(excel_path):
+    """{index: video_name} từ lần chạy trước không ghi được Excel."""
+    path = unsaved_path(excel_path)
+    rows = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                    rows[int(e["index"])] = str(e["video_name"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+    return rows
+
+def worker_task(get_page, sess, index, url, worker_no, writer):
+    """
+    Xử lý 1 link: thử HTTP trước, chỉ khi thất bại mới dùng page của luồng
+    (get_page() mở trình duyệt khi cần lần đầu).
+    """
     if stop_event.is_set(): return
 
-    random_name = f"{secrets.token_hex(16)}.mp4"
-    file_path = os.path.join(DOWNLOAD_DIR, random_name)
+    # tên theo link + dòng → chạy lại sau khi bị ngắt tải tiếp đúng .part cũ
+    # (URL phát lấy lại mỗi lần nên không dùng làm khoá được)
+    video_name = downloader.stable_name(f"{index}:{url}", ".mp4")
+    file_path = os.path.join(DOWNLOAD_DIR, video_name)
 
     print(f"[*] Luồng {worker_no} đang xử lý hàng {index + 1}: {url[:40]}...")
 
+    try:
+        target_url = resolve_play_url_http(url, sess)
+        if not target_url:
+            if stop_event.is_set(): return
+            print(f"    [Luồng {worker_no}] HTTP không đọc được VIDEO_CONFIG → dùng trình duyệt")
+            with metrics.timer("resolve_browser"):
+                target_url = resolve_play_url_browser(get_page(), url)
+
+        if target_url:
+            if download_file(target_url, file_path, worker_no, sess):
+                # file đã tải đủ → luôn ghi nhận (kể cả khi vừa nhấn ESC), luồng Excel sẽ ghi theo lô
+                writer.put(index, video_name)
+                print(f"    [Luồng {worker_no}][OK] Đã tải {video_name}")
+                metrics.incr("link", "done")
+                return
+        metrics.incr("link", "failures")
+    except Exception:
+        metrics.incr("link", "failures")
+
+def worker_loop(worker_no, task_queue, writer):
+    """
+    Mỗi luồng giữ 1 Session HTTP và (khi cần) 1 Playwright + 1 Chromium sống suốt phiên,
+    dùng lại page giữa các link. Trình duyệt chỉ được mở ở lần fallback đầu tiên.
+    Context được tạo lại sau RECYCLE_CONTEXT_AFTER lần dùng hoặc khi page bị crash.
+    """
+    sess = ratecontrol.mount(requests.Session(), pool_size=4)
     with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
-        page = context.new_page()
+        st = {"browser": None, "context": None, "page": None, "used": 0}
+
+        def get_page():
+            if st["browser"] is None:
+                st["browser"] = p.chromium.launch(headless=True)
+            if st["context"] is None or st["used"] >= RECYCLE_CONTEXT_AFTER or st["page"].is_closed():
+                if st["context"] is not None:
+                    try: st["context"].close()
+                    except Exception: pass
+                st["context"] = st["browser"].new_context(user_agent=USER_AGENT)
+                if BLOCK_TYPES or BLOCK_ADS:
+                    RouteFilter(BLOCK_TYPES, DEFAULT_BLOCK_HOSTS if BLOCK_ADS else ()).install(st["context"])
+                st["page"] = st["context"].new_page()
+                st["used"] = 0
+            st["used"] += 1
+            return st["page"]
 
         try:
-            if stop_event.is_set(): return
-            page.goto(url, wait_until="networkidle", timeout=60000)
-            
-            if stop_event.is_set(): return
-            page.wait_for_selector(".play-button", timeout=45000)
-            
-            time.sleep(2)
-            if stop_event.is_set(): return
+            while not stop_event.is_set():
+                try:
+                    index, url = task_queue.get_nowait()
+                except queue.Empty:
+                    break
 
-            video_config = page.evaluate("() => window.VIDEO_CONFIG")
-            
-            if video_config and "streams" in video_config:
-                streams = video_config["streams"]
-                if streams:
-                    target_url = streams[-1].get("play_url")
-                    if target_url:
-                        if download_file(target_url, file_path, worker_no):
-                            if stop_event.is_set(): return
-                            with excel_lock:
-                                df_temp = pd.read_excel(EXCEL_FILE)
-                                df_temp[NAME_COLUMN] = df_temp[NAME_COLUMN].astype(str)
-                                df_temp.at[index, NAME_COLUMN] = str(random_name)
-                                df_temp.to_excel(EXCEL_FILE, index=False)
-                                print(f"    [Luồng {worker_no}][OK] Đã lưu {random_name}")
-        except Exception:
-            pass
+                worker_task(get_page, sess, index, url, worker_no, writer)
+
+                # dọn trang cũ (dừng video/JS) trước link tiếp theo
+                if st["page"] is not None and not st["page"].is_closed():
+                    try: st["page"].goto("about:blank")
+                    except Exception: pass
         finally:
-            browser.close()
+            if st["browser"] is not None:
+                st["browser"].close()
+            sess.close()
 
 def main():
     if not os.path.exists(EXCEL_FILE):
@@ -111,7 +313,15 @@ def main():
     
     df[NAME_COLUMN] = df[NAME_COLUMN].astype(str)
     df.loc[df[NAME_COLUMN] == 'nan', NAME_COLUMN] = ""
+    # kết quả lần trước chưa ghi được vào Excel (file bị khoá lúc thoát)
+    unsaved = load_unsaved(EXCEL_FILE)
+    for index, video_name in unsaved.items():
+        if index in df.index:
+            df.at[index, NAME_COLUMN] = video_name
     df.to_excel(EXCEL_FILE, index=False)
+    if unsaved:
+        os.remove(unsaved_path(EXCEL_FILE))
+        print(f"[Excel] Đã ghi {len(unsaved)} dòng còn sót từ lần chạy trước")
 
     mask = (df[URL_COLUMN].apply(is_valid_blogger_url)) & ((df[NAME_COLUMN] == "") | (df[NAME_COLUMN].isna()))
     tasks = [(idx, row[URL_COLUMN]) for idx, row in df[mask].iterrows()]
@@ -122,19 +332,28 @@ def main():
 
     print(f"[*] Tổng {len(tasks)} link. Nhấn ESC bất cứ lúc nào để dừng chương trình.")
 
-    # Sử dụng ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for i, (idx, url) in enumerate(tasks):
-            worker_no = (i % MAX_WORKERS) + 1
-            futures.append(executor.submit(worker_task, idx, url, worker_no))
-            
-            # Kiểm tra nếu đã nhấn Esc thì không gửi thêm task mới vào hàng đợi
-            if stop_event.is_set():
-                break
+    # Hàng đợi task dùng chung; mỗi luồng có trình duyệt riêng, sống đến khi hết task hoặc ESC
+    task_queue = queue.Queue()
+    for task in tasks:
+        task_queue.put(task)
+
+    scheduler.configure(max_total=MAX_DOWNLOADS, per_host=HOST_DOWNLOADS,
+                        bytes_per_sec=BANDWIDTH_MBPS * 1e6, policy=DOWNLOAD_PRIORITY)
+    metrics.start(METRICS_FILE, METRICS_INTERVAL, name="bloger")
+    writer = ExcelWriter(EXCEL_FILE)
+    writer.start()
+    workers = [threading.Thread(target=worker_loop, args=(n, task_queue, writer))
+               for n in range(1, min(MAX_WORKERS, len(tasks)) + 1)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    # ghi nốt các video đã tải xong (kể cả khi dừng bằng ESC)
+    writer.close()
 
     # Đợi các luồng hiện tại đóng trình duyệt và thoát
     stop_event.set() 
+    print("[metrics] " + json.dumps(metrics.finish(), ensure_ascii=False))
     print("\n[*] ĐÃ DỪNG CHƯƠNG TRÌNH.")
 
 if __name__ == "__main__":
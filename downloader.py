@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tải file lớn có thể tiếp tục (dùng chung cho craw_quatvn, download_video_bloger):
+- Ghi vào <file>.part, xong mới đổi tên thành file thật. Tên file nên cố định theo URL (stable_name)
+  để chạy lại sau khi bị ngắt tìm thấy đúng .part cũ và chỉ tải phần còn thiếu.
+- Đứt kết nối giữa chừng (kể cả khi đang đọc body) → thử lại với header Range: bytes=<đã có>-.
+- Server bỏ qua Range (trả 200) → ghi lại từ đầu.
+- Kiểm tra kích thước cuối cùng với Content-Length / Content-Range.
+- connections > 1: chia file thành N khoảng byte, tải song song vào file .part đã cấp phát sẵn
+  (tiến độ từng khoảng lưu ở <file>.part.ranges.json); server không hỗ trợ Range → 1 luồng như thường.
+- Mọi kết nối tải đi qua scheduler (giới hạn tổng / mỗi host, băng thông, thứ tự ưu tiên).
+"""
+
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+import metrics
+import scheduler
+
+log = logging.getLogger("downloader")
+
+CHUNK_SIZE = 1024 * 1024
+# lỗi HTTP đáng thử lại; các mã khác (403, 404...) ném ra luôn
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+# file nhỏ hơn mức này thì chia nhiều kết nối không đáng
+MIN_SPLIT_SIZE = 8 * 1024 * 1024
+# ghi lại tiến độ các khoảng byte (.part.ranges.json) tối đa mỗi chừng này byte / giây, và luôn ghi khi kết thúc
+SAVE_EVERY_BYTES = 16 * 1024 * 1024
+SAVE_EVERY_SECS = 2.0
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+def stable_name(key: str, ext: str = "") -> str:
+    """Tên file cố định theo key (URL nguồn): cùng key → cùng tên ở mọi lần chạy."""
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:32] + ext
+
+
+def part_path(out_path) -> Path:
+    out_path = Path(out_path)
+    return out_path.with_name(out_path.name + ".part")
+
+
+def _total_from_response(r: requests.Response, pos: int) -> int | None:
+    """Tổng kích thước file: ưu tiên Content-Range (.../total), rồi Content-Length."""
+    if r.headers.get("Content-Encoding", "identity") != "identity":
+        return None  # body bị nén, số byte ghi ra không khớp Content-Length
+    m = re.match(r"bytes\s+(\d+)-(\d+)/(\d+)", r.headers.get("Content-Range", ""))
+    if m:
+        return int(m.group(3))
+    cl = r.headers.get("Content-Length")
+    if cl and cl.isdigit():
+        return int(cl) + (pos if r.status_code == 206 else 0)
+    return None
+
+
+def download_file(url: str, out_path, sess: requests.Session | None = None,
+                  headers: dict | None = None, retries: int = 5, timeout: int = 60,
+                  backoff: float = 2.0, should_stop=None, connections: int = 1,
+                  size_hint: int | None = None) -> bool:
+    """
+    Tải url về out_path. Trả về True khi xong, False nếu should_stop() báo dừng
+    (file .part được giữ lại). Ném DownloadError / HTTPError khi hết lượt thử.
+    `retries` = số lần lỗi liên tiếp không tải thêm được byte nào.
+    `connections` = số kết nối tối đa cho 1 file (chia khoảng byte nếu server hỗ trợ Range).
+    `size_hint` = kích thước dự kiến (nếu biết) cho policy "smallest" của scheduler.
+    """
+    out_path = Path(out_path)
+    part = part_path(out_path)
+    http = sess or requests
+    sched = scheduler.get()
+    created = time.monotonic()  # retry giữ nguyên thứ tự ưu tiên "oldest"
+
+    if connections > 1:
+        done = _download_multi(url, out_path, http, headers, connections, retries, timeout,
+                               backoff, should_stop, sched, created)
+        if done is not None:
+            return done
+
+    fails = 0
+    last_err: Exception | None = None
+
+    while True:
+        if should_stop and should_stop():
+            return False
+
+        pos = part.stat().st_size if part.exists() else 0
+        h = dict(headers or {})
+        if pos:
+            h["Range"] = f"bytes={pos}-"
+
+        start_pos = pos
+        try:
+            with sched.slot(url, size=size_hint, created=created), \
+                 http.get(url, headers=h, stream=True, timeout=timeout) as r:
+                if r.status_code == 416 and pos:
+                    # đã có đủ file (hoặc .part hỏng) → kiểm tra tổng kích thước
+                    m = re.match(r"bytes\s+\*/(\d+)", r.headers.get("Content-Range", ""))
+                    if m and int(m.group(1)) == pos:
+                        os.replace(part, out_path)
+                        return True
+                    part.unlink(missing_ok=True)
+                    raise DownloadError(f"416 Range Not Satisfiable tại byte {pos}")
+                if r.status_code in RETRY_STATUS:
+                    raise DownloadError(f"HTTP {r.status_code}")
+                r.raise_for_status()
+
+                if pos and r.status_code != 206:
+                    # server không hỗ trợ Range → tải lại từ đầu
+                    pos = 0
+                elif r.status_code == 206:
+                    m = re.match(r"bytes\s+(\d+)-", r.headers.get("Content-Range", ""))
+                    if m and int(m.group(1)) != pos:
+                        part.unlink(missing_ok=True)
+                        raise DownloadError(f"Content-Range lệch: {m.group(1)} != {pos}")
+                total = _total_from_response(r, pos)
+
+                with open(part, "ab" if pos else "wb") as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        if should_stop and should_stop():
+                            return False
+                        if chunk:
+                            f.write(chunk)
+                            pos += len(chunk)
+                            sched.throttle(len(chunk))
+
+            if total is not None and pos != total:
+                if pos > total:
+                    part.unlink(missing_ok=True)
+                raise DownloadError(f"Sai kích thước: {pos}/{total} bytes")
+
+            os.replace(part, out_path)
+            return True
+
+        except requests.HTTPError:
+            raise
+        except (requests.RequestException, DownloadError, OSError) as e:
+            last_err = e
+            cur = part.stat().st_size if part.exists() else 0
+            # có tải thêm được byte thì reset bộ đếm lỗi
+            fails = 0 if cur > start_pos else fails + 1
+            if fails > retries:
+                metrics.incr("download", "failures")
+                raise DownloadError(f"Tải thất bại sau {retries} lần thử: {last_err}") from e
+            wait = backoff * max(1, fails)
+            metrics.incr("download", "retries")
+            log.warning(f"  - Đứt tải {out_path.name} tại {cur} bytes ({e}); thử lại sau {wait:.0f}s")
+            time.sleep(wait)
+
+
+# ---------- Nhiều kết nối / 1 file ----------
+def ranges_path(out_path) -> Path:
+    out_path = Path(out_path)
+    return out_path.with_name(out_path.name + ".part.ranges.json")
+
+
+def _probe_size(url, http, headers, timeout) -> int | None:
+    """GET bytes=0-0: trả về tổng kích thước nếu server hỗ trợ Range, ngược lại None."""
+    h = dict(headers or {})
+    h["Range"] = "bytes=0-0"
+    try:
+        with http.get(url, headers=h, stream=True, timeout=timeout) as r:
+            if r.status_code != 206:
+                return None
+            if r.headers.get("Accept-Ranges", "bytes").lower() == "none":
+                return None
+            m = re.match(r"bytes\s+\d+-\d+/(\d+)", r.headers.get("Content-Range", ""))
+            return int(m.group(1)) if m else None
+    except requests.RequestException:
+        return None
+
+
+class _RangeState:
+    """Tiến độ các khoảng byte: [[start, pos, end], ...] (end inclusive), ghi ra json để tiếp tục."""
+
+    def __init__(self, path: Path, size: int, n: int):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.ranges = self._load()
+        if self.ranges is None:
+            step = -(-size // n)
+            self.ranges = [[s, s, min(s + step, size) - 1] for s in range(0, size, step)]
+            self.save()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("size") == self.size:
+                return data["ranges"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def advance(self, i: int, n: int):
+        with self._lock:
+            self.ranges[i][1] += n
+            self._unsaved += n
+            if self._unsaved < SAVE_EVERY_BYTES and time.monotonic() - self._saved_at < SAVE_EVERY_SECS:
+                return
+            data = self._snapshot()
+        self._write(data)
+
+    def save(self):
+        with self._lock:
+            data = self._snapshot()
+        self._write(data)
+
+    def _snapshot(self) -> str:
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        return json.dumps({"size": self.size, "ranges": self.ranges})
+
+    def _write(self, data: str):
+        # ghi ngoài self._lock: các luồng tải khác không phải chờ I/O
+        # (bản ghi cũ hơn có ghi đè sau thì chỉ làm lần sau tải lại vài MB, không mất dữ liệu)
+        with self._io_lock:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, self.path)
+
+    def complete(self) -> bool:
+        return all(pos > end for _, pos, end in self.ranges)
+
+
+def _download_multi(url, out_path: Path, http, headers, connections, retries, timeout,
+                    backoff, should_stop, sched, created) -> bool | None:
+    """Trả về None nếu không chia được (để gọi tiếp bản 1 luồng)."""
+    part = part_path(out_path)
+    rpath = ranges_path(out_path)
+    # .part của bản 1 luồng (không có file tiến độ) → để bản 1 luồng tiếp tục
+    if part.exists() and not rpath.exists():
+        return None
+    with sched.slot(url, created=created):
+        size = _probe_size(url, http, headers, timeout)
+    if not size or size < MIN_SPLIT_SIZE:
+        return None
+
+    state = _RangeState(rpath, size, connections)
+    # cấp phát trước đủ dung lượng; các luồng ghi thẳng vào đúng offset
+    with open(part, "r+b" if part.exists() else "wb") as f:
+        f.truncate(size)
+
+    stopped = threading.Event()
+
+    def fetch(i: int):
+        fails = 0
+        with open(part, "r+b") as f:
+            while True:
+                _, pos, end = state.ranges[i]
+                if pos > end:
+                    return
+                if stopped.is_set() or (should_stop and should_stop()):
+                    stopped.set()
+                    return
+                h = dict(headers or {})
+                h["Range"] = f"bytes={pos}-{end}"
+                got = 0
+                try:
+                    with sched.slot(url, size=size, created=created), \
+                         http.get(url, headers=h, stream=True, timeout=timeout) as r:
+                        if r.status_code in RETRY_STATUS:
+                            raise DownloadError(f"HTTP {r.status_code}")
+                        r.raise_for_status()
+                        if r.status_code != 206:
+                            raise DownloadError(f"Server không trả 206 cho khoảng {pos}-{end}")
+                        f.seek(pos)
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            if should_stop and should_stop():
+                                stopped.set()
+                                return
+                            if chunk:
+                                chunk = chunk[:end + 1 - pos - got]
+                                f.write(chunk)
+                                got += len(chunk)
+                                state.advance(i, len(chunk))
+                                sched.throttle(len(chunk))
+                    if state.ranges[i][1] <= end:
+                        raise DownloadError(f"Khoảng {pos}-{end} thiếu dữ liệu")
+                except requests.HTTPError:
+                    raise
+                except (requests.RequestException, DownloadError, OSError) as e:
+                    fails = 0 if got else fails + 1
+                    if fails > retries:
+                        metrics.incr("download", "failures")
+                        raise DownloadError(f"Khoảng {i} thất bại sau {retries} lần thử: {e}") from e
+                    wait = backoff * max(1, fails)
+                    metrics.incr("download", "retries")
+                    log.warning(f"  - Đứt khoảng {i} của {out_path.name} ({e}); thử lại sau {wait:.0f}s")
+                    time.sleep(wait)
+
+    todo = [i for i, (_, pos, end) in enumerate(state.ranges) if pos <= end]
+    err = None
+    with ThreadPoolExecutor(max_workers=max(1, min(connections, len(todo) or 1))) as ex:
+        for fut in [ex.submit(fetch, i) for i in todo]:
+            try:
+                fut.result()
+            except Exception as e:
+                stopped.set()  # 1 khoảng hỏng hẳn → dừng các khoảng còn lại
+                err = err or e
+    state.save()  # advance() chỉ lưu theo đợt → lưu tiến độ cuối (kể cả khi dừng / lỗi)
+    if err is not None:
+        raise err
+
+    if stopped.is_set():
+        return False
+    if not state.complete():
+        raise DownloadError(f"Chưa tải đủ {out_path.name}")
+    os.replace(part, out_path)
+    rpath.unlink(missing_ok=True)
+    return True
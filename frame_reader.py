@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Giải mã video ở thread riêng cho các player review (playvideo_loc, playvideo_loc_webp).
+- Thread đọc frame, scale sẵn về kích thước hiển thị, dựng vào canvas và vẽ overlay phụ thuộc frame
+  (thời gian, thanh tiến trình) → vòng UI chỉ còn imshow + xử lý phím.
+- Ring buffer tối đa BUFFER_FRAMES canvas (và tối đa BUFFER_BYTES), cấp phát dần khi cần rồi dùng lại mãi
+  (không np.zeros mỗi frame). Reader mở sẵn bằng prefetch() chỉ giải mã trước PREFETCH_FRAMES frame
+  cho tới khi tới lượt phát.
+- seek(): bỏ các frame đã giải mã trước đó, thread giải mã nạp lại từ vị trí mới.
+  Có chỉ mục keyframe (keyframe_index.py, build nền lúc mở video hoặc đọc cache) thì nhảy ngay tới keyframe
+  gần nhất phía trước để hiện liền, rồi mới giải mã tiếp tới đúng frame cần tua (grab, không dựng ảnh).
+
+    reader = FrameReader(path, box=(1536, 864), letterbox=True, overlay=draw)
+    if reader.wait_ready():
+        res = reader.get(timeout=1.0)   # (pos, canvas) | None (chưa có frame / hết video)
+        ...
+        reader.seek(pos + 5 * reader.fps)
+    reader.close()
+
+set_speed(): xem lướt 2x-16x (frame không hiển thị chỉ grab(), không dựng ảnh) hoặc chỉ xem keyframe
+  (nhảy keyframe → keyframe theo chỉ mục, không giải mã frame ở giữa).
+prefetch(): mở sẵn video kế tiếp trong hàng chờ (giải mã sẵn PREFETCH_FRAMES frame đầu) trong lúc video hiện tại đang phát.
+screen_size(): kích thước màn hình, hỏi Tk 1 lần rồi nhớ.
+
+overlay(canvas, pos, reader) chạy trong thread giải mã; canvas của frame đang hiển thị thuộc về UI
+cho tới lần get() kế tiếp.
+"""
+
+from __future__ import annotations
+import functools
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import keyframe_index
+
+BUFFER_FRAMES = 32  # số frame giải mã trước tối đa (~1s với video 25-30fps)
+BUFFER_BYTES = 64 * 1024 * 1024  # ... nhưng tổng canvas không quá chừng này (cửa sổ 1536x864 → 16 frame)
+PREFETCH_FRAMES = 8  # reader mở sẵn cho video kế tiếp (chưa phát)
+SPEEDS = (1, 2, 4, 8, 16)  # tốc độ xem lướt
+KEYFRAME_FPS = 4.0  # chế độ chỉ keyframe: số keyframe hiển thị mỗi giây
+
+
+@functools.lru_cache(maxsize=1)
+def screen_size() -> tuple[int, int]:
+    """Kích thước màn hình (tkinter, chạy được win/macos/linux); chỉ tạo Tk lần đầu."""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        size = (root.winfo_screenwidth(), root.winfo_screenheight())
+        root.destroy()
+        return size
+    except Exception:
+        return 1920, 1080
+
+
+def speed_key(reader, key, pacer=None) -> bool:
+    """Phím 1-5 = tốc độ 1x/2x/4x/8x/16x, 0 = bật/tắt chỉ keyframe. True nếu key là phím tốc độ."""
+    if ord('1') <= key < ord('1') + len(SPEEDS):
+        reader.set_speed(SPEEDS[key - ord('1')], keyframes_only=False)
+    elif key == ord('0'):
+        reader.set_speed(reader.speed, keyframes_only=not reader.keyframes_only)
+    else:
+        return False
+    if pacer is not None:
+        pacer.set_fps(reader.display_fps)
+    return True
+
+
+def speed_label(reader) -> str:
+    """Nhãn tốc độ để vẽ cạnh thời gian: "" (1x), "x4", "KEYFRAME"."""
+    if reader.keyframes_only:
+        return "KEYFRAME"
+    return f"x{reader.speed}" if reader.speed > 1 else ""
+
+
+def prefetch(items, open_reader):
+    """
+    Duyệt items, trả về (item, reader). Reader của item kế tiếp được mở (và bắt đầu giải mã) ngay khi
+    item hiện tại được trả ra, nên sang video sau gần như tức thì. Người gọi đóng reader hiện tại;
+    reader mở sẵn còn lại được đóng khi generator kết thúc / bị close().
+    """
+    def open_next(item):
+        if item is None:
+            return None, 0
+        r = open_reader(item)
+        full = r.capacity
+        r.set_capacity(min(full, PREFETCH_FRAMES))  # chưa phát → chỉ giữ ít frame trong RAM
+        return r, full
+
+    it = iter(items)
+    nxt = next(it, None)
+    reader, full = open_next(nxt)
+    try:
+        while nxt is not None:
+            cur, cur_reader, cur_full = nxt, reader, full
+            nxt = next(it, None)
+            reader, full = open_next(nxt)
+            cur_reader.set_capacity(cur_full)
+            yield cur, cur_reader
+    finally:
+        if reader is not None:
+            reader.close()
+
+
+class FrameReader:
+    def __init__(self, video_path, box, letterbox: bool = False, upscale: bool = False,
+                 overlay=None, capacity: int = BUFFER_FRAMES):
+        """
+        box: (rộng, cao) tối đa để hiển thị; video được scale giữ tỉ lệ cho vừa box
+        (upscale=False: không phóng to quá kích thước gốc).
+        letterbox=True: canvas đúng bằng box, video nằm giữa, viền đen; False: canvas = kích thước video đã scale.
+        """
+        self.video_path = str(video_path)
+        self.box = (int(box[0]), int(box[1]))
+        self.letterbox = letterbox
+        self.upscale = upscale
+        self.overlay = overlay
+        self.capacity = max(2, int(capacity))
+        self._max_slots = self.capacity + 1  # + 1 slot UI đang hiển thị; giảm theo BUFFER_BYTES trong _open
+
+        # thông tin video, có sau wait_ready()
+        self.ok = False
+        self.fps = 25.0
+        self.total_frames = 0
+        self.size = (0, 0)               # (rộng, cao) canvas
+        self.video_rect = (0, 0, 0, 0)   # (x, y, rộng, cao) vùng video trong canvas
+        self.keyframes = None            # KeyframeIndex, có sau khi build xong (thread nền)
+        self.speed = 1                   # hiển thị 1 frame, bỏ qua speed-1 frame
+        self.keyframes_only = False
+
+        self._ready = threading.Event()
+        self._cond = threading.Condition()
+        self._slots: list[np.ndarray] = []
+        self._free: deque = deque()
+        self._filled: deque = deque()    # (pos, slot)
+        self._shown = None               # slot UI đang hiển thị
+        self._shown_pos = -1
+        self._target = None              # frame đích của lần tua gần nhất, tới khi hiện được frame đó
+        self._seek_to = None
+        self._gen = 0                    # tăng mỗi lần seek; frame giải mã dở của lượt cũ bị bỏ
+        self._eof = False
+        self._stop = False
+        self._raw = None
+        self._small = None
+
+        self._thread = threading.Thread(target=self._run, name="frame-reader", daemon=True)
+        self._thread.start()
+
+    # ---- phía UI ----
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Chờ mở xong video. False nếu không mở / không đọc được."""
+        self._ready.wait(timeout)
+        return self.ok
+
+    def get(self, timeout: float | None = None):
+        """Frame kế tiếp (pos, canvas); None nếu hết timeout hoặc đã hết video (xem eof)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._filled or self._eof or self._stop, timeout):
+                return None
+            if not self._filled:
+                return None
+            if self._shown is not None:
+                self._free.append(self._shown)
+            pos, slot = self._filled.popleft()
+            self._shown, self._shown_pos = slot, pos
+            if self._target is not None and pos >= self._target:
+                self._target = None
+            self._cond.notify_all()
+            return pos, self._slots[slot]
+
+    @property
+    def position(self) -> int:
+        """Vị trí hiện tại theo ý người xem: frame đích nếu đang tua dở (đang hiện keyframe), không thì frame đang hiện."""
+        with self._cond:
+            return self._target if self._target is not None else max(self._shown_pos, 0)
+
+    @property
+    def eof(self) -> bool:
+        with self._cond:
+            return self._eof and not self._filled
+
+    def seek(self, frame: int, exact: bool = True) -> None:
+        """
+        Nhảy tới frame; các frame đã giải mã sẵn bị bỏ, thread giải mã nạp lại từ vị trí mới.
+        Có chỉ mục keyframe: hiện keyframe phía trước ngay, exact=True thì giải mã tiếp tới đúng frame.
+        """
+        with self._cond:
+            self._seek_locked(frame, exact, preview=True)
+
+    def set_speed(self, speed: int = 1, keyframes_only: bool = False) -> None:
+        """
+        Đổi tốc độ xem: speed lần (bỏ qua frame bằng grab) hoặc chỉ keyframe (cần chỉ mục keyframe,
+        chưa có thì lướt ở tốc độ lớn nhất). Frame đã giải mã theo tốc độ cũ bị bỏ, phát tiếp từ sau frame đang hiện.
+        """
+        with self._cond:
+            if (speed, keyframes_only) == (self.speed, self.keyframes_only):
+                return
+            self.speed, self.keyframes_only = max(1, int(speed)), keyframes_only
+            if self._target is not None:
+                resume = self._target  # đang tua dở
+            else:
+                resume = self._filled[0][0] if self._filled else self._shown_pos + 1
+            self._seek_locked(resume, exact=True, preview=False)
+
+    @property
+    def display_fps(self) -> float:
+        """Nhịp hiển thị cho Pacer: fps gốc, riêng chế độ chỉ keyframe là KEYFRAME_FPS."""
+        if self.keyframes_only and self.keyframes is not None:
+            return min(KEYFRAME_FPS, self.fps)
+        return self.fps
+
+    def set_capacity(self, capacity: int) -> None:
+        """Đổi số frame giải mã trước (slot đã cấp phát không bị thu hồi, chỉ thôi cấp thêm)."""
+        with self._cond:
+            self.capacity = max(2, int(capacity))
+            self._max_slots = self._limit_slots()
+            self._cond.notify_all()
+
+    def _limit_slots(self) -> int:
+        cw, ch = self.size
+        budget = BUFFER_BYTES // (cw * ch * 3) if cw and ch else self.capacity
+        return min(self.capacity, max(2, budget)) + 1
+
+    def _seek_locked(self, frame, exact, preview):
+        last = self.total_frames - 1 if self.total_frames > 0 else frame
+        frame = int(max(0, min(frame, last)))
+        # preview=False: không hiện keyframe, giải mã thẳng tới frame (dùng khi đổi tốc độ, tránh giật lùi)
+        self._seek_to = (frame, exact, preview)
+        self._target = frame if exact else None
+        self._gen += 1
+        self._free.extend(slot for _, slot in self._filled)
+        self._filled.clear()
+        self._eof = False
+        self._cond.notify_all()
+
+    def redraw(self):
+        """
+        Dựng lại frame đang hiển thị (sạch overlay của UI). Chỉ dùng khi đã hết video (eof),
+        lúc thread giải mã đứng yên, để UI vẽ lại chữ trạng thái lên frame cuối.
+        """
+        with self._cond:
+            if self._shown is None or self._small is None:
+                return None
+            canvas = self._slots[self._shown]
+            self._compose(canvas, self._shown_pos)
+            return self._shown_pos, canvas
+
+    def close(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+
+    # ---- thread giải mã ----
+    def _open(self):
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+        # đọc frame đầu để biết kích thước thật (CAP_PROP_FRAME_WIDTH có thể = 0)
+        ok, raw = cap.read()
+        if not ok:
+            cap.release()
+            return None
+        vh, vw = raw.shape[:2]
+        bw, bh = self.box
+        scale = min(bw / vw, bh / vh)
+        if not self.upscale:
+            scale = min(scale, 1.0)
+        nw, nh = max(1, int(vw * scale)), max(1, int(vh * scale))
+        cw, ch = (bw, bh) if self.letterbox else (nw, nh)
+
+        self.size = (cw, ch)
+        self.video_rect = ((cw - nw) // 2, (ch - nh) // 2, nw, nh)
+        self._raw = raw
+        self._small = np.empty((nh, nw, 3), dtype=np.uint8)
+        with self._cond:
+            self._max_slots = self._limit_slots()
+        return cap
+
+    def _take_slot(self):
+        """Slot trống (gọi khi giữ self._cond); chưa đủ _max_slots thì cấp thêm 1 slot. None nếu đã hết."""
+        if self._free:
+            return self._free.popleft()
+        if len(self._slots) < self._max_slots:
+            self._slots.append(None)  # np.zeros ngoài khoá, xem _run
+            return len(self._slots) - 1
+        return None
+
+    def _compose(self, canvas, pos):
+        x, y, w, h = self.video_rect
+        canvas[y:y + h, x:x + w] = self._small
+        # xoá overlay cũ ở viền đen (canvas được dùng lại)
+        if y:
+            canvas[:y] = 0
+            canvas[y + h:] = 0
+        if x:
+            canvas[:, :x] = 0
+            canvas[:, x + w:] = 0
+        if self.overlay is not None:
+            self.overlay(canvas, pos, self)
+
+    def _run(self):
+        try:
+            cap = self._open()
+        except Exception as e:
+            print(f"Không mở được video: {self.video_path} ({e})")
+            cap = None
+        self.ok = cap is not None
+        self._ready.set()
+        if cap is None:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+            return
+        threading.Thread(target=self._load_index, name="keyframe-index", daemon=True).start()
+
+        pos = 0
+        have_raw = True  # frame 0 đã đọc trong _open
+        refine_to = None  # frame cần tới sau khi đã hiện keyframe
+        check = None      # (keyframe theo chỉ mục, frame thực sự cần) → kiểm tra lại sau lần đọc kế tiếp
+        try:
+            while True:
+                with self._cond:
+                    while not self._stop and self._seek_to is None and \
+                            (self._eof or not (self._free or len(self._slots) < self._max_slots)):
+                        self._cond.wait()
+                    if self._stop:
+                        break
+                    seek, self._seek_to = self._seek_to, None
+                    gen = self._gen
+                if seek is not None:
+                    target, exact, preview = seek
+                    kf = self.keyframes.floor(target) if self.keyframes is not None else target
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, kf)
+                    pos, have_raw = kf, False
+                    refine_to = None
+                    check = (kf, target) if self.keyframes is not None else None
+                    if exact and target > kf:
+                        if preview:
+                            refine_to = target
+                        else:
+                            pos = self._skip(cap, pos, target, gen)
+                    continue
+
+                if not have_raw:
+                    ok, raw = cap.read(self._raw)
+                    if not ok:
+                        with self._cond:
+                            if gen == self._gen:
+                                self._eof = True
+                                self._cond.notify_all()
+                        continue
+                    self._raw = raw
+                    if check is not None:
+                        kf, target = check
+                        check = None
+                        if not self._seek_ok(cap, kf):
+                            # chỉ mục không khớp cách OpenCV đếm frame (VFR, pts lệch...) → bỏ chỉ mục, tua chính xác
+                            print(f"Chỉ mục keyframe không khớp, tua chính xác: {self.video_path}")
+                            self.keyframes = None
+                            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                            pos, refine_to = target, None
+                            continue
+                have_raw = False
+
+                with self._cond:
+                    if gen != self._gen:
+                        continue
+                    slot = self._take_slot()
+                    if slot is None:
+                        have_raw = True  # vừa bị giảm capacity → giữ frame, chờ slot trống
+                        continue
+                if self._slots[slot] is None:
+                    cw, ch = self.size
+                    self._slots[slot] = np.zeros((ch, cw, 3), dtype=np.uint8)
+                _, _, w, h = self.video_rect
+                cv2.resize(self._raw, (w, h), dst=self._small)
+                self._compose(self._slots[slot], pos)
+                with self._cond:
+                    if gen == self._gen:
+                        self._filled.append((pos, slot))
+                    else:
+                        self._free.append(slot)
+                    self._cond.notify_all()
+                pos += 1
+
+                if refine_to is not None:
+                    # keyframe đã hiện; bỏ qua các frame ở giữa, frame đọc kế tiếp là refine_to
+                    pos = self._skip(cap, pos, refine_to, gen)
+                    refine_to = None
+                elif self.keyframes_only and self.keyframes is not None:
+                    # chỉ keyframe: nhảy thẳng tới keyframe sau frame vừa hiện, không giải mã phần giữa
+                    nk = self.keyframes.next_after(pos - 1)
+                    if nk is None:
+                        with self._cond:
+                            if gen == self._gen:
+                                self._eof = True
+                                self._cond.notify_all()
+                    elif nk > pos:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, nk)
+                        pos = nk
+                        check = (nk, nk)
+                else:
+                    speed = SPEEDS[-1] if self.keyframes_only else self.speed
+                    if speed > 1:
+                        pos = self._skip(cap, pos, pos + speed - 1, gen)
+        finally:
+            cap.release()
+
+    def _skip(self, cap, pos, target, gen) -> int:
+        """grab() (giải mã nhưng không chuyển màu / copy ảnh) tới khi frame đọc kế tiếp là target."""
+        while pos < target and gen == self._gen and not self._stop:
+            if not cap.grab():
+                break
+            pos += 1
+        return pos
+
+    def _seek_ok(self, cap, frame) -> bool:
+        """
+        Sau cap.read(): frame vừa đọc có đúng là keyframe frame của chỉ mục không, so theo thời điểm.
+        (Không so CAP_PROP_POS_FRAMES: sau cap.set OpenCV luôn báo đúng frame vừa yêu cầu.)
+        """
+        idx = self.keyframes
+        t = idx.time_of(frame) if idx is not None else None
+        if t is None:
+            return True
+        return abs(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 - t) <= max(1.5 / self.fps, 0.05)
+
+    def _load_index(self):
+        try:
+            self.keyframes = keyframe_index.load_or_build(self.video_path)
+        except Exception as e:
+            print(f"Không build được chỉ mục keyframe: {self.video_path} ({e})")
+
+
+class Pacer:
+    """
+    Giữ nhịp hiển thị theo fps (tính theo mốc thời gian nên thời gian imshow / vẽ không cộng dồn vào độ trễ).
+    reader: nếu có, mỗi lần wait_ms() theo reader.display_fps (vd: bật chỉ keyframe trước khi chỉ mục
+    build xong → khi có chỉ mục tự chuyển sang KEYFRAME_FPS).
+    """
+
+    def __init__(self, fps: float, reader=None):
+        self.reader = reader
+        self.set_fps(fps)
+
+    def reset(self) -> None:
+        self._next = time.perf_counter()
+
+    def set_fps(self, fps: float) -> None:
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.interval = 1.0 / self.fps
+        self.reset()
+
+    def wait_ms(self) -> int:
+        """Số ms cần waitKey để tới mốc frame kế tiếp (tối thiểu 1)."""
+        if self.reader is not None and self.reader.display_fps != self.fps:
+            self.set_fps(self.reader.display_fps)
+        self._next += self.interval
+        now = time.perf_counter()
+        delay = self._next - now
+        if delay < -0.25:
+            # trễ nhiều (vừa seek, chờ giải mã) → bắt nhịp lại từ bây giờ
+            self._next = now
+            delay = 0.0
+        return max(1, int(delay * 1000))
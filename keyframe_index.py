@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Chỉ mục keyframe cho từng video (dùng khi tua trong player review, xem frame_reader.py).
+- Lấy danh sách packet bằng ffprobe (chỉ đọc container, không giải mã → nhanh cả với file dài).
+- Số frame của keyframe = thứ tự packet theo pts (không tính từ pts × fps → đúng cả với VFR / pts đầu khác 0).
+- Cache cạnh video: <video>.keyframes.json (kèm size + mtime, video đổi thì tự build lại).
+- Không có ffprobe / lỗi → None, player tua chính xác như cũ (chậm hơn).
+
+Usage (build sẵn cho cả thư mục):
+    python keyframe_index.py --video_dir luuvideo/videos
+"""
+
+from __future__ import annotations
+import argparse
+import bisect
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+FFPROBE = "ffprobe"  # hoặc đường dẫn đầy đủ, vd: C:\ffmpeg\bin\ffprobe.exe
+CACHE_SUFFIX = ".keyframes.json"
+CACHE_VERSION = 2  # 1: chỉ có "times" (frame = pts × fps, sai với VFR)
+VIDEO_EXTS = (".mp4", ".mkv", ".webm", ".mov", ".avi", ".ts")
+
+
+class KeyframeIndex:
+    """
+    frames: số thứ tự frame (tính từ 0, như CAP_PROP_POS_FRAMES) của các keyframe, tăng dần.
+    times: thời điểm (giây, tính từ frame đầu) tương ứng — để kiểm tra lại sau khi seek.
+    """
+
+    def __init__(self, frames: list[int], times: list[float]):
+        pairs = sorted(zip(frames, times)) or [(0, 0.0)]
+        self.frames = [f for f, _ in pairs]
+        self.times = [t for _, t in pairs]
+
+    def time_of(self, frame: int) -> float | None:
+        i = bisect.bisect_left(self.frames, frame)
+        return self.times[i] if i < len(self.frames) and self.frames[i] == frame else None
+
+    def floor(self, frame: int) -> int:
+        """Keyframe gần nhất ở trước (hoặc đúng) frame: giải mã từ đây tới frame là ít nhất."""
+        i = bisect.bisect_right(self.frames, frame) - 1
+        return self.frames[max(i, 0)]
+
+    def next_after(self, frame: int) -> int | None:
+        i = bisect.bisect_right(self.frames, frame)
+        return self.frames[i] if i < len(self.frames) else None
+
+    def prev_before(self, frame: int) -> int | None:
+        i = bisect.bisect_left(self.frames, frame) - 1
+        return self.frames[i] if i >= 0 else None
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def cache_path(video_path) -> Path:
+    p = Path(video_path)
+    return p.with_name(p.name + CACHE_SUFFIX)
+
+
+def probe_keyframes(video_path) -> tuple[list[int], list[float]] | None:
+    """
+    (frames, times) các keyframe của luồng video đầu tiên; None nếu không chạy được ffprobe.
+    Packet đọc theo thứ tự giải mã (dts) → xếp lại theo pts để ra thứ tự hiển thị = số frame.
+    """
+    exe = shutil.which(FFPROBE) or (FFPROBE if os.path.isfile(FFPROBE) else None)
+    if exe is None:
+        return None
+    cmd = [exe, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", str(video_path)]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=120).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    pts, keys = [], []
+    for ln in out.splitlines():
+        parts = ln.strip().split(",")
+        if len(parts) < 2:
+            continue
+        try:
+            t = float(parts[0])
+        except ValueError:
+            continue  # pts_time = N/A
+        pts.append(t)
+        if "K" in parts[1]:
+            keys.append(t)
+    if not keys:
+        return None
+    pts.sort()
+    t0 = pts[0]
+    frames = [bisect.bisect_left(pts, t) for t in keys]
+    return frames, [round(t - t0, 6) for t in keys]
+
+def load_or_build(video_path) -> KeyframeIndex | None:
+    """Đọc cache cạnh video nếu còn khớp, không thì chạy ffprobe rồi ghi cache."""
+    video_path = Path(video_path)
+    try:
+        st = video_path.stat()
+    except OSError:
+        return None
+    cp = cache_path(video_path)
+    try:
+        data = json.loads(cp.read_text(encoding="utf-8"))
+        if (data.get("version") == CACHE_VERSION and data.get("size") == st.st_size
+                and data.get("mtime") == int(st.st_mtime)):
+            return KeyframeIndex(data["frames"], data["times"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    probed = probe_keyframes(video_path)
+    if not probed:
+        return None
+    frames, times = probed
+    try:
+        tmp = cp.with_name(cp.name + ".tmp")
+        tmp.write_text(json.dumps({"version": CACHE_VERSION, "size": st.st_size, "mtime": int(st.st_mtime),
+                                   "frames": frames, "times": times}), encoding="utf-8")
+        os.replace(tmp, cp)
+    except OSError:
+        pass  # thư mục chỉ đọc → vẫn dùng chỉ mục trong RAM
+    return KeyframeIndex(frames, times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--video_dir", type=str, required=True, help="Thư mục video cần build chỉ mục keyframe")
+    args = ap.parse_args()
+    n = 0
+    for p in sorted(Path(args.video_dir).iterdir()):
+        if p.suffix.lower() not in VIDEO_EXTS:
+            continue
+        idx = load_or_build(p)
+        print(f"{p.name}: {len(idx) if idx else 'không build được'} keyframe")
+        n += bool(idx)
+    print(f"==> {n} video có chỉ mục keyframe")
+
+
+if __name__ == "__main__":
+    main()
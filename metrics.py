@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Đo thời gian / thông lượng theo stage cho các crawler (dùng chung, an toàn giữa các thread).
+- with metrics.timer("video"): ...        → số lần, tổng/min/max/p50/p95 thời gian; lỗi trong khối → failures
+- metrics.add_bytes("video", n)            → tổng byte (tính MB/s)
+- metrics.incr("download", "retries")      → bộ đếm bất kỳ theo stage
+- metrics.start("crawl_metrics.json", 10)  → thread nền ghi lại file JSON mỗi 10s (dashboard đọc file này)
+- metrics.finish()                         → ghi file lần cuối + log 1 dòng JSON tổng kết
+
+Chưa gọi start() thì mọi hàm vẫn chạy (chỉ gom số liệu trong RAM), nên module dùng chung như
+downloader có thể ghi số liệu mà không cần biết script nào đang chạy.
+"""
+
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+log = logging.getLogger("metrics")
+
+# số mẫu thời gian giữ lại mỗi stage để tính p50/p95
+SAMPLES = 2000
+
+
+class _Stage:
+    __slots__ = ("count", "failures", "total", "min", "max", "bytes", "counters", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.bytes = 0
+        self.counters: dict[str, int] = {}
+        self.samples: deque = deque(maxlen=SAMPLES)
+
+    def as_dict(self, elapsed: float) -> dict:
+        d = {"count": self.count, "failures": self.failures}
+        if self.count:
+            ss = sorted(self.samples)
+            d.update(total_s=round(self.total, 3),
+                     mean_ms=round(self.total / self.count * 1000, 1),
+                     min_ms=round((self.min or 0) * 1000, 1),
+                     p50_ms=round(ss[len(ss) // 2] * 1000, 1),
+                     p95_ms=round(ss[min(len(ss) - 1, int(0.95 * len(ss)))] * 1000, 1),
+                     max_ms=round(self.max * 1000, 1))
+        if self.bytes:
+            d.update(bytes=self.bytes, mb_per_s=round(self.bytes / 1e6 / max(elapsed, 1e-6), 2))
+        d.update(self.counters)
+        return d
+
+
+class Metrics:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: dict[str, _Stage] = {}
+        self._path: Path | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _stage(self, stage: str) -> _Stage:
+        st = self._stages.get(stage)
+        if st is None:
+            st = self._stages.setdefault(stage, _Stage())
+        return st
+
+    # ---- ghi số liệu ----
+    def observe(self, stage: str, secs: float, ok: bool = True) -> None:
+        with self._lock:
+            st = self._stage(stage)
+            st.count += 1
+            st.total += secs
+            st.min = secs if st.min is None else min(st.min, secs)
+            st.max = max(st.max, secs)
+            st.samples.append(secs)
+            if not ok:
+                st.failures += 1
+
+    @contextmanager
+    def timer(self, stage: str):
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(stage, time.perf_counter() - t0, ok)
+
+    def add_bytes(self, stage: str, n: int) -> None:
+        if n:
+            with self._lock:
+                self._stage(stage).bytes += n
+
+    def incr(self, stage: str, key: str, n: int = 1) -> None:
+        with self._lock:
+            st = self._stage(stage)
+            if key == "failures":
+                st.failures += n
+            else:
+                st.counters[key] = st.counters.get(key, 0) + n
+
+    # ---- xuất ----
+    def snapshot(self) -> dict:
+        elapsed = time.perf_counter() - self._t0
+        with self._lock:
+            stages = {k: v.as_dict(elapsed) for k, v in self._stages.items()}
+        return {"name": self.name, "started": int(self.started), "updated": int(time.time()),
+                "elapsed_s": round(elapsed, 3), "stages": stages}
+
+    def write(self, path=None) -> None:
+        path = Path(path or self._path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)  # đọc giữa chừng không bao giờ thấy file ghi dở
+
+    def start(self, path, interval: float = 10.0, name: str | None = None) -> None:
+        """Bật ghi file định kỳ; path rỗng = chỉ gom số liệu, không ghi file."""
+        if name:
+            self.name = name
+        if not path:
+            return
+        self._path = Path(path)
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.write()
+                except OSError as e:
+                    log.warning(f"[metrics] Không ghi được {self._path}: {e}")
+
+        self._thread = threading.Thread(target=loop, name="metrics", daemon=True)
+        self._thread.start()
+
+    def finish(self) -> dict:
+        """Dừng thread nền, ghi file lần cuối và log tổng kết JSON. Gọi nhiều lần không sao."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        snap = self.snapshot()
+        if self._path is not None:
+            try:
+                self.write()
+            except OSError as e:
+                log.warning(f"[metrics] Không ghi được {self._path}: {e}")
+        log.info("[metrics] " + json.dumps(snap, ensure_ascii=False))
+        return snap
+
+
+# registry mặc định cho cả tiến trình
+_default = Metrics()
+
+timer = _default.timer
+observe = _default.observe
+add_bytes = _default.add_bytes
+incr = _default.incr
+snapshot = _default.snapshot
+start = _default.start
+finish = _default.finish
@@ -1,8 +1,11 @@
 import os
 import cv2
-import pandas as pd
+from contextlib import closing
 from datetime import datetime
 
+from frame_reader import FrameReader, Pacer, prefetch, screen_size, speed_key, speed_label
+from review_journal import ReviewJournal
+
 # ==== CẤU HÌNH ====
 EXCEL_PATH = r"C:\code\quatvn\ketqua.xlsx"   # đường dẫn file excel (can sua)
 VIDEO_DIR  = r"C:\code\quatvn\luuvideo\videos"          # thư mục chứa video (can sua)
@@ -11,10 +14,41 @@ LOG_PATH   = r"C:\code\quatvn\luuvideo\log_chon_loc.txt"  # file log txt
 COLUMN_VIDEO_NAME = "video_name"  # tên cột trong excel chứa tên file video
 COLUMN_CHON_LOC   = "chon_loc"    # tên cột chọn lọc
 
+WINDOW_NAME = "Chon loc"  # 1 cửa sổ dùng cho mọi video (tiêu đề đổi theo tên video)
+
 # ==================
 
 
-def play_video_and_get_choice(video_path, window_name="Video"):
+def format_time(sec):
+    sec = int(sec)
+    return f"{sec//60:02d}:{sec%60:02d}"
+
+
+def draw_time(canvas, pos, reader):
+    """Vẽ thời gian lên góc trái phía trên (chạy trong thread giải mã)."""
+    time_text = f"{format_time(pos / reader.fps)} / {format_time(reader.total_frames / reader.fps)}"
+    label = speed_label(reader)
+    if label:
+        time_text += f"  [{label}]"
+    cv2.putText(
+        canvas,
+        time_text,
+        (10, 30),  # vị trí
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1.0,        # size chữ
+        (255, 255, 255),   # màu trắng
+        2,          # độ dày
+        cv2.LINE_AA
+    )
+
+
+def open_video(video_path):
+    """Mở video + bắt đầu giải mã ở thread riêng; scale vừa 80% màn hình, giữ tỉ lệ."""
+    screen_w, screen_h = screen_size()
+    return FrameReader(video_path, box=(screen_w * 0.8, screen_h * 0.8), overlay=draw_time)
+
+
+def play_video_and_get_choice(reader, title="Video", window_name=WINDOW_NAME):
     """
     Phát video bằng OpenCV.
     Điều khiển:
@@ -22,161 +56,107 @@ def play_video_and_get_choice(video_path, window_name="Video"):
       K  -> chọn KO
       N  -> bỏ qua (để trống)
       ESC -> thoát chương trình chính
-      A  -> tua lùi 10s
-      D  -> tua tới 10s
+      A  -> tua lùi 10s (x tốc độ đang xem)
+      D  -> tua tới 10s (x tốc độ đang xem)
+      1..5 -> xem lướt 1x / 2x / 4x / 8x / 16x (frame bỏ qua chỉ grab, không dựng ảnh)
+      0  -> bật/tắt chỉ xem keyframe
       Enter -> khi đã hết video: phát lại từ đầu
 
+    reader: FrameReader từ open_video() (có thể đã mở sẵn + giải mã sẵn vài frame đầu).
+    Giải mã + resize + vẽ thời gian chạy ở thread riêng (frame_reader.py), vòng này chỉ imshow và đọc phím.
+    Cửa sổ được giữ lại cho video sau, main() đóng khi xong.
+
     Trả về:
       'OK', 'KO', '', hoặc None (ESC).
     """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Không mở được video: {video_path}")
+    if not reader.wait_ready():
+        print(f"Không mở được video: {reader.video_path}")
+        reader.close()
         return ''
 
     # ---- thông tin video ----
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0:
-        fps = 25.0
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    ret, frame = cap.read()
-    if not ret:
-        cap.release()
-        return ''
-
-    h, w = frame.shape[:2]
-
-    # ---- kích thước màn hình (tkinter, chạy được win/macos/linux) ----
-    try:
-        import tkinter as tk
-        root = tk.Tk()
-        root.withdraw()
-        screen_w = root.winfo_screenwidth()
-        screen_h = root.winfo_screenheight()
-        root.destroy()
-    except Exception:
-        screen_w, screen_h = 1920, 1080
-
-    # scale vừa 80% màn hình, giữ tỉ lệ
-    scale = min(screen_w * 0.8 / w, screen_h * 0.8 / h, 1.0)
-    disp_w = int(w * scale)
-    disp_h = int(h * scale)
+    fps = reader.fps
+    total_frames = reader.total_frames
+    disp_w, disp_h = reader.size
+    screen_w, screen_h = screen_size()
 
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    cv2.setWindowTitle(window_name, title)
     cv2.resizeWindow(window_name, disp_w, disp_h)
     cv2.moveWindow(window_name,
                    int((screen_w - disp_w) / 2),
                    int((screen_h - disp_h) / 2))
 
-    # quay lại frame đầu
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
     choice = ''
-
     jump_frames = int(10 * fps)  # 10s
+    pacer = Pacer(fps, reader)
+
+    try:
+        while True:
+            res = reader.get(timeout=0.05)
+
+            # ---- hết video: dừng lại, chờ phím ----
+            if res is None and reader.eof:
+                while True:
+                    key = cv2.waitKey(0) & 0xFF  # ở đây chỉ cần 8-bit
+
+                    if key in (ord('o'), ord('O')):
+                        return 'OK'
+                    elif key in (ord('k'), ord('K')):
+                        return 'KO'
+                    elif key in (ord('n'), ord('N')):
+                        return ''
+                    elif key == 27:  # ESC
+                        return None
+                    elif key == 13:  # Enter: phát lại
+                        reader.seek(0)
+                        pacer.reset()
+                        break  # thoát vòng chờ phím, quay lại loop phát
+                    # phím khác thì tiếp tục chờ
+
+                continue  # quay lại vòng while lớn (phát lại)
+
+            if res is not None:
+                # ---- còn frame: hiển thị (đã scale + vẽ thời gian sẵn) ----
+                _, frame = res
+                cv2.imshow(window_name, frame)
+                key = cv2.waitKey(pacer.wait_ms()) & 0xFF
+            else:
+                # vừa tua, thread giải mã đang tới đúng frame: giữ hình cũ, vẫn nhận phím
+                key = cv2.waitKey(1) & 0xFF
+            if key == 255:  # không có phím
+                continue
+
+            # --- phím chọn ---
+            if key in (ord('o'), ord('O')):
+                choice = 'OK'
+                break
+            elif key in (ord('k'), ord('K')):
+                choice = 'KO'
+                break
+            elif key in (ord('n'), ord('N')):
+                choice = ''
+                break
+            elif key == 27:  # ESC
+                choice = None
+                break
+
+            # --- xem lướt: 1..5, 0 ---
+            if speed_key(reader, key, pacer):
+                continue
+
+            # --- tua bằng A / D (nhảy ngay tới keyframe, thread giải mã tự tới đúng frame) ---
+            pos = reader.position
+            jump = jump_frames * reader.speed
+            if key in (ord('a'), ord('A')):
+                reader.seek(max(pos - jump, 0))
+                pacer.reset()
+            elif key in (ord('d'), ord('D')):
+                reader.seek(min(pos + jump, max(total_frames - 1, 0)))
+                pacer.reset()
+    finally:
+        reader.close()
 
-    while True:
-        ret, frame = cap.read()
-
-        # ---- hết video: dừng lại, chờ phím ----
-        if not ret:
-            if total_frames > 0:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, max(total_frames - 1, 0))
-                ret_last, frame_last = cap.read()
-                if ret_last:
-                    frame_disp = cv2.resize(frame_last, (disp_w, disp_h))
-                    cv2.imshow(window_name, frame_disp)
-
-            while True:
-                key = cv2.waitKey(0) & 0xFF  # ở đây chỉ cần 8-bit
-
-                if key in (ord('o'), ord('O')):
-                    choice = 'OK'
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return choice
-                elif key in (ord('k'), ord('K')):
-                    choice = 'KO'
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return choice
-                elif key in (ord('n'), ord('N')):
-                    choice = ''
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return choice
-                elif key == 27:  # ESC
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return None
-                elif key == 13:  # Enter: phát lại
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    break  # thoát vòng chờ phím, quay lại loop phát
-                # phím khác thì tiếp tục chờ
-
-            continue  # quay lại vòng while lớn (phát lại)
-
-        # ---- còn frame: hiển thị ----
-        # ----- tính thời gian -----
-        current_frame = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-        current_sec = current_frame / fps
-        total_sec = total_frames / fps
-
-        def format_time(sec):
-            sec = int(sec)
-            return f"{sec//60:02d}:{sec%60:02d}"
-
-        time_text = f"{format_time(current_sec)} / {format_time(total_sec)}"
-
-        # ----- resize frame -----
-        frame_disp = cv2.resize(frame, (disp_w, disp_h))
-
-        # ----- vẽ thời gian lên góc trái phía trên -----
-        cv2.putText(
-            frame_disp,
-            time_text,
-            (10, 30),  # vị trí
-            cv2.FONT_HERSHEY_SIMPLEX,
-            1.0,        # size chữ
-            (255, 255, 255),   # màu trắng
-            2,          # độ dày
-            cv2.LINE_AA
-        )
-
-        cv2.imshow(window_name, frame_disp)
-
-
-        wait_ms = int(1000 / fps)
-        key = cv2.waitKey(wait_ms) & 0xFF
-        if key == 255:  # không có phím
-            continue
-
-        # --- phím chọn ---
-        if key in (ord('o'), ord('O')):
-            choice = 'OK'
-            break
-        elif key in (ord('k'), ord('K')):
-            choice = 'KO'
-            break
-        elif key in (ord('n'), ord('N')):
-            choice = ''
-            break
-        elif key == 27:  # ESC
-            choice = None
-            break
-
-        # --- tua bằng A / D ---
-        if key in (ord('a'), ord('A')):
-            current = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-            new_pos = max(current - jump_frames, 0)
-            cap.set(cv2.CAP_PROP_POS_FRAMES, new_pos)
-        elif key in (ord('d'), ord('D')):
-            current = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-            new_pos = min(current + jump_frames, max(total_frames - 1, 0))
-            cap.set(cv2.CAP_PROP_POS_FRAMES, new_pos)
-
-    cap.release()
-    cv2.destroyAllWindows()
     return choice
 
 
@@ -191,51 +171,53 @@ def append_log(video_name, choice):
 
 
 def main():
-    # đọc file excel
-    df = pd.read_excel(EXCEL_PATH)
+    # đọc file excel 1 lần; quyết định ghi vào journal, thread nền gộp vào excel
+    journal = ReviewJournal(EXCEL_PATH, key_col=COLUMN_VIDEO_NAME)
+    df = journal.df
 
     # đảm bảo có 2 cột cần thiết
     if COLUMN_VIDEO_NAME not in df.columns or COLUMN_CHON_LOC not in df.columns:
         print("Không tìm thấy cột 'video_name' hoặc 'chon_loc' trong file Excel.")
+        journal.close()
         return
 
-    # lặp qua từng dòng
-    for idx, row in df.iterrows():
-        chon_loc_value = str(row[COLUMN_CHON_LOC]).strip() if not pd.isna(row[COLUMN_CHON_LOC]) else ""
-
-        # bỏ qua những dòng đã có chọn lọc
-        if chon_loc_value != "":
-            continue
-
-        video_name = str(row[COLUMN_VIDEO_NAME]).strip()
-        video_path = os.path.join(VIDEO_DIR, video_name)
-
-        if not os.path.isfile(video_path):
-            print(f"KHÔNG TÌM THẤY FILE VIDEO: {video_path}")
-            append_log(video_name, "FILE_NOT_FOUND")
-            continue
-
-        print(f"\nĐang phát: {video_name}")
-        print("Phím O = OK, K = KO, N = bỏ qua, ESC = thoát chương trình")
-        print("Phím A = tua lùi 10s, D = tua tới 10s, khi hết video: Enter = phát lại")
+    def videos():
+        # lặp qua những dòng chưa có chọn lọc và có file video
+        for idx, video_name in journal.pending(COLUMN_CHON_LOC):
+            video_path = os.path.join(VIDEO_DIR, video_name)
+            if not os.path.isfile(video_path):
+                print(f"KHÔNG TÌM THẤY FILE VIDEO: {video_path}")
+                append_log(video_name, "FILE_NOT_FOUND")
+                continue
+            yield video_name, video_path
 
-        choice = play_video_and_get_choice(video_path, window_name=video_name)
-
-        if choice is None:
-            # người dùng bấm ESC → thoát luôn
-            print("Bạn đã bấm ESC. Thoát chương trình.")
-            break
-
-        # cập nhật vào dataframe
-        df.at[idx, COLUMN_CHON_LOC] = choice
-
-        # lưu lại excel sau mỗi video để không mất dữ liệu
-        df.to_excel(EXCEL_PATH, index=False)
-
-        # ghi log
-        append_log(video_name, choice)
-
-        print(f"Đã ghi '{choice}' cho video {video_name}")
+    try:
+        # video kế tiếp được mở + giải mã sẵn trong lúc xem video hiện tại
+        with closing(prefetch(videos(), lambda v: open_video(v[1]))) as queue:
+            for (video_name, video_path), reader in queue:
+                print(f"\nĐang phát: {video_name}")
+                print("Phím O = OK, K = KO, N = bỏ qua, ESC = thoát chương trình")
+                print("Phím A = tua lùi 10s, D = tua tới 10s, khi hết video: Enter = phát lại")
+                print("Phím 1..5 = xem lướt 1x/2x/4x/8x/16x, 0 = chỉ xem keyframe")
+
+                choice = play_video_and_get_choice(reader, title=video_name)
+
+                if choice is None:
+                    # người dùng bấm ESC → thoát luôn
+                    print("Bạn đã bấm ESC. Thoát chương trình.")
+                    break
+
+                # ghi vào journal (fsync ngay, không mất dữ liệu nếu tắt ngang)
+                journal.set(video_name, COLUMN_CHON_LOC, choice)
+
+                # ghi log
+                append_log(video_name, choice)
+
+                print(f"Đã ghi '{choice}' cho video {video_name}")
+    finally:
+        cv2.destroyAllWindows()
+        n = journal.close()
+        print(f"Đã lưu Excel ({n} ô cập nhật ở lần gộp cuối).")
 
     print("Hoàn thành.")
 
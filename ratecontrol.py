@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Điều chỉnh tốc độ request theo từng host (dùng chung mọi Session trong tiến trình):
+- AIMD: mỗi response khoẻ (không 429/503/timeout) → tăng giới hạn đồng thời thêm 1/limit;
+  bị 429 / 503 / timeout → giảm một nửa (tối thiểu MIN_LIMIT).
+- Retry-After (giây hoặc ngày giờ HTTP) → tạm dừng host đúng khoảng đó rồi mới gửi lại.
+- Circuit breaker: FAIL_THRESHOLD lỗi liên tiếp → "đỗ" host COOLDOWN giây (tăng gấp đôi mỗi lần mở lại,
+  tối đa MAX_COOLDOWN); hết cool-down cho 1 request thăm dò, thành công mới mở lại bình thường.
+
+Gắn vào Session qua AdaptiveAdapter (thay cho HTTPAdapter + Retry(status_forcelist=...)):
+    sess.mount("https://", AdaptiveAdapter(pool_connections=50, pool_maxsize=50))
+Với request stream=True, suất của host được giữ tới khi đọc xong body / đóng response → giảm giới hạn khi bị 429
+thực sự giảm số body đang tải song song từ host đó (kết quả AIMD vẫn tính ngay khi nhận header).
+Trong lúc chờ host hết tạm dừng, suất scheduler (nếu thread đang giữ) được nhả ra để host khác vẫn tải được.
+"""
+
+from __future__ import annotations
+import email.utils
+import logging
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+import metrics
+import scheduler
+
+log = logging.getLogger("ratecontrol")
+
+INITIAL_LIMIT = 4      # số request đồng thời ban đầu mỗi host
+MIN_LIMIT = 1
+MAX_LIMIT = 32
+FAIL_THRESHOLD = 5     # lỗi liên tiếp trước khi mở circuit
+COOLDOWN = 30.0        # giây đỗ host lần đầu
+MAX_COOLDOWN = 300.0
+THROTTLE_RETRIES = 3   # số lần gửi lại khi bị 429/503 (sau khi chờ Retry-After / backoff)
+MIN_RETRY_AFTER = 1.0  # Retry-After = 0 / ngày giờ đã qua → vẫn chờ tối thiểu chừng này giây
+THROTTLE_STATUS = (429, 503)
+FAIL_STATUS = (500, 502, 504)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After: số giây hoặc ngày giờ HTTP → số giây cần chờ (None nếu không có / không đọc được)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
+
+class _Host:
+    __slots__ = ("limit", "inflight", "paused_until", "fails", "opens", "opened_at", "probing")
+
+    def __init__(self):
+        self.limit = float(INITIAL_LIMIT)
+        self.inflight = 0
+        self.paused_until = 0.0
+        self.fails = 0
+        self.opens = 0          # số lần circuit đã mở liên tiếp (để tăng cool-down)
+        self.opened_at = -1.0   # lúc circuit mở gần nhất; lỗi của request gửi trước đó không mở thêm lần nữa
+        self.probing = False    # đang half-open: chỉ cho 1 request thăm dò
+
+
+class HostController:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._hosts: dict[str, _Host] = {}
+
+    def _host(self, host: str) -> _Host:
+        h = self._hosts.get(host)
+        if h is None:
+            h = self._hosts[host] = _Host()
+        return h
+
+    def acquire(self, host: str) -> float:
+        """Chờ tới lượt gửi request tới host. Trả về thời điểm bắt đầu (truyền lại cho release)."""
+        while True:
+            with self._cond:
+                h = self._host(host)
+                now = time.monotonic()
+                wait = h.paused_until - now
+                if wait <= 0:
+                    if h.opens and h.fails >= FAIL_THRESHOLD:
+                        # hết cool-down → half-open, chỉ 1 request thăm dò
+                        if not h.probing:
+                            h.probing = True
+                            h.inflight += 1
+                            return now
+                        wait = 1.0
+                    elif h.inflight < max(MIN_LIMIT, int(h.limit)):
+                        h.inflight += 1
+                        return now
+                    else:
+                        self._cond.wait(1.0)
+                        continue
+            # host đang tạm dừng (Retry-After / cool-down) → nhả suất scheduler trong lúc ngủ
+            with scheduler.get().suspend():
+                time.sleep(wait)
+
+    def release(self, host: str, ok: bool | None, throttled: bool = False,
+                retry_after: float | None = None, started: float | None = None, hold: bool = False) -> None:
+        """
+        ok=True: response khoẻ, False: 429/503/5xx/timeout, None: không tính (lỗi phía client).
+        started: giá trị acquire() trả về; lỗi của request gửi trước lần mở circuit gần nhất không mở thêm.
+        hold=True: chỉ ghi nhận kết quả, suất vẫn giữ tới khi gọi done() (body stream chưa đọc xong).
+        """
+        with self._cond:
+            h = self._host(host)
+            if not hold:
+                h.inflight -= 1
+            h.probing = False
+            now = time.monotonic()
+            if ok is None:
+                pass
+            elif ok:
+                if h.opens:
+                    log.info(f"[rate] {host}: hoạt động lại (limit {h.limit:.1f})")
+                h.fails = 0
+                h.opens = 0
+                h.limit = min(MAX_LIMIT, h.limit + 1.0 / h.limit)
+            else:
+                h.fails += 1
+                h.limit = max(MIN_LIMIT, h.limit / 2)
+                if throttled:
+                    metrics.incr("ratecontrol", "throttled")
+                if retry_after:
+                    h.paused_until = max(h.paused_until, now + retry_after)
+                if h.fails >= FAIL_THRESHOLD and (started is None or started >= h.opened_at):
+                    h.opens += 1
+                    h.opened_at = now
+                    cool = min(MAX_COOLDOWN, COOLDOWN * 2 ** (h.opens - 1))
+                    h.paused_until = max(h.paused_until, now + cool)
+                    metrics.incr("ratecontrol", "circuit_open")
+                    log.warning(f"[rate] {host}: {h.fails} lỗi liên tiếp → tạm dừng {cool:.0f}s")
+            self._cond.notify_all()
+
+    def done(self, host: str) -> None:
+        """Trả suất đã giữ bằng release(..., hold=True)."""
+        with self._cond:
+            self._host(host).inflight -= 1
+            self._cond.notify_all()
+
+    def limit(self, host: str) -> float:
+        with self._cond:
+            return self._host(host).limit
+
+
+_controller = HostController()
+
+
+def controller() -> HostController:
+    return _controller
+
+
+class AdaptiveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter đi qua HostController: chờ suất của host, gửi, báo kết quả.
+    429/503 được gửi lại tối đa THROTTLE_RETRIES lần sau Retry-After (hoặc backoff 2^n giây);
+    urllib3 Retry chỉ còn lo lỗi kết nối.
+    """
+
+    def __init__(self, *args, retries: int = THROTTLE_RETRIES, **kwargs):
+        kwargs.setdefault("max_retries", Retry(total=3, backoff_factor=0.5, status_forcelist=()))
+        super().__init__(*args, **kwargs)
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        ctl = controller()
+        for attempt in range(self.retries + 1):
+            started = ctl.acquire(host)
+            try:
+                resp = super().send(request, **kwargs)
+            except (requests.Timeout, requests.ConnectionError):
+                ctl.release(host, ok=False, started=started)
+                raise
+            except BaseException:
+                ctl.release(host, ok=None, started=started)
+                raise
+            status = resp.status_code
+            if status in THROTTLE_STATUS:
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                if retry_after is not None:
+                    retry_after = max(retry_after, MIN_RETRY_AFTER)
+                ctl.release(host, ok=False, throttled=True, retry_after=retry_after, started=started)
+                if attempt == self.retries:
+                    return resp
+                wait = retry_after if retry_after is not None else 2.0 ** attempt
+                log.info(f"[rate] {host}: HTTP {status}, thử lại sau {wait:.1f}s"
+                         f" (limit {ctl.limit(host):.1f})")
+                resp.close()
+                if retry_after is None:
+                    # có Retry-After thì acquire() tự chờ tới hết thời gian tạm dừng
+                    with scheduler.get().suspend():
+                        time.sleep(wait)
+                continue
+            if kwargs.get("stream"):
+                ctl.release(host, ok=status not in FAIL_STATUS, started=started, hold=True)
+                return _hold_until_closed(resp, host)
+            ctl.release(host, ok=status not in FAIL_STATUS, started=started)
+            return resp
+        return resp
+
+
+def _hold_until_closed(resp, host: str):
+    """Gọi controller().done(host) đúng 1 lần khi body đọc hết (urllib3 trả kết nối) hoặc response bị đóng."""
+    lock = threading.Lock()
+    finished = []
+
+    def finish():
+        with lock:
+            if finished:
+                return
+            finished.append(True)
+        controller().done(host)
+
+    def wrap(fn):
+        def inner(*a, **kw):
+            try:
+                return fn(*a, **kw)
+            finally:
+                finish()
+        return inner
+
+    resp.close = wrap(resp.close)
+    if hasattr(resp.raw, "release_conn"):
+        resp.raw.release_conn = wrap(resp.raw.release_conn)
+    weakref.finalize(resp, finish)  # response bị bỏ rơi không đóng → vẫn trả suất
+    return resp
+
+
+def mount(sess: requests.Session, pool_size: int = 50) -> requests.Session:
+    """Gắn AdaptiveAdapter cho http/https của sess."""
+    adapter = AdaptiveAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    return sess
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Lưu kết quả crawl vào journal JSONL (append-only) thay cho load_workbook + save mỗi dòng.
+- Mỗi bài xong: ghi thêm 1 dòng JSON vào <excel>.pending.<pid>.jsonl (flush + fsync, không đọc lại file).
+  Mỗi tiến trình 1 journal riêng → nhiều crawler cùng ghi 1 ketqua.xlsx không giẫm lên nhau.
+- Cuối lượt crawl (hoặc chạy tay): export-xlsx gộp các journal không còn ai ghi (của chính nó, của tiến
+  trình đã thoát / crash) vào Excel trong 1 lần load/save, giữ nguyên các cột đã có (vd: chon_loc).
+  Journal được đổi tên sang .merging trước khi đọc và chỉ bị xoá sau khi Excel đã replace xong;
+  journal của crawler khác đang chạy được để nguyên cho lượt export của nó.
+- Mọi chỗ load → save cùng 1 file Excel (export-xlsx, review_journal gộp chon_loc) đều giữ khoá
+  <excel>.lock (xlsx_lock) để không ghi đè thay đổi của nhau.
+
+Usage:
+    python result_store.py export-xlsx --excel ketqua.xlsx
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: file đang mở ở tiến trình khác thì không đổi tên được, không cần khoá thêm
+    fcntl = None
+
+COLUMNS = ["page", "post_url", "title", "thumb_url", "thumb_path",
+           "video_url", "video_name", "tags"]
+LOCK_TIMEOUT = 120.0  # giây chờ tiến trình khác ghi xong Excel
+LOCK_STALE = 600.0    # file khoá cũ hơn mức này = tiến trình giữ khoá đã chết
+
+
+@contextmanager
+def xlsx_lock(xlsx_path, timeout: float = LOCK_TIMEOUT):
+    """Khoá liên tiến trình (file <excel>.lock) quanh load → save của 1 file Excel."""
+    path = Path(str(xlsx_path) + ".lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > LOCK_STALE:
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Tiến trình khác đang ghi {xlsx_path} (khoá {path})")
+            time.sleep(0.2)
+            continue
+        os.write(fd, f"{os.getpid()}\n".encode("ascii"))
+        os.close(fd)
+        break
+    try:
+        yield
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def journal_path(xlsx_path, pid: int | None = None) -> Path:
+    """ketqua.xlsx -> ketqua.pending.<pid>.jsonl (cùng thư mục); pid=None = tiến trình hiện tại."""
+    xlsx = Path(xlsx_path)
+    return xlsx.with_name(f"{xlsx.stem}.pending.{os.getpid() if pid is None else pid}.jsonl")
+
+
+def journal_paths(xlsx_path) -> list[Path]:
+    """Mọi journal của file Excel: của từng tiến trình, bản cũ ketqua.pending.jsonl và các .merging còn sót."""
+    xlsx = Path(xlsx_path)
+    return sorted(p for p in xlsx.parent.glob(xlsx.stem + ".pending*")
+                  if p.suffix in (".jsonl", ".merging"))
+
+
+def _open_journal(path: Path):
+    """Mở journal để ghi tiếp và giữ flock suốt thời gian ghi (POSIX) → export biết journal còn người ghi."""
+    while True:
+        f = open(path, "a", encoding="utf-8")
+        if fcntl is None:
+            return f
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()  # export vừa đổi tên file này sang .merging → mở file mới
+
+
+def _claim(path: Path) -> Path | None:
+    """Đổi tên journal không còn ai ghi sang .merging; đang có tiến trình ghi → None."""
+    dst = path.with_suffix(".merging")
+    try:
+        if fcntl is None:
+            os.replace(path, dst)  # Windows: PermissionError nếu tiến trình khác đang mở
+            return dst
+        with open(path, "rb") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            os.replace(path, dst)
+            return dst
+    except (FileNotFoundError, PermissionError):
+        return None
+
+
+def read_journal(path) -> list[dict]:
+    """Đọc journal, bỏ qua dòng cuối bị ghi dở (crash giữa chừng)."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln:
+                continue
+            try:
+                rows.append(json.loads(ln))
+            except ValueError:
+                continue
+    return rows
+
+
+class ResultStore:
+    """Ghi từng dòng kết quả vào journal; an toàn khi gọi từ nhiều thread."""
+
+    def __init__(self, xlsx_path):
+        self.xlsx_path = Path(xlsx_path)
+        self.journal = journal_path(self.xlsx_path)
+        self.count = 0
+        self._lock = threading.Lock()
+        self._f = _open_journal(self.journal)
+
+    def append(self, row: dict) -> None:
+        line = json.dumps({c: row.get(c, "") for c in COLUMNS}, ensure_ascii=False)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+
+    def export_xlsx(self) -> int:
+        self.close()
+        return export_xlsx(self.xlsx_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_xlsx(xlsx_path) -> int:
+    """
+    Gộp các journal không còn ai ghi vào Excel (1 lần load + 1 lần save). Tạo file có header nếu chưa có.
+    Trả về số dòng đã gộp.
+    """
+    xlsx = Path(xlsx_path)
+    with xlsx_lock(xlsx):
+        # .merging còn sót = lần export trước lỗi trước khi replace Excel → gộp lại cùng lượt này
+        merging = [p for p in journal_paths(xlsx) if p.suffix == ".merging"]
+        merging += [m for m in map(_claim, (p for p in journal_paths(xlsx) if p.suffix == ".jsonl")) if m]
+        rows = [r for p in merging for r in read_journal(p)]
+        _export_locked(xlsx, rows)
+        for p in merging:
+            p.unlink(missing_ok=True)
+    return len(rows)
+
+
+def _export_locked(xlsx: Path, rows: list[dict]) -> None:
+    from openpyxl import Workbook, load_workbook
+
+    if xlsx.exists():
+        wb = load_workbook(str(xlsx))
+        ws = wb.active
+        header = [c.value for c in ws[1]]
+    else:
+        wb = Workbook()
+        ws = wb.active
+        ws.append(COLUMNS)
+        header = list(COLUMNS)
+
+    # ghi theo đúng thứ tự cột của file hiện có; thiếu header chuẩn thì dùng COLUMNS
+    if not all(c in header for c in COLUMNS):
+        header = list(COLUMNS)
+    for r in rows:
+        ws.append([r.get(h, "") if h in COLUMNS else None for h in header])
+
+    # lưu ra file tạm rồi replace để không làm hỏng Excel nếu bị ngắt giữa chừng
+    tmp = xlsx.with_name(xlsx.stem + ".tmp.xlsx")
+    wb.save(str(tmp))
+    os.replace(tmp, xlsx)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export-xlsx", help="Gộp journal .pending.jsonl vào file Excel")
+    ex.add_argument("--excel", type=str, default="ketqua.xlsx", help="Tên file Excel")
+    args = ap.parse_args()
+
+    if args.cmd == "export-xlsx":
+        n = export_xlsx(args.excel)
+        print(f"==> Đã gộp {n} dòng vào: {Path(args.excel).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
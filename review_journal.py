@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Trạng thái chọn lọc của các player review (playvideo_loc, playvideo_loc_webp) giữ trong RAM:
+- Excel chỉ được đọc 1 lần lúc khởi động.
+- Mỗi quyết định (chon_loc, name_webp...) ghi thêm 1 dòng JSON vào <excel>.review.jsonl (flush + fsync),
+  không đụng tới Excel → thời gian giữa 2 video không phụ thuộc số dòng.
+- Thread nền gộp journal vào Excel mỗi MERGE_EVERY giây (và 1 lần cuối khi close()):
+  mở bằng openpyxl, tìm dòng theo video_name, chỉ sửa đúng ô cần sửa → giữ nguyên các cột / dòng khác
+  (kể cả dòng crawler vừa export thêm trong lúc đang review; cả 2 bên cùng giữ khoá <excel>.lock khi ghi).
+- Bị tắt ngang (crash, đóng cửa sổ): journal còn lại được gộp ở lần chạy sau trước khi đọc Excel.
+
+Usage (gộp tay):
+    python review_journal.py --excel ketqua.xlsx
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from result_store import xlsx_lock
+
+MERGE_EVERY = 30.0  # giây
+
+
+def journal_path(xlsx_path) -> Path:
+    """ketqua.xlsx -> ketqua.review.jsonl (cùng thư mục)."""
+    xlsx = Path(xlsx_path)
+    return xlsx.with_name(xlsx.stem + ".review.jsonl")
+
+
+def _read_entries(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            try:
+                e = json.loads(ln)
+            except ValueError:
+                continue  # dòng cuối ghi dở khi crash
+            if isinstance(e, dict) and "video_name" in e and "col" in e:
+                out.append(e)
+    return out
+
+
+def merge_entries(xlsx_path, entries: list[dict], key_col: str = "video_name") -> int:
+    """Ghi các quyết định vào Excel (1 lần load + 1 lần save, file tạm rồi replace). Trả về số ô đã ghi."""
+    if not entries:
+        return 0
+    xlsx = Path(xlsx_path)
+    with xlsx_lock(xlsx):
+        return _merge_locked(xlsx, entries, key_col)
+
+
+def _merge_locked(xlsx: Path, entries: list[dict], key_col: str) -> int:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(str(xlsx))
+    ws = wb.active
+    header = [c.value for c in ws[1]]
+    cols = {str(h): i + 1 for i, h in enumerate(header) if h is not None}
+    if key_col not in cols:
+        raise KeyError(f"Không có cột {key_col} trong {xlsx}")
+
+    # quyết định sau cùng cho mỗi (video, cột)
+    latest: dict[tuple[str, str], str] = {}
+    for e in entries:
+        latest[(str(e["video_name"]), str(e["col"]))] = "" if e.get("value") is None else str(e["value"])
+
+    for _, col in latest:
+        if col not in cols:
+            cols[col] = ws.max_column + 1
+            ws.cell(row=1, column=cols[col], value=col)
+
+    rows: dict[str, int] = {}
+    key_idx = cols[key_col]
+    for r in range(2, ws.max_row + 1):
+        v = ws.cell(row=r, column=key_idx).value
+        if v is not None:
+            rows.setdefault(str(v).strip(), r)
+
+    n = 0
+    for (video, col), value in latest.items():
+        r = rows.get(video)
+        if r is None:
+            continue
+        ws.cell(row=r, column=cols[col], value=value)
+        n += 1
+
+    tmp = xlsx.with_name(xlsx.stem + ".tmp.xlsx")
+    wb.save(str(tmp))
+    os.replace(tmp, xlsx)
+    return n
+
+
+class ReviewJournal:
+    """
+    df: DataFrame (dtype=str, ô trống = "") đọc 1 lần; set() cập nhật df + ghi journal.
+    An toàn khi gọi từ nhiều thread (vd: luồng cắt WebP).
+    """
+
+    def __init__(self, xlsx_path, key_col: str = "video_name", columns=(), merge_every: float = MERGE_EVERY):
+        import pandas as pd
+
+        self.xlsx_path = Path(xlsx_path)
+        self.key_col = key_col
+        self.journal = journal_path(self.xlsx_path)
+        self._merging = self.journal.with_suffix(".merging")
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+
+        # journal còn sót từ lần chạy trước (crash / chưa gộp được) → dồn sang .merging để gộp
+        self._dirty = self._stash()
+
+        self.df = pd.read_excel(self.xlsx_path, dtype=str).fillna("")
+        for c in columns:
+            if c not in self.df.columns:
+                self.df[c] = ""
+        self._index = {}
+        for idx, v in self.df[key_col].items():
+            self._index.setdefault(str(v).strip(), idx)
+        # Excel có thể chưa gộp được (đang mở) → vẫn áp phần còn sót vào RAM
+        for e in _read_entries(self._merging):
+            self._apply(str(e["video_name"]), str(e["col"]), "" if e.get("value") is None else str(e["value"]))
+
+        self._f = open(self.journal, "a", encoding="utf-8")
+        if self._dirty:
+            self.merge()
+        self._stop = threading.Event()
+        self._thread = None
+        if merge_every and merge_every > 0:
+            self._thread = threading.Thread(target=self._loop, args=(merge_every,),
+                                            name="review-merge", daemon=True)
+            self._thread.start()
+
+    def get(self, video_name: str, col: str) -> str:
+        with self._lock:
+            idx = self._index.get(str(video_name).strip())
+            return "" if idx is None else str(self.df.at[idx, col])
+
+    def set(self, video_name: str, col: str, value) -> None:
+        video_name = str(video_name).strip()
+        value = "" if value is None else str(value)
+        line = json.dumps({"ts": time.time(), "video_name": video_name, "col": col, "value": value},
+                          ensure_ascii=False)
+        with self._lock:
+            self._apply(video_name, col, value)
+            self._f.write(line + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._dirty = True
+
+    def _apply(self, video_name: str, col: str, value: str) -> None:
+        idx = self._index.get(video_name)
+        if idx is not None:
+            if col not in self.df.columns:
+                self.df[col] = ""
+            self.df.at[idx, col] = value
+
+    def pending(self, col: str):
+        """Lần lượt (idx, video_name) của các dòng còn trống cột col (duyệt 1 lượt, không quét lại)."""
+        for idx in list(self.df.index):
+            with self._lock:
+                if str(self.df.at[idx, col]).strip():
+                    continue
+                video_name = str(self.df.at[idx, self.key_col]).strip()
+            yield idx, video_name
+
+    # ---- gộp vào Excel ----
+    def _stash(self) -> bool:
+        """Dồn journal hiện tại vào .merging (nối tiếp nếu lần gộp trước lỗi). True nếu có gì cần gộp."""
+        if self.journal.exists() and self.journal.stat().st_size:
+            if self._merging.exists():
+                with open(self._merging, "ab") as dst, open(self.journal, "rb") as src:
+                    dst.write(src.read())
+                self.journal.unlink()
+            else:
+                os.replace(self.journal, self._merging)
+        return self._merging.exists()
+
+    def _rotate(self) -> None:
+        """Chuyển phần journal mới sang .merging, mở journal mới để set() không phải chờ lúc gộp."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._f.close()
+            self._stash()
+            self._f = open(self.journal, "a", encoding="utf-8")
+            self._dirty = False
+
+    def merge(self) -> int:
+        """Gộp các quyết định chưa có trong Excel. Lỗi (vd: Excel đang mở) → giữ lại, lần sau gộp tiếp."""
+        try:
+            with self._merge_lock:
+                self._rotate()
+                n = merge_entries(self.xlsx_path, _read_entries(self._merging), self.key_col)
+                self._merging.unlink(missing_ok=True)
+                return n
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            print(f"[review] Chưa gộp được vào Excel: {e}")
+            return 0
+
+    def _loop(self, every: float):
+        while not self._stop.wait(every):
+            self.merge()
+
+    def close(self) -> int:
+        """Dừng thread nền và gộp lần cuối. Trả về số ô đã ghi ở lần gộp cuối."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        n = self.merge()
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+        if self.journal.exists() and self.journal.stat().st_size == 0:
+            self.journal.unlink()
+        return n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--excel", type=str, default="ketqua.xlsx", help="File Excel cần gộp journal review")
+    ap.add_argument("--key", type=str, default="video_name", help="Cột khoá để tìm dòng")
+    args = ap.parse_args()
+    jp = journal_path(args.excel)
+    merging = jp.with_suffix(".merging")
+    entries = _read_entries(merging) + _read_entries(jp)
+    n = merge_entries(args.excel, entries, args.key)
+    merging.unlink(missing_ok=True)
+    jp.unlink(missing_ok=True)
+    print(f"==> Đã gộp {n} ô vào: {Path(args.excel).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
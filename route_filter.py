@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Chặn tài nguyên nặng trong Playwright (ảnh, font, video, quảng cáo / analytics) khi crawler chỉ cần
+1 response API hoặc 1 object JS. Dùng chung cho caoviet69, crawfullcliphot, download_video_bloger.
+
+    from route_filter import RouteFilter
+    flt = RouteFilter(block_types=("image", "font", "media"), allow=("emb.cd-vs.com",))
+    flt.install(context)               # sync API
+    await flt.install_async(context)   # async API
+
+- block_types: resource_type của Playwright (document, stylesheet, image, media, font, script,
+  xhr, fetch, websocket, other...). Không bao giờ chặn theo loại với document / xhr / fetch.
+- block_hosts: chặn theo chuỗi con của URL, mọi loại (mặc định: mạng quảng cáo / analytics phổ biến).
+- allow: chuỗi con URL luôn cho qua (ưu tiên hơn mọi luật chặn).
+"""
+
+from __future__ import annotations
+
+import metrics
+
+DEFAULT_BLOCK_TYPES = ("image", "font", "media")
+DEFAULT_BLOCK_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "adservice.google.", "connect.facebook.net", "hotjar.com", "clarity.ms", "histats.com",
+    "mc.yandex.ru", "popads.net", "popcash.net", "propellerads.com", "adsterra.com", "exoclick.com",
+    "juicyads.com", "trafficjunky.net", "onclickads.net", "hilltopads.net", "cloudflareinsights.com",
+)
+NEVER_BLOCK_TYPES = ("document", "xhr", "fetch")
+
+
+class RouteFilter:
+    def __init__(self, block_types=DEFAULT_BLOCK_TYPES, block_hosts=DEFAULT_BLOCK_HOSTS, allow=()):
+        self.block_types = frozenset(t for t in block_types if t not in NEVER_BLOCK_TYPES)
+        self.block_hosts = tuple(block_hosts)
+        self.allow = tuple(allow)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if any(a in url for a in self.allow):
+            return False
+        if resource_type in self.block_types and not url.startswith(("data:", "blob:")):
+            return True
+        # iframe quảng cáo (document) cũng chặn theo host
+        return any(h in url for h in self.block_hosts)
+
+    def _blocked(self, request) -> bool:
+        if self.should_block(request.url, request.resource_type):
+            metrics.incr("route", "blocked")
+            return True
+        return False
+
+    # ---- sync API ----
+    def _handle(self, route, request):
+        if self._blocked(request):
+            route.abort("blockedbyclient")
+        else:
+            route.continue_()
+
+    def install(self, target) -> None:
+        """target: BrowserContext hoặc Page (sync API)."""
+        target.route("**/*", self._handle)
+
+    # ---- async API ----
+    async def _handle_async(self, route, request):
+        if self._blocked(request):
+            await route.abort("blockedbyclient")
+        else:
+            await route.continue_()
+
+    async def install_async(self, target) -> None:
+        """target: BrowserContext hoặc Page (async API)."""
+        await target.route("**/*", self._handle_async)
+
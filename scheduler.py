@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bộ điều phối tải dùng chung cho mọi lượt tải (downloader, segment PNG, thumbnail):
+- Giới hạn tổng số kết nối tải đang mở (max_total) và số kết nối mỗi host (per_host).
+- Ngân sách băng thông bytes/s (token bucket), throttle theo từng chunk.
+- Hàng chờ có thứ tự ưu tiên: "oldest" (lượt tải bắt đầu sớm nhất trước, retry không bị xếp cuối)
+  hoặc "smallest" (file nhỏ trước, nếu biết kích thước).
+- Nhiều crawler chạy cùng lúc trên 1 máy chia đều đường truyền: mỗi tiến trình ghi heartbeat vào
+  <tmp>/crawl_scheduler/<pid>.json, giới hạn tổng / băng thông / host chung được chia cho số tiến trình
+  đang tải (host chung = chỉ tính các tiến trình đang tải từ host đó).
+
+    sched = scheduler.configure(max_total=16, per_host=8, bytes_per_sec=5e6, policy="oldest")
+    with scheduler.get().slot(url, size=n):
+        for chunk in r.iter_content(...):
+            scheduler.get().throttle(len(chunk))
+
+Thread đang giữ suất mà phải chờ lâu (host bị tạm dừng do 429 / circuit breaker, xem ratecontrol.py)
+thì nhả suất trong lúc chờ bằng `with scheduler.get().suspend(): ...`, để host khác không bị đói.
+"""
+
+from __future__ import annotations
+import atexit
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+log = logging.getLogger("scheduler")
+
+SHARE_DIR = Path(tempfile.gettempdir()) / "crawl_scheduler"
+HEARTBEAT_SECS = 2.0
+PEER_TIMEOUT = 10.0   # heartbeat cũ hơn mức này = tiến trình đã chết / không còn tải
+POLICIES = ("oldest", "smallest")
+
+
+class TokenBucket:
+    """rate bytes/s, cho phép dồn tối đa 1 giây; rate <= 0 = không giới hạn."""
+
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        with self._lock:
+            rate = self.rate
+            if rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(rate, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Scheduler:
+    def __init__(self, max_total: int = 16, per_host: int = 8, bytes_per_sec: float = 0,
+                 policy: str = "oldest", share_dir=SHARE_DIR):
+        if policy not in POLICIES:
+            raise ValueError(f"policy phải là một trong {POLICIES}")
+        self.max_total = max(1, max_total)
+        self.per_host = max(1, per_host)
+        self.bytes_per_sec = bytes_per_sec
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_host: Counter = Counter()
+        self._waiting: list[tuple] = []
+        self._local = threading.local()   # suất thread hiện tại đang giữ: [(key, host), ...]
+        self._bucket = TokenBucket(bytes_per_sec)
+        # số tiến trình khác đang tải (tổng / theo host), cập nhật bởi thread heartbeat
+        self._peers = 0
+        self._peer_hosts: Counter = Counter()
+
+        self._share_dir = Path(share_dir) if share_dir else None
+        self._stop = threading.Event()
+        if self._share_dir is not None:
+            self._hb_file = self._share_dir / f"{os.getpid()}.json"
+            threading.Thread(target=self._heartbeat_loop, name="scheduler-hb", daemon=True).start()
+            atexit.register(self.close)
+
+    # ---- giới hạn sau khi chia cho các tiến trình khác ----
+    def _limit_total(self) -> int:
+        return max(1, self.max_total // (1 + self._peers))
+
+    def _limit_host(self, host: str) -> int:
+        return max(1, self.per_host // (1 + self._peer_hosts.get(host, 0)))
+
+    def _key(self, size, created) -> float:
+        if self.policy == "smallest" and size:
+            return float(size)
+        if self.policy == "oldest" and created is not None:
+            return float(created)
+        return float("inf")  # không rõ → theo thứ tự đến (seq)
+
+    def _can_run(self, ticket) -> bool:
+        if self._active >= self._limit_total():
+            return False
+        # ticket ưu tiên cao nhất trong số các ticket mà host còn chỗ
+        for t in sorted(self._waiting):
+            if self._active_host[t[2]] < self._limit_host(t[2]):
+                return t is ticket
+        return False
+
+    @contextmanager
+    def slot(self, url: str, size: int | None = None, created: float | None = None):
+        """
+        Giữ 1 suất tải cho url trong suốt khối with. size = kích thước (nếu biết) cho policy "smallest",
+        created = time.monotonic() lúc bắt đầu lượt tải cho policy "oldest" (retry giữ nguyên created).
+        """
+        host = urlparse(url).netloc
+        key = self._key(size, created)
+        self._acquire(key, host)
+        held = self._held()
+        held.append((key, host))
+        try:
+            yield
+        finally:
+            held.pop()
+            self._release(host)
+
+    @contextmanager
+    def suspend(self):
+        """
+        Tạm nhả suất mà thread hiện tại đang giữ (nếu có) trong khối with, rồi xin lại với cùng độ ưu tiên.
+        Dùng khi phải ngủ chờ lâu bên trong slot().
+        """
+        held = self._held()
+        if not held:
+            yield
+            return
+        key, host = held[-1]
+        self._release(host)
+        try:
+            yield
+        finally:
+            self._acquire(key, host)
+
+    def _held(self) -> list:
+        held = getattr(self._local, "held", None)
+        if held is None:
+            held = self._local.held = []
+        return held
+
+    def _acquire(self, key: float, host: str) -> None:
+        ticket = (key, next(self._seq), host)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                # timeout để tính lại khi số tiến trình chia sẻ thay đổi
+                while not self._can_run(ticket):
+                    self._cond.wait(1.0)
+            finally:
+                self._waiting.remove(ticket)
+            self._active += 1
+            self._active_host[host] += 1
+
+    def _release(self, host: str) -> None:
+        with self._cond:
+            self._active -= 1
+            self._active_host[host] -= 1
+            if not self._active_host[host]:
+                del self._active_host[host]
+            self._cond.notify_all()
+
+    def throttle(self, n: int) -> None:
+        """Gọi sau mỗi chunk n byte; chờ nếu vượt ngân sách băng thông."""
+        self._bucket.consume(n)
+
+    # ---- chia sẻ giữa các tiến trình ----
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._heartbeat()
+            except OSError as e:
+                log.debug(f"[scheduler] heartbeat lỗi: {e}")
+            self._stop.wait(HEARTBEAT_SECS)
+
+    def _heartbeat(self):
+        self._share_dir.mkdir(parents=True, exist_ok=True)
+        with self._cond:
+            hosts = sorted(set(self._active_host) | {t[2] for t in self._waiting})
+        tmp = self._hb_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"ts": time.time(), "hosts": hosts}), encoding="utf-8")
+        os.replace(tmp, self._hb_file)
+
+        now = time.time()
+        peers, peer_hosts = 0, Counter()
+        for f in self._share_dir.glob("*.json"):
+            if f == self._hb_file:
+                continue
+            try:
+                data = json.loads(f.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            age = now - data.get("ts", 0)
+            if age > PEER_TIMEOUT * 6:
+                f.unlink(missing_ok=True)  # tiến trình chết để lại file
+                continue
+            if age > PEER_TIMEOUT or not data.get("hosts"):
+                continue
+            peers += 1
+            peer_hosts.update(data["hosts"])
+
+        self._bucket.rate = self.bytes_per_sec / (1 + peers) if self.bytes_per_sec > 0 else 0
+        with self._cond:
+            changed = peers != self._peers or peer_hosts != self._peer_hosts
+            self._peers, self._peer_hosts = peers, peer_hosts
+            if changed:
+                self._cond.notify_all()
+        if changed:
+            log.info(f"[scheduler] {peers} tiến trình khác đang tải → giới hạn tổng {self._limit_total()}"
+                     f" kết nối" + (f", {self._bucket.rate / 1e6:.1f} MB/s" if self._bucket.rate else ""))
+
+    def close(self):
+        self._stop.set()
+        if self._share_dir is not None:
+            try:
+                self._hb_file.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+
+_default: Scheduler | None = None
+_default_lock = threading.Lock()
+
+
+def configure(**kwargs) -> Scheduler:
+    """Tạo scheduler dùng chung cho cả tiến trình (gọi 1 lần trong main, trước khi tải)."""
+    global _default
+    with _default_lock:
+        if _default is not None:
+            _default.close()
+        _default = Scheduler(**kwargs)
+        return _default
+
+
+def get() -> Scheduler:
+    """Scheduler dùng chung; chưa configure thì dùng giới hạn mặc định."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Scheduler()
+    return _default
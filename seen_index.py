@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Chỉ mục các URL đã xử lý (post_url + media url) để crawl lại chỉ lấy bài mới.
+- File text append-only: mỗi dòng "<kind>\t<url>", nạp hết vào set khi khởi động.
+- Lần đầu (chưa có file) tự nạp từ kết quả cũ: Excel/CSV (cột post_url, video_url)
+  và các journal .pending*.jsonl của result_store.
+"""
+
+from __future__ import annotations
+import csv
+import logging
+import threading
+from pathlib import Path
+
+from result_store import journal_paths, read_journal
+
+log = logging.getLogger("seen_index")
+
+SEED_COLUMNS = ("post_url", "video_url")
+
+
+def _seed_rows(path: Path):
+    """Đọc các dòng kết quả cũ (xlsx/csv + journal) dưới dạng dict."""
+    if path.suffix.lower() == ".csv":
+        if path.exists():
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                yield from csv.DictReader(f)
+        return
+    if path.exists():
+        from openpyxl import load_workbook
+        wb = load_workbook(str(path), read_only=True)
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(c) if c is not None else "" for c in next(rows, ())]
+        for r in rows:
+            yield dict(zip(header, r))
+        wb.close()
+    for j in journal_paths(path):
+        yield from read_journal(j)
+
+
+class SeenIndex:
+    """Tập URL đã xử lý; an toàn khi gọi từ nhiều thread."""
+
+    def __init__(self, path="seen_index.txt", seed_from=None):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._urls: set[str] = set()
+
+        fresh = not self.path.exists()
+        if not fresh:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for ln in f:
+                    kind, _, url = ln.rstrip("\n").partition("\t")
+                    if url:
+                        self._urls.add(url)
+        self._f = open(self.path, "a", encoding="utf-8")
+
+        if fresh and seed_from:
+            n = 0
+            for row in _seed_rows(Path(seed_from)):
+                for col in SEED_COLUMNS:
+                    if row.get(col):
+                        n += self.add(str(row[col]).strip(), kind=col)
+            if n:
+                log.info(f"[seen] Nạp {n} URL từ {seed_from}")
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __contains__(self, url) -> bool:
+        return bool(url) and url in self._urls
+
+    def add(self, url: str, kind: str = "post_url") -> int:
+        """Thêm 1 URL; trả về 1 nếu là URL mới, 0 nếu đã có."""
+        if not url:
+            return 0
+        with self._lock:
+            if url in self._urls:
+                return 0
+            self._urls.add(url)
+            self._f.write(f"{kind}\t{url}\n")
+            self._f.flush()
+            return 1
+
+    def all_seen(self, urls) -> bool:
+        urls = [u for u in urls if u]
+        return bool(urls) and all(u in self._urls for u in urls)
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()